@@ -0,0 +1,211 @@
+"""Rolling-window attendance analytics over per-day bitmaps.
+
+Every member has one Python int per flag (responded, yes, yes_later, no,
+on LOA) in which bit i is day EPOCH + i. A member's last response of a
+day wins. Turf days are the union of everyone's responded bits, so a
+window query is a handful of and/shift/bit_count operations per member
+regardless of how much history there is.
+
+Rolling attendance is yes days over turf days in the window, leaving out
+days the member was on LOA. Streaks count consecutive turf days answered
+yes, skipping LOA days; today only counts once the member has answered.
+
+LOA days come from the LOA index's intervals, current and ended, so a
+member on leave who never answers is still covered and the bitmaps
+rebuild the same way after a restart.
+"""
+from datetime import date
+
+from records import Availability
+
+
+EPOCH = date(2020, 1, 1).toordinal()
+WINDOWS = (7, 30, 90)
+
+
+def _bit(day):
+    return day.toordinal() - EPOCH
+
+
+def _window(end_bit, days):
+    # Mask of the `days` days ending at (and including) end_bit
+    start = max(end_bit - days + 1, 0)
+    return ((1 << (end_bit - start + 1)) - 1) << start
+
+
+def _span(start, end):
+    # Mask of the days start..end (dates), clipped to EPOCH
+    first, last = max(_bit(start), 0), _bit(end)
+    if last < first:
+        return 0
+    return ((1 << (last - first + 1)) - 1) << first
+
+
+class MemberBits:
+    __slots__ = ("responded", "yes", "yes_later", "no", "loa")
+
+    def __init__(self):
+        self.responded = 0
+        self.yes = 0
+        self.yes_later = 0
+        self.no = 0
+        self.loa = 0
+
+
+class AttendanceBitmaps:
+
+    def __init__(self):
+        self.members = {}
+        self.turf_days = 0
+        # uid -> [(start, end)] of LOAs, and the mask they cover
+        self.leaves = {}
+        self.leave_masks = {}
+
+    def add(self, uid, entry):
+        # entry: a records.HistoryRecord
+        bit = entry.day - EPOCH
+        if bit < 0:
+            return
+        flag = 1 << bit
+        bits = self.members.get(uid)
+        if bits is None:
+            bits = self.members[uid] = MemberBits()
+            bits.loa = self.leave_masks.get(uid, 0)
+        bits.responded |= flag
+        bits.yes &= ~flag
+        bits.yes_later &= ~flag
+        bits.no &= ~flag
+        available = entry.available
+        if available is Availability.YES:
+            bits.yes |= flag
+        elif available is Availability.YES_LATER:
+            bits.yes_later |= flag
+        elif available is Availability.NO:
+            bits.no |= flag
+        self.turf_days |= flag
+
+    def remove_user(self, uid):
+        # Turf days stay: they were still held for everyone else
+        self.members.pop(uid, None)
+        self.leaves.pop(uid, None)
+        self.leave_masks.pop(uid, None)
+
+    def clear(self):
+        self.members = {}
+        self.turf_days = 0
+        self.leaves = {}
+        self.leave_masks = {}
+
+    # --- LOA intervals (reported by loa_index.LOAIndex) ----------------
+
+    def _refresh_leaves(self, uid):
+        mask = 0
+        for start, end in self.leaves.get(uid, ()):
+            mask |= _span(start, end)
+        if mask:
+            self.leave_masks[uid] = mask
+        else:
+            self.leaves.pop(uid, None)
+            self.leave_masks.pop(uid, None)
+        bits = self.members.get(uid)
+        if bits is None:
+            if not mask:
+                return
+            bits = self.members[uid] = MemberBits()
+        elif not (mask or bits.responded):
+            # Only ever here for an LOA
+            del self.members[uid]
+            return
+        bits.loa = mask
+
+    def add_loa(self, uid, entry):
+        self.leaves.setdefault(uid, []).append((entry.start, entry.end))
+        self._refresh_leaves(uid)
+
+    def remove_loa(self, uid, entry):
+        # Only for LOAs withdrawn; ended ones keep their days
+        leaves = self.leaves.get(uid, [])
+        if (entry.start, entry.end) in leaves:
+            leaves.remove((entry.start, entry.end))
+            self._refresh_leaves(uid)
+
+    def clear_loas(self):
+        for uid in list(self.leaves):
+            self.leaves.pop(uid)
+            self._refresh_leaves(uid)
+
+    # --- queries -------------------------------------------------------
+
+    def window(self, uid, today, days, offset=0):
+        # (yes days, counted turf days) for the `days` days ending `offset`
+        # days before today
+        bits = self.members.get(uid)
+        end = _bit(today) - offset
+        if bits is None or end < 0:
+            return 0, 0
+        counted = self.turf_days & _window(end, days) & ~bits.loa
+        return (bits.yes & counted).bit_count(), counted.bit_count()
+
+    def rate(self, uid, today, days, offset=0):
+        # Percent attendance in the window, or None without turf days
+        yes, counted = self.window(uid, today, days, offset)
+        return yes / counted * 100 if counted else None
+
+    def _hits_and_misses(self, bits, today):
+        end = _bit(today)
+        counted = self.turf_days & ~bits.loa & ((1 << (end + 1)) - 1)
+        hits = bits.yes & counted
+        # Today is not a miss until the day is over
+        misses = counted & ~bits.yes & ~(1 << end)
+        return hits, misses
+
+    def current_streak(self, uid, today):
+        bits = self.members.get(uid)
+        if bits is None or _bit(today) < 0:
+            return 0
+        hits, misses = self._hits_and_misses(bits, today)
+        return (hits >> misses.bit_length()).bit_count()
+
+    def longest_streak(self, uid, today):
+        bits = self.members.get(uid)
+        if bits is None or _bit(today) < 0:
+            return 0
+        hits, misses = self._hits_and_misses(bits, today)
+        best, start = 0, 0
+        while misses:
+            low = misses & -misses
+            miss = low.bit_length() - 1
+            run = (hits >> start) & ((1 << (miss - start)) - 1)
+            best = max(best, run.bit_count())
+            start = miss + 1
+            misses ^= low
+        return max(best, (hits >> start).bit_count())
+
+    def trend(self, uid, today):
+        # Change in weekly attendance points, this week vs the one before
+        this_week = self.rate(uid, today, 7)
+        last_week = self.rate(uid, today, 7, offset=7)
+        if this_week is None or last_week is None:
+            return None
+        return this_week - last_week
+
+    def roster_rate(self, today, days, offset=0):
+        end = _bit(today) - offset
+        if end < 0:
+            return None
+        held = self.turf_days & _window(end, days)
+        yes = counted = 0
+        for bits in self.members.values():
+            if not bits.responded & held:
+                continue
+            mask = held & ~bits.loa
+            yes += (bits.yes & mask).bit_count()
+            counted += mask.bit_count()
+        return yes / counted * 100 if counted else None
+
+    def active(self, today, days):
+        # Members who answered at least once in the window
+        mask = _window(_bit(today), days) if _bit(today) >= 0 else 0
+        return [
+            uid for uid, bits in self.members.items() if bits.responded & mask
+        ]
@@ -0,0 +1,156 @@
+"""Daily response archives, rolled up into compressed monthly packs.
+
+The current month is kept as one archive/YYYY-MM-DD.json per day.
+Finished months are packed into archive/YYYY-MM.pack: each day is a
+separately zlib-compressed JSON blob, followed by a small JSON index of
+day -> (offset, length) and the index's own offset in the last 8 bytes.
+Reading a day from a pack is one seek and one decompress, and a range
+query only opens the months it overlaps. A pack is written atomically
+before its daily files are removed; if both exist the daily file wins.
+"""
+import json
+import os
+import struct
+import zlib
+
+from metrics import file_label, storage_seconds
+from persistence import write_bytes_atomic
+
+
+DAY_SUFFIX = ".json"
+PACK_SUFFIX = ".pack"
+TRAILER = struct.Struct(">Q")
+
+
+class ArchiveStore:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._indexes = {}
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def day_path(self, day):
+        return os.path.join(self.folder, f"{day}{DAY_SUFFIX}")
+
+    def _pack_path(self, month):
+        return os.path.join(self.folder, f"{month}{PACK_SUFFIX}")
+
+    def _listing(self):
+        days, packs = [], []
+        for name in os.listdir(self.folder):
+            if name.endswith(DAY_SUFFIX):
+                days.append(name[:-len(DAY_SUFFIX)])
+            elif name.endswith(PACK_SUFFIX):
+                packs.append(name[:-len(PACK_SUFFIX)])
+        return days, packs
+
+    # --- reading -------------------------------------------------------
+
+    def _index(self, month):
+        index = self._indexes.get(month)
+        if index is None:
+            path = self._pack_path(month)
+            if not os.path.exists(path):
+                return {}
+            with open(path, 'rb') as f:
+                f.seek(-TRAILER.size, os.SEEK_END)
+                end = f.tell()
+                start, = TRAILER.unpack(f.read(TRAILER.size))
+                f.seek(start)
+                index = json.loads(f.read(end - start))
+            self._indexes[month] = index
+        return index
+
+    def _read_packed(self, f, span):
+        offset, length = span
+        f.seek(offset)
+        return json.loads(zlib.decompress(f.read(length)))
+
+    def load(self, day):
+        path = self.day_path(day)
+        if os.path.exists(path):
+            with storage_seconds.time(op="load", file=file_label(path)):
+                with open(path, 'r') as f:
+                    return json.load(f)
+        span = self._index(day[:7]).get(day)
+        if span is None:
+            return {}
+        with open(self._pack_path(day[:7]), 'rb') as f:
+            return self._read_packed(f, span)
+
+    def days(self):
+        days, packs = self._listing()
+        found = set(days)
+        for month in packs:
+            found.update(self._index(month))
+        return sorted(found)
+
+    def range(self, start, end):
+        # Yields (day, responses) for start <= day <= end (ISO strings)
+        days, packs = self._listing()
+        loose = {day for day in days if start <= day <= end}
+        months = sorted({day[:7] for day in loose} | {
+            month for month in packs if start[:7] <= month <= end[:7]
+        })
+        for month in months:
+            packed = {
+                day: span
+                for day, span in self._index(month).items()
+                if start <= day <= end and day not in loose
+            }
+            wanted = sorted(set(packed) | {d for d in loose if d[:7] == month})
+            if not wanted:
+                continue
+            pack = open(self._pack_path(month), 'rb') if packed else None
+            try:
+                for day in wanted:
+                    if day in packed:
+                        yield day, self._read_packed(pack, packed[day])
+                    else:
+                        yield day, self.load(day)
+            finally:
+                if pack:
+                    pack.close()
+
+    # --- packing -------------------------------------------------------
+
+    def unpacked_months(self, before):
+        # Months (YYYY-MM) older than `before` that still have daily files
+        days, _ = self._listing()
+        return sorted({day[:7] for day in days if day[:7] < before})
+
+    def pack_month(self, month):
+        days, _ = self._listing()
+        loose = sorted(day for day in days if day[:7] == month)
+        merged = {}
+        index = self._index(month)
+        if index:
+            with open(self._pack_path(month), 'rb') as f:
+                for day, span in index.items():
+                    merged[day] = self._read_packed(f, span)
+        for day in loose:
+            merged[day] = self.load(day)
+
+        blobs, new_index, offset = [], {}, 0
+        for day in sorted(merged):
+            blob = zlib.compress(
+                json.dumps(merged[day], separators=(",", ":")).encode(), 9)
+            new_index[day] = [offset, len(blob)]
+            blobs.append(blob)
+            offset += len(blob)
+        blobs.append(json.dumps(new_index, separators=(",", ":")).encode())
+        blobs.append(TRAILER.pack(offset))
+        write_bytes_atomic(self._pack_path(month), b"".join(blobs))
+        self._indexes[month] = new_index
+        for day in loose:
+            try:
+                os.remove(self.day_path(day))
+            except FileNotFoundError:
+                pass
+        return len(loose)
+
+    def clear(self):
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+        self._indexes = {}
@@ -0,0 +1,311 @@
+"""Microbenchmarks for the storage and rendering hot paths.
+
+Each scenario runs in its own subprocess inside a temp directory seeded
+with synthetic history.json / loas.json data, and drives main.py through
+a fake bot/channel stand-in, so no network or token is needed.
+
+    python benchmarks/hotpaths.py                     # full grid
+    python benchmarks/hotpaths.py --quick             # skip 1M entries
+    python benchmarks/hotpaths.py --compare benchmarks/results/abc123.json
+
+Results are written to benchmarks/results/<commit>.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+HISTORY_SIZES = [100, 10_000, 1_000_000]
+LOA_SIZES = [10, 100, 1_000, 10_000]
+DEFAULT_LOAS = 1_000
+DEFAULT_HISTORY = 10_000
+MIN_SECONDS = 0.5
+
+REASONS = ["work", "school", "sick", "holiday", "family", "no internet",
+           "banned", "dr appointment", "gym", "sleeping"]
+
+
+# --- synthetic data ----------------------------------------------------
+
+def roster_size(history_size):
+    return max(10, history_size // 100)
+
+
+def user_id(i):
+    return str(100000000000000000 + i)
+
+
+def make_history(size, rng):
+    users = roster_size(size)
+    per_user = size // users
+    start = date(2024, 1, 1)
+    history = {}
+    for u in range(users):
+        entries = []
+        for d in range(per_user):
+            roll = rng.random()
+            if roll < 0.7:
+                available, reason = "yes", ""
+            elif roll < 0.8:
+                available, reason = "yes_later", ""
+            else:
+                available, reason = "no", rng.choice(REASONS)
+            entries.append({
+                "date": (start + timedelta(days=d)).isoformat(),
+                "available": available,
+                "reason": reason,
+                "time": f"{rng.randrange(24):02d}:{rng.randrange(60):02d}:00"
+            })
+        history[user_id(u)] = entries
+    return history
+
+
+def make_loas(size, users, rng):
+    today = date.today()
+    loas = {}
+    pool = max(users, size // 2)
+    for _ in range(size):
+        start = today + timedelta(days=rng.randrange(-5, 10))
+        end = start + timedelta(days=rng.randrange(0, 30))
+        loas.setdefault(user_id(rng.randrange(pool)), []).append({
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "reason": rng.choice(REASONS)
+        })
+    return loas
+
+
+# --- fake discord stand-ins --------------------------------------------
+
+class FakeMessage:
+    _next_id = 1
+
+    def __init__(self, content=None):
+        FakeMessage._next_id += 1
+        self.id = FakeMessage._next_id
+        self.content = content
+
+    async def edit(self, content=None, view=None):
+        self.content = content
+
+    async def delete(self):
+        pass
+
+
+class FakeMember:
+
+    def __init__(self, uid):
+        self.id = int(uid)
+        self.display_name = f"Member {uid[-4:]}"
+        self.bot = False
+
+
+class FakeGuild:
+
+    def get_member(self, uid):
+        return FakeMember(str(uid))
+
+
+class FakeChannel:
+
+    def __init__(self):
+        self.id = 1
+        self.guild = FakeGuild()
+        self.name = "bench"
+        self.messages = {}
+
+    async def send(self, content=None, view=None):
+        msg = FakeMessage(content)
+        self.messages[msg.id] = msg
+        return msg
+
+    def get_partial_message(self, message_id):
+        return self.messages.setdefault(message_id, FakeMessage())
+
+    async def purge(self, limit=100, check=None):
+        return []
+
+
+class FakeUser:
+
+    def __init__(self, uid):
+        self.id = int(uid)
+        self.display_name = f"Member {uid[-4:]}"
+
+
+# --- timing ------------------------------------------------------------
+
+def measure(fn, min_seconds=MIN_SECONDS):
+    # Repeat fn until min_seconds elapsed; returns ops/sec and peak bytes
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    ops = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_seconds:
+        fn()
+        ops += 1
+        elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - before
+    return {"ops_per_sec": ops / elapsed, "ops": ops, "peak_bytes": peak}
+
+
+def run_scenario(history_size, loa_size):
+    # The bot reads and writes its files in the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="turfbench-") as workdir:
+        os.chdir(workdir)
+        try:
+            return _run_in(history_size, loa_size)
+        finally:
+            os.chdir(cwd)
+
+
+def _run_in(history_size, loa_size):
+    rng = random.Random(42)
+    with open("history.json", "w") as f:
+        json.dump(make_history(history_size, rng), f)
+    users = roster_size(history_size)
+    with open("loas.json", "w") as f:
+        json.dump(make_loas(loa_size, users, rng), f)
+
+    sys.path.insert(0, ROOT)
+    tracemalloc.start()
+    import main
+
+    channel = FakeChannel()
+    main.bot.get_channel = lambda channel_id: channel
+    # Measure the bot's own work, not Discord's rate limits
+    main.outbox = main.Outbox(channel_capacity=10**9, global_capacity=10**9)
+    results = {}
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    start = time.perf_counter()
+    state = loop.run_until_complete(main.guilds.get(main.HOME_GUILD_ID))
+    results["load_all"] = {
+        "seconds": time.perf_counter() - start,
+        # Python allocations still live after the load, not process RSS
+        "traced_bytes": tracemalloc.get_traced_memory()[0]
+    }
+    for i in range(max(users, loa_size)):
+        member = FakeMember(user_id(i))
+        state.members.set(member.id, member.display_name)
+
+    today = date.today()
+    uids = [user_id(i) for i in range(users)]
+    answers = [("yes", ""), ("yes_later", "later"), ("no", "busy")]
+    counter = iter(range(10**12))
+
+    def record_response():
+        i = next(counter)
+        available, reason = answers[i % len(answers)]
+        loop.run_until_complete(
+            main.record_response(state, FakeUser(uids[i % users]), available,
+                                 reason))
+
+    def is_on_loa():
+        state.loa_index.is_on_loa(uids[next(counter) % users], today)
+
+    def summary_text():
+        state.summary_board.render(today)
+
+    def leaderboard():
+        [(uid, s.percent, s.total) for uid, s in state.attendance.top(5)]
+
+    def loa_list():
+        loop.run_until_complete(main.update_loa_list(state))
+
+    for name, fn in (("record_response", record_response),
+                     ("is_on_loa", is_on_loa), ("summary_text", summary_text),
+                     ("leaderboard", leaderboard), ("update_loa_list",
+                                                    loa_list)):
+        results[name] = measure(fn)
+    loop.run_until_complete(state.storage.flush())
+    return results
+
+
+# --- driver ------------------------------------------------------------
+
+def scenarios(quick):
+    history_sizes = [s for s in HISTORY_SIZES if not quick or s < 1_000_000]
+    grid = [(h, DEFAULT_LOAS) for h in history_sizes]
+    grid += [(DEFAULT_HISTORY, l) for l in LOA_SIZES if l != DEFAULT_LOAS]
+    return grid
+
+
+def commit_label():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            text=True).strip()
+    except Exception:
+        return time.strftime("%Y%m%d-%H%M%S")
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["scenarios"]
+    print(f"\nCompared with {baseline_path} (ops/sec ratio, >1 is faster):")
+    for key, benches in current.items():
+        for name, result in benches.items():
+            old = baseline.get(key, {}).get(name, {})
+            if "ops_per_sec" in result and old.get("ops_per_sec"):
+                ratio = result["ops_per_sec"] / old["ops_per_sec"]
+                flag = "  <-- regression" if ratio < 0.8 else ""
+                print(f"  {key:28} {name:18} x{ratio:6.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true",
+                        help="skip the 1M-entry history scenario")
+    parser.add_argument("--compare", help="earlier results file to diff")
+    parser.add_argument("--output", help="results file to write")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        history_size, loa_size = map(int, args.scenario.split(","))
+        print(json.dumps(run_scenario(history_size, loa_size)))
+        return
+
+    results = {}
+    for history_size, loa_size in scenarios(args.quick):
+        key = f"history={history_size},loas={loa_size}"
+        out = subprocess.run(
+            [sys.executable, __file__, "--scenario",
+             f"{history_size},{loa_size}"],
+            capture_output=True, text=True, check=True).stdout
+        results[key] = json.loads(out.strip().splitlines()[-1])
+        print(key)
+        for name, result in results[key].items():
+            if "ops_per_sec" in result:
+                print(f"  {name:18} {result['ops_per_sec']:>12,.0f} ops/s"
+                      f"  peak {result['peak_bytes'] / 1024:>9,.1f} KiB")
+            else:
+                print(f"  {name:18} {result['seconds']:>12.3f} s"
+                      f"  traced {result['traced_bytes'] / 2**20:>7,.1f} MiB")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit_label()}.json")
+    with open(output, "w") as f:
+        json.dump({"commit": commit_label(), "scenarios": results}, f,
+                  indent=2)
+    print(f"\nSaved {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""Streaming export and import of history, LOAs and archived days.
+
+Rows share one flat schema (FIELDS) so every kind fits in a single CSV
+or JSONL stream, gzip-compressed on export. Rows are produced and
+consumed one at a time, and imports are applied in fixed-size batches,
+each as one mutation on the guild's queue, so memory use does not grow
+with the size of the data. Importing is an upsert: history rows already
+present (same member, day, time and answer), identical LOAs and
+unchanged archive records are skipped.
+
+    python bulk.py export out.jsonl.gz [--guild ID] [--kinds history,loas]
+                   [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--member ID]
+    python bulk.py import in.csv.gz [--guild ID]
+
+The command line works on the data files directly, so it refuses to run
+while the bot holds its lock; with the bot up, use /export and /import.
+Export only reads: it skips the LOA sweep and session restore that
+loading a guild for the bot does.
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import sys
+from collections import OrderedDict
+from datetime import date
+
+from guilds import GuildState
+from loa_index import LOAIndex
+from records import Availability, HistoryRecord, parse_availability
+from storage import HOME_GUILD_ID, open_guild_storage, refuse_if_bot_running
+
+
+FIELDS = ("type", "uid", "date", "end", "available", "reason", "time", "name")
+KINDS = ("history", "loas", "archive")
+FORMATS = ("jsonl", "csv")
+GZIP_MAGIC = b"\x1f\x8b"
+BATCH_SIZE = 500
+MAX_REASON = 500
+# Members whose existing history keys, and archive days whose merged
+# records, are kept while importing
+HISTORY_KEY_CACHE = 64
+ARCHIVE_DAY_CACHE = 64
+
+
+# --- export ------------------------------------------------------------
+
+
+def export_rows(storage, loa_index, kinds=KINDS, start=None, end=None,
+                uid=None, available=None):
+    # Yields row dicts for one guild, filtered by ISO date range, member
+    # and availability
+    start = start or date.min.isoformat()
+    end = end or date.max.isoformat()
+    if "history" in kinds:
+        for row_uid, entry in storage.history_range(start, end, uid):
+            if available and entry.available.value != available:
+                continue
+            yield {
+                "type": "history",
+                "uid": row_uid,
+                "date": entry.date.isoformat(),
+                "available": entry.available.value,
+                "reason": entry.reason,
+                "time": entry.time
+            }
+    if "loas" in kinds and not available:
+        for row_uid, user in list(loa_index.users.items()):
+            if uid is not None and row_uid != uid:
+                continue
+            for entry in list(user.entries):
+                if entry.end.isoformat() < start or entry.start.isoformat() > end:
+                    continue
+                yield {
+                    "type": "loas",
+                    "uid": row_uid,
+                    "date": entry.start.isoformat(),
+                    "end": entry.end.isoformat(),
+                    "reason": entry.reason
+                }
+    if "archive" in kinds:
+        for day, row_uid, record in storage.archive_range(
+                start, end, uid=uid, available=available):
+            yield {
+                "type": "archive",
+                "uid": row_uid,
+                "date": day,
+                "available": record.get("available", ""),
+                "reason": record.get("reason", ""),
+                "name": record.get("name", "")
+            }
+
+
+class RowWriter:
+    """Writes rows to a binary file object as gzip-compressed CSV/JSONL."""
+
+    def __init__(self, fileobj, fmt="jsonl"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt}")
+        self.fmt = fmt
+        self.gzip = gzip.GzipFile(fileobj=fileobj, mode="wb")
+        self.text = io.TextIOWrapper(self.gzip, encoding="utf-8",
+                                     newline="")
+        self.csv = None
+        if fmt == "csv":
+            self.csv = csv.DictWriter(self.text, FIELDS, restval="")
+            self.csv.writeheader()
+        self.count = 0
+
+    def write(self, row):
+        if self.csv:
+            self.csv.writerow(row)
+        else:
+            self.text.write(json.dumps(row, separators=(",", ":")) + "\n")
+        self.count += 1
+
+    def close(self):
+        # Leaves the underlying file object open for the caller
+        self.text.flush()
+        self.text.detach()
+        self.gzip.close()
+
+
+# --- import ------------------------------------------------------------
+
+
+def read_rows(fileobj, fmt=None):
+    # Yields row dicts from a binary file object, gzip or plain; the
+    # format is sniffed from the first byte when not given
+    if fileobj.read(2) == GZIP_MAGIC:
+        fileobj.seek(0)
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    fileobj.seek(0)
+    if fmt is None:
+        fmt = "jsonl" if fileobj.read(1) in (b"{", b"") else "csv"
+        fileobj.seek(0)
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield {"_error": "not valid JSON"}
+
+
+def _seconds(text):
+    # "HH:MM[:SS]" -> seconds since midnight; empty means unknown (0)
+    if not text:
+        return 0
+    parts = text.split(":")
+    if not 2 <= len(parts) <= 3 or not all(p.isdigit() for p in parts):
+        raise ValueError("time must be HH:MM:SS")
+    parts += ["0"] * (3 - len(parts))
+    hours, minutes, seconds = (int(p) for p in parts)
+    if hours > 23 or minutes > 59 or seconds > 59:
+        raise ValueError("time must be HH:MM:SS")
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def _day(value, field):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be YYYY-MM-DD")
+
+
+def validate(row):
+    # Returns (kind, uid, payload) or raises ValueError
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    if row.get("_error"):
+        raise ValueError(row["_error"])
+    kind = row.get("type")
+    if kind not in KINDS:
+        raise ValueError(f"type must be one of {', '.join(KINDS)}")
+    uid = str(row.get("uid") or "")
+    if not uid.isdigit():
+        raise ValueError("uid must be a Discord user ID")
+    reason = (row.get("reason") or "").strip()
+    if len(reason) > MAX_REASON:
+        raise ValueError(f"reason is longer than {MAX_REASON} characters")
+    day = _day(row.get("date"), "date")
+    if kind == "loas":
+        end = _day(row.get("end"), "end")
+        if end < day:
+            raise ValueError("end is before date")
+        return kind, uid, (day, end, reason)
+    available = parse_availability(row.get("available") or "")
+    if available is None:
+        raise ValueError("available must be yes, yes_later or no")
+    if kind == "history":
+        return kind, uid, HistoryRecord(day.toordinal(), available, reason,
+                                        _seconds(row.get("time") or ""))
+    name = (row.get("name") or "").strip() or f"User ID {uid}"
+    return kind, uid, (day, {
+        "name": name,
+        "available": available.value,
+        "reason": reason
+    })
+
+
+class Importer:
+    """Validates rows and applies them to a guild in batches."""
+
+    def __init__(self, state, max_errors=10):
+        self.state = state
+        self.max_errors = max_errors
+        self.counts = {kind: 0 for kind in KINDS}
+        self.skipped = 0
+        self.invalid = 0
+        self.errors = []
+        self.rows = 0
+        self._history_keys = OrderedDict()
+        # Archive saves can still be queued when the next batch reads the
+        # same day back, so days written here are served from memory
+        self._archive_days = OrderedDict()
+
+    def parse(self, rows):
+        # Yields validated (kind, uid, payload) tuples, recording errors
+        for row in rows:
+            self.rows += 1
+            try:
+                yield validate(row)
+            except ValueError as e:
+                self.invalid += 1
+                if len(self.errors) < self.max_errors:
+                    self.errors.append(f"row {self.rows}: {e}")
+
+    def batches(self, rows, size=BATCH_SIZE):
+        batch = []
+        for item in self.parse(rows):
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _known_history(self, uid):
+        keys = self._history_keys.get(uid)
+        if keys is None:
+            keys = {(e.day, e.seconds, e.available)
+                    for e in self.state.storage.history_for(uid)}
+            self._history_keys[uid] = keys
+            if len(self._history_keys) > HISTORY_KEY_CACHE:
+                self._history_keys.popitem(last=False)
+        else:
+            self._history_keys.move_to_end(uid)
+        return keys
+
+    def _archive_day(self, day):
+        responses = self._archive_days.get(day)
+        if responses is None:
+            responses = dict(self.state.storage.load_archive(day))
+            self._archive_days[day] = responses
+            if len(self._archive_days) > ARCHIVE_DAY_CACHE:
+                self._archive_days.popitem(last=False)
+        else:
+            self._archive_days.move_to_end(day)
+        return responses
+
+    def apply(self, batch):
+        # Runs as one mutation, inside one storage batch
+        state = self.state
+        changed = {}
+        for kind, uid, payload in batch:
+            if kind == "history":
+                keys = self._known_history(uid)
+                key = (payload.day, payload.seconds, payload.available)
+                if key in keys:
+                    self.skipped += 1
+                    continue
+                keys.add(key)
+                state.add_history(uid, payload)
+            elif kind == "loas":
+                start, end, reason = payload
+                entries = state.loa_index.entries_for(uid)
+                if (start, end, reason) in entries:
+                    self.skipped += 1
+                    continue
+                # Same dates with another reason: the imported row wins
+                for i in reversed(range(len(entries))):
+                    if entries[i][:2] == (start, end):
+                        state.loa_index.remove_at(uid, i)
+                state.loa_index.add(uid, start, end, reason)
+            else:
+                day, record = payload
+                day = day.isoformat()
+                responses = self._archive_day(day)
+                if responses.get(uid) == record:
+                    self.skipped += 1
+                    continue
+                responses[uid] = record
+                changed[day] = responses
+            self.counts[kind] += 1
+        for day, responses in changed.items():
+            state.storage.save_archive(day, responses)
+
+    def summary(self):
+        done = ", ".join(f"{n} {kind}" for kind, n in self.counts.items())
+        text = (f"Imported {done}; skipped {self.skipped} already present, "
+                f"{self.invalid} invalid.")
+        if self.errors:
+            text += "\n" + "\n".join(self.errors)
+        return text
+
+
+# --- command line --------------------------------------------------------
+
+
+def export_file(args):
+    storage = open_guild_storage(args.guild or HOME_GUILD_ID)
+    storage.load_history(None, writable=False)
+    loa_index = LOAIndex(storage)
+    loa_index.load()
+    fmt = args.format or ("csv" if ".csv" in args.path else "jsonl")
+    with open(args.path, "wb") as f:
+        writer = RowWriter(f, fmt)
+        for row in export_rows(storage, loa_index, args.kinds.split(","),
+                               args.start, args.end, args.member,
+                               args.available):
+            writer.write(row)
+        writer.close()
+    print(f"Exported {writer.count} rows to {args.path}")
+
+
+async def import_file(args):
+    # Loaded as the bot would load it, so stats and indexes stay in step
+    guild_id = args.guild or HOME_GUILD_ID
+    state = GuildState(guild_id, open_guild_storage(guild_id), {}, 0)
+    await state.mutations.submit(state.load, date.today())
+    importer = Importer(state)
+    with open(args.path, "rb") as f:
+        for batch in importer.batches(read_rows(f, args.format)):
+            await state.mutations.submit(importer.apply, batch)
+            # Duplicate checks read storage, so earlier batches must land
+            await state.storage.flush()
+    print(importer.summary())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("action", choices=("export", "import"))
+    parser.add_argument("path")
+    parser.add_argument("--guild", type=int, default=None,
+                        help="Guild ID (default: the home guild)")
+    parser.add_argument("--kinds", default=",".join(KINDS))
+    parser.add_argument("--format", choices=FORMATS, default=None)
+    parser.add_argument("--start", help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", help="Last day, YYYY-MM-DD")
+    parser.add_argument("--member", help="Member ID")
+    parser.add_argument("--available",
+                        choices=[a.value for a in Availability
+                                 if a is not Availability.UNKNOWN])
+    args = parser.parse_args(argv)
+    refuse_if_bot_running()
+    if args.action == "export":
+        export_file(args)
+    else:
+        asyncio.run(import_file(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
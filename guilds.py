@@ -0,0 +1,238 @@
+"""Per-guild bot state, partitioned by guild ID and loaded on first use.
+
+Each guild has its own storage engine, responses, summary, LOA index,
+attendance stats and bitmaps, reason index, tracked messages and
+mutation queue. peek() reads a guild's settings only, so the scheduler
+can resolve announcement times, while get() also loads history and LOAs
+the first time the guild is actually used.
+"""
+import asyncio
+from datetime import date, timedelta
+
+from analytics import AttendanceBitmaps
+from loa_board import LOABoard
+from loa_index import LOAIndex
+from member_names import MemberNames
+from message_registry import MessageRegistry
+from mutations import MutationQueue
+from reason_index import RESPONSE, ReasonIndex
+from records import (LOA_REASON, Availability, HistoryRecord, Response,
+                     parse_availability, parse_time)
+from stats import AttendanceStats
+from summary import SummaryBoard
+
+
+class GuildState:
+
+    def __init__(self, guild_id, storage, settings, min_responses):
+        self.guild_id = guild_id
+        self.storage = storage
+        self.settings = settings
+        self.settings.update(storage.load_settings({}))
+        self.responses = {}
+        self.summary_board = SummaryBoard()
+        self.attendance = AttendanceStats(min_responses)
+        self.analytics = AttendanceBitmaps()
+        self.reasons = ReasonIndex()
+        self.loa_index = LOAIndex(storage, self.reasons, self.analytics)
+        self.tracked = MessageRegistry(storage)
+        self.loa_board = LOABoard()
+        self.members = MemberNames(storage)
+        # purpose -> content hash of each posted page
+        self.page_hashes = {}
+        self.mutations = MutationQueue(storage)
+        self.loaded = False
+        # Day of the live turf session, restored from storage on load
+        self.session_day = None
+        # Summary message coalescing
+        self.summary_last_content = None
+        self.summary_dirty = False
+        self.summary_task = None
+        self.summary_lock = asyncio.Lock()
+
+    # The methods below mutate state and run on self.mutations
+
+    def load(self, today):
+        if self.loaded:
+            return
+        self.storage.load_history(self.attendance)
+        self.analytics.clear()
+        self.reasons.clear()
+        for uid, entry in self.storage.history_rows():
+            self.analytics.add(uid, entry)
+            self.reasons.add_response(uid, entry)
+        self.tracked.load()
+        self.members.load()
+        self.loa_index.load()
+        self.loa_index.sweep(today)
+        self.restore_session(today)
+        self.loaded = True
+
+    def restore_session(self, today):
+        # Picks today's responses back up after a restart. A session left
+        # over from an earlier day was never archived, so archive it now
+        self.responses.clear()
+        self.summary_board.clear()
+        day, saved = self.storage.load_session()
+        for uid, data in saved.items():
+            response = self.responses[uid] = Response(
+                data["name"],
+                parse_availability(data["available"]) or Availability.UNKNOWN,
+                data["reason"])
+            self._show(uid, response)
+        self.session_day = date.fromisoformat(day) if day else None
+        if self.session_day and self.session_day < today:
+            if self.responses:
+                self.archive(self.session_day)
+            self.clear_responses()
+
+    def clear_responses(self, day=None):
+        # day starts a new, empty session; None ends the current one
+        self.responses.clear()
+        self.summary_board.clear()
+        self.session_day = day
+        self.storage.session_clear(day.isoformat() if day else None)
+
+    def archive(self, day):
+        self.storage.save_archive(day.isoformat(), {
+            uid: response.to_json()
+            for uid, response in self.responses.items()
+        })
+
+    def close_day(self, today):
+        # Archived under the session's own day, as restore_session does;
+        # the job runs just after midnight, so without one that is the
+        # day that just ended
+        self.archive(self.session_day or today - timedelta(days=1))
+        self.clear_responses()
+
+    def apply_retention(self, today):
+        # Rolls up raw history older than history_raw_days and drops daily
+        # final states older than history_daily_days (None keeps them)
+        raw_days = self.settings.get("history_raw_days")
+        if not raw_days:
+            return 0
+        daily_days = self.settings.get("history_daily_days")
+        raw_before = today - timedelta(days=raw_days)
+        daily_before = (today - timedelta(days=daily_days)
+                        if daily_days else date.min)
+        return self.storage.roll_up_history(raw_before.isoformat(),
+                                            daily_before.isoformat())
+
+    def update_settings(self, changes):
+        self.settings.update(changes)
+        self.storage.save_settings(self.settings)
+
+    def apply_response(self, uid, name, availability, reason, today,
+                       timestamp):
+        # Returns True if a 1-day LOA was added
+        loa_added = False
+        if self.loa_index.is_on_loa(uid, today):
+            # Auto set no if user on LOA today
+            reason = LOA_REASON
+            availability = Availability.NO
+        else:
+            availability = (parse_availability(availability)
+                            or Availability.UNKNOWN)
+            reason = reason.strip() if availability is Availability.NO else ""
+
+        # Automatically add 1-day LOA if user responds 'no'
+        if availability is Availability.NO and reason:
+            if not self.loa_index.is_on_loa(uid, today):
+                self.loa_index.add(uid, today, today, reason)
+                loa_added = True
+
+        previous = self.responses.get(uid)
+        change_note = f" (changed at {timestamp})" if (
+            previous and previous.available is Availability.YES
+            and availability is Availability.NO) else ""
+
+        # Re-inserted so responses stay in summary order
+        self.responses.pop(uid, None)
+        response = self.responses[uid] = Response(
+            name, availability,
+            reason + change_note if reason and change_note else reason)
+        self._show(uid, response)
+        self.session_day = self.session_day or today
+        self.storage.session_set(self.session_day.isoformat(), uid,
+                                 response.to_json())
+
+        entry = HistoryRecord(today.toordinal(), availability, reason,
+                              parse_time(timestamp))
+        self.add_history(uid, entry)
+        return loa_added
+
+    def add_history(self, uid, entry):
+        # Also used for bulk imports, which leave the live session alone
+        self.storage.append_history(uid, entry)
+        self.analytics.add(uid, entry)
+        self.reasons.add_response(uid, entry)
+
+    def rename_member(self, uid, name):
+        # Returns True if today's summary shows this member
+        self.members.set(uid, name)
+        response = self.responses.get(uid)
+        if response is None or response.name == name:
+            return False
+        response.name = name
+        self.responses[uid] = self.responses.pop(uid)
+        self._show(uid, response)
+        self.storage.session_set(self.session_day.isoformat(), uid,
+                                 response.to_json())
+        return True
+
+    def _show(self, uid, response):
+        self.summary_board.set(uid, response.name, response.available.value,
+                               response.reason)
+
+    def clear_all_records(self):
+        self.storage.clear_archives()
+        self.loa_index.clear()
+        self.storage.clear_history()
+        self.analytics.clear()
+        self.reasons.clear()
+        self.clear_responses(self.session_day)
+
+    def clear_member_records(self, uid):
+        self.storage.clear_history(uid)
+        self.analytics.remove_user(uid)
+        self.reasons.remove_user(uid, RESPONSE)
+        self.loa_index.remove_user(uid)
+        self.loa_index.clear_ended(uid)
+        if uid in self.responses:
+            del self.responses[uid]
+            self.summary_board.remove(uid)
+            self.storage.session_remove(uid)
+
+
+class GuildRegistry:
+
+    def __init__(self, open_storage, default_settings, min_responses, today):
+        # open_storage(guild_id) -> storage engine for that guild;
+        # default_settings(guild_id) -> fresh settings dict;
+        # today(state) -> the current date in the guild's timezone
+        self.open_storage = open_storage
+        self.default_settings = default_settings
+        self.min_responses = min_responses
+        self.today = today
+        self.states = {}
+
+    def peek(self, guild_id):
+        state = self.states.get(guild_id)
+        if state is None:
+            state = self.states[guild_id] = GuildState(
+                guild_id, self.open_storage(guild_id),
+                self.default_settings(guild_id), self.min_responses)
+        return state
+
+    async def get(self, guild_id):
+        state = self.peek(guild_id)
+        if not state.loaded:
+            await state.mutations.submit(state.load, self.today(state))
+        return state
+
+    def loaded(self):
+        return [state for state in self.states.values() if state.loaded]
+
+    def __iter__(self):
+        return iter(list(self.states.values()))
@@ -0,0 +1,359 @@
+"""Append-only, segmented JSONL journal for turf response history.
+
+Every response is appended as one compact line ([day, availability
+code, seconds, reason]) to the active segment in the journal directory.
+Compaction folds sealed segments into a snapshot named after the last
+segment it covers (base-000042.json), so a crash at any point replays
+each record exactly once. Attendance aggregates are snapshotted
+alongside (aggregates-000042.json) and kept current on every append.
+Snapshots store each member's history as the columnar arrays of
+records.UserHistory. A legacy history.json, or a snapshot of entry
+dicts, is converted on load.
+
+History is kept in three tiers. Raw responses are rolled up once they
+are older than the retention window: their exact counts are added to
+per-member monthly counters, and each day's final answer moves to a
+daily tier, which is itself dropped after a longer window. Roll-ups are
+journaled like any other change, and attendance totals always equal raw
+counts plus the monthly counters.
+"""
+import json
+import os
+
+from persistence import write_atomic
+from records import HistoryRecord, UserHistory
+from stats import UserStats
+
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl"
+BASE_PREFIX = "base-"
+BASE_SUFFIX = ".json"
+AGGREGATES_PREFIX = "aggregates-"
+SEGMENT_MAX_BYTES = 256 * 1024
+
+
+def _numbered(directory, prefix, suffix):
+    found = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix):
+            try:
+                found.append(int(name[len(prefix):-len(suffix)]))
+            except ValueError:
+                continue
+    return sorted(found)
+
+
+class HistoryStore:
+
+    def __init__(self, journal_dir, legacy_file=None, stats=None,
+                 segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.journal_dir = journal_dir
+        self.legacy_file = legacy_file
+        self.stats = stats
+        self.segment_max_bytes = segment_max_bytes
+        self.entries = {}
+        # Rolled-up tiers: uid -> UserHistory of one record per day, and
+        # uid -> {"YYYY-MM": counters in UserStats.to_json() form}
+        self.daily = {}
+        self.monthly = {}
+        self._rolled = None
+        self._segment = None
+        self._segment_index = 0
+        self._compacting = False
+        self._generation = 0
+        self.defer_flush = False
+
+    # --- loading -------------------------------------------------------
+
+    def load(self, writable=True):
+        # writable=False only reads: no legacy migration and no new
+        # journal segment, for offline tools
+        if not os.path.exists(self.journal_dir):
+            os.makedirs(self.journal_dir)
+        self.entries, self.daily, self.monthly = {}, {}, {}
+        self._rolled = None
+        bases = _numbered(self.journal_dir, BASE_PREFIX, BASE_SUFFIX)
+        through = 0
+        aggregates = None
+        if bases:
+            through = bases[-1]
+            with open(self._base_path(through), 'r') as f:
+                self._decode(json.load(f))
+            if os.path.exists(self._aggregates_path(through)):
+                with open(self._aggregates_path(through), 'r') as f:
+                    aggregates = json.load(f)
+        elif self.legacy_file and os.path.exists(self.legacy_file):
+            with open(self.legacy_file, 'r') as f:
+                self._decode(json.load(f))
+        if self.stats is not None:
+            if aggregates is None:
+                self.stats.rebuild(self.entries, self.monthly)
+            else:
+                self.stats.load_json(aggregates)
+        if writable and not bases and self.entries:
+            self.write_snapshot(self._encode(), self._stats_json(), 0)
+            os.replace(self.legacy_file, self.legacy_file + ".migrated")
+        last = through
+        for index in self.segment_indexes():
+            if index > through:
+                self._replay(self._segment_path(index))
+            last = max(last, index)
+        if writable:
+            self._open_segment(last + 1)
+
+    def _decode(self, data):
+        if "raw" not in data:
+            # Untiered snapshot or legacy history.json: raw entries only
+            data = {"raw": data}
+        self.entries = {
+            uid: UserHistory.from_json(raw)
+            for uid, raw in data["raw"].items()
+        }
+        self.daily = {
+            uid: UserHistory.from_json(raw)
+            for uid, raw in data.get("daily", {}).items()
+        }
+        self.monthly = data.get("monthly", {})
+
+    def _encode(self):
+        return {
+            "raw": {uid: h.to_json() for uid, h in self.entries.items()},
+            "daily": {uid: h.to_json() for uid, h in self.daily.items()},
+            "monthly": {
+                uid: {month: dict(counts) for month, counts in months.items()}
+                for uid, months in self.monthly.items()
+            }
+        }
+
+    def _replay(self, path):
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Cut short by a crash; load() appends to a new segment
+                    continue
+                self._apply(record)
+
+    def _apply(self, record):
+        op = record.get("op")
+        if op == "add":
+            if "r" in record:
+                entry = HistoryRecord.decode(record["r"])
+            else:
+                entry = HistoryRecord.from_entry(record["entry"])
+            self._add(record["uid"], entry)
+        elif op == "clear":
+            self.entries.pop(record["uid"], None)
+            self.daily.pop(record["uid"], None)
+            self.monthly.pop(record["uid"], None)
+            if self.stats is not None:
+                self.stats.remove_user(record["uid"])
+        elif op == "rollup":
+            self._roll_up(record["raw_before"], record["daily_before"])
+
+    def _add(self, uid, entry):
+        history = self.entries.get(uid)
+        if history is None:
+            history = self.entries[uid] = UserHistory()
+        history.append(entry)
+        if self._rolled is not None and entry.day < self._rolled[0]:
+            # A backfilled row the last roll-up did not see
+            self._rolled = None
+        if self.stats is not None:
+            self.stats.add(uid, entry)
+
+    def _stats_json(self):
+        return self.stats.to_json() if self.stats is not None else None
+
+    # --- segments ------------------------------------------------------
+
+    def _segment_path(self, index):
+        return os.path.join(self.journal_dir,
+                            f"{SEGMENT_PREFIX}{index:06d}{SEGMENT_SUFFIX}")
+
+    def _base_path(self, index):
+        return os.path.join(self.journal_dir,
+                            f"{BASE_PREFIX}{index:06d}{BASE_SUFFIX}")
+
+    def _aggregates_path(self, index):
+        return os.path.join(self.journal_dir,
+                            f"{AGGREGATES_PREFIX}{index:06d}{BASE_SUFFIX}")
+
+    def segment_indexes(self):
+        return _numbered(self.journal_dir, SEGMENT_PREFIX, SEGMENT_SUFFIX)
+
+    def sealed_segments(self):
+        return [i for i in self.segment_indexes() if i < self._segment_index]
+
+    def _open_segment(self, index):
+        if self._segment:
+            self._segment.close()
+        self._segment_index = index
+        self._segment = open(self._segment_path(index), 'a')
+
+    def _write(self, record):
+        self._segment.write(json.dumps(record, separators=(",", ":")) + "\n")
+        if not self.defer_flush:
+            self.flush()
+
+    def flush(self):
+        if not self._segment:
+            return
+        self._segment.flush()
+        if self._segment.tell() >= self.segment_max_bytes:
+            self._open_segment(self._segment_index + 1)
+
+    # --- public API ----------------------------------------------------
+
+    def append(self, uid, entry):
+        # entry: a records.HistoryRecord
+        self._add(uid, entry)
+        self._write({"op": "add", "uid": uid, "r": entry.encode()})
+
+    def entries_for(self, uid):
+        return self.entries.get(uid, ())
+
+    def items(self):
+        return self.entries.items()
+
+    def records_for(self, uid):
+        # Daily final states followed by raw responses, oldest first
+        yield from self.daily.get(uid, ())
+        yield from self.entries.get(uid, ())
+
+    def all_records(self):
+        for uid in list(set(self.daily) | set(self.entries)):
+            for record in self.records_for(uid):
+                yield uid, record
+
+    def clear_user(self, uid):
+        if (uid not in self.entries and uid not in self.daily
+                and uid not in self.monthly):
+            return
+        record = {"op": "clear", "uid": uid}
+        self._apply(record)
+        self._write(record)
+
+    def clear_all(self):
+        self.entries, self.daily, self.monthly = {}, {}, {}
+        if self.stats is not None:
+            self.stats.clear()
+        self._generation += 1
+        # Keep numbering monotonic so an in-flight compaction can never
+        # delete a segment opened after the clear
+        next_index = self._segment_index + 1
+        if self._segment:
+            self._segment.close()
+            self._segment = None
+        self._remove_files(upto=None)
+        self._open_segment(next_index)
+
+    def _remove_files(self, upto):
+        paths = [
+            self._segment_path(index) for index in self.segment_indexes()
+            if upto is None or index <= upto
+        ]
+        for prefix, path_for in ((BASE_PREFIX, self._base_path),
+                                 (AGGREGATES_PREFIX, self._aggregates_path)):
+            paths += [
+                path_for(index)
+                for index in _numbered(self.journal_dir, prefix, BASE_SUFFIX)
+                if upto is None or index < upto
+            ]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # --- retention -----------------------------------------------------
+
+    def roll_up(self, raw_before, daily_before):
+        # Day ordinals: raw responses before raw_before are rolled up and
+        # daily final states before daily_before are dropped
+        if self._rolled == (raw_before, daily_before):
+            return 0
+        moved = self._roll_up(raw_before, daily_before)
+        if moved:
+            self._write({
+                "op": "rollup",
+                "raw_before": raw_before,
+                "daily_before": daily_before
+            })
+        return moved
+
+    def _roll_up(self, raw_before, daily_before):
+        moved = 0
+        for uid, history in list(self.entries.items()):
+            older, newer = history.split(raw_before)
+            if not len(older):
+                continue
+            moved += len(older)
+            months = self.monthly.setdefault(uid, {})
+            counts = {}
+            for record in older:
+                month = record.date.isoformat()[:7]
+                stats = counts.get(month)
+                if stats is None:
+                    stats = counts[month] = UserStats.from_json(
+                        months.get(month, {}))
+                stats.add(record.available, record.reason)
+            for month, stats in counts.items():
+                months[month] = stats.to_json()
+            days = {r.day: r for r in self.daily.get(uid, ())}
+            days.update((r.day, r) for r in older.final_states())
+            self.daily[uid] = UserHistory.from_records(
+                days[day] for day in sorted(days))
+            if len(newer):
+                self.entries[uid] = newer
+            else:
+                del self.entries[uid]
+        for uid, history in list(self.daily.items()):
+            if history.days and history.days[0] < daily_before:
+                _, kept = history.split(daily_before)
+                moved += len(history) - len(kept)
+                if len(kept):
+                    self.daily[uid] = kept
+                else:
+                    del self.daily[uid]
+        self._rolled = (raw_before, daily_before)
+        return moved
+
+    # --- compaction ----------------------------------------------------
+
+    def begin_compaction(self):
+        # Seal the active segment and capture the state it closes over.
+        # Encoding copies each member's arrays, so later appends do not
+        # leak into the snapshot.
+        if self._compacting:
+            return None
+        self._compacting = True
+        self._open_segment(self._segment_index + 1)
+        snapshot = self._encode()
+        return (snapshot, self._stats_json(), self._segment_index - 1,
+                self._generation)
+
+    def write_snapshot(self, snapshot, aggregates, through):
+        # Only touches files, so it is safe to run off the event loop.
+        # Aggregates go first: a base without them is rebuilt on load.
+        if aggregates is not None:
+            write_atomic(self._aggregates_path(through), aggregates)
+        write_atomic(self._base_path(through), snapshot)
+
+    def write_compaction(self, snapshot, aggregates, through, generation):
+        self.write_snapshot(snapshot, aggregates, through)
+        self._remove_files(upto=through)
+
+    def end_compaction(self, snapshot, aggregates, through, generation):
+        self._compacting = False
+        if generation != self._generation:
+            # History was cleared while the snapshot was being written
+            for path in (self._base_path(through),
+                         self._aggregates_path(through)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def needs_compaction(self, min_sealed=1):
+        return len(self.sealed_segments()) >= min_sealed
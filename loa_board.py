@@ -0,0 +1,62 @@
+"""LOA list rendering with a per-entry line cache and page splitting.
+
+Each LOA line is formatted once and reused until the member's display
+name changes. The list is split into pages that each fit in one Discord
+message, so every page can be posted and edited on its own.
+"""
+
+
+PAGE_LIMIT = 1900  # Discord allows 2000 characters per message
+HEADER = "**📋 Current and Upcoming LOAs:**"
+CONTINUED_HEADER = "**📋 Current and Upcoming LOAs (continued):**"
+EMPTY = "✅ No active LOAs."
+
+
+class LOABoard:
+
+    def __init__(self, page_limit=PAGE_LIMIT):
+        self.page_limit = page_limit
+        self._lines = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lines(self, entries, name_for):
+        # entries: (uid, LOA) pairs; name_for(uid) -> display name or None
+        # to leave the member out
+        lines = []
+        cache = {}
+        for uid, entry in entries:
+            name = name_for(uid)
+            if name is None:
+                continue
+            key = (uid, entry)
+            cached = self._lines.get(key)
+            if cached and cached[0] == name:
+                self.hits += 1
+            else:
+                self.misses += 1
+                start_str = entry.start.strftime("%d/%m/%Y")
+                end_str = entry.end.strftime("%d/%m/%Y")
+                cached = (name, f"📅 **{name}** — {start_str} to {end_str} – "
+                          f"{entry.reason}")
+            cache[key] = cached
+            lines.append(cached[1])
+        # Entries that are gone drop out of the cache here
+        self._lines = cache
+        return lines
+
+    def pages(self, entries, name_for):
+        return self.paginate(self.lines(entries, name_for))
+
+    def paginate(self, lines):
+        if not lines:
+            return [f"{HEADER}\n{EMPTY}"]
+        pages = []
+        page = HEADER
+        for line in lines:
+            if len(page) + 1 + len(line) > self.page_limit:
+                pages.append(page)
+                page = CONTINUED_HEADER
+            page += "\n" + line[:self.page_limit - len(CONTINUED_HEADER) - 1]
+        pages.append(page)
+        return pages
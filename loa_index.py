@@ -0,0 +1,182 @@
+"""In-memory leave-of-absence index with write-through persistence.
+
+Each user's LOAs are kept sorted by start date together with a running
+max of end dates, so "is X on leave on D" is a single bisect. A
+min-heap of end dates lets the sweeper drop expired LOAs without
+scanning everyone. Every mutation is written through to the storage
+engine, and reported to an optional reason index and attendance
+bitmaps. Swept LOAs are moved to the engine's ended LOAs rather than
+deleted, and stay in the bitmaps: the member was on leave on those days.
+"""
+import bisect
+import heapq
+from collections import namedtuple
+from datetime import date
+
+
+LOA = namedtuple("LOA", ["start", "end", "reason"])
+
+
+class UserLOAs:
+
+    def __init__(self):
+        self.entries = []
+        self._starts = []
+        self._max_end = []
+
+    def _reindex(self):
+        self._starts = [e.start.toordinal() for e in self.entries]
+        self._max_end = []
+        running = 0
+        for e in self.entries:
+            running = max(running, e.end.toordinal())
+            self._max_end.append(running)
+
+    def add(self, entry):
+        bisect.insort(self.entries, entry)
+        self._reindex()
+
+    def remove(self, entry):
+        try:
+            self.entries.remove(entry)
+        except ValueError:
+            return False
+        self._reindex()
+        return True
+
+    def covers(self, day):
+        i = bisect.bisect_right(self._starts, day.toordinal())
+        return i > 0 and self._max_end[i - 1] >= day.toordinal()
+
+
+class LOAIndex:
+
+    def __init__(self, storage, reasons=None, analytics=None):
+        self.storage = storage
+        self.reasons = reasons
+        self.analytics = analytics
+        self.users = {}
+        self._expiry = []
+
+    # --- persistence ---------------------------------------------------
+
+    def load(self):
+        self.users = {}
+        self._expiry = []
+        if self.reasons is not None:
+            self.reasons.clear("loa")
+        if self.analytics is not None:
+            self.analytics.clear_loas()
+        for uid, records in self.storage.load_loas().items():
+            for record in records:
+                self._insert(uid, self.from_record(record))
+        if self.analytics is not None:
+            for uid, records in self.storage.load_ended_loas().items():
+                for record in records:
+                    self.analytics.add_loa(uid, self.from_record(record))
+
+    @staticmethod
+    def to_record(entry):
+        return {
+            "start": entry.start.isoformat(),
+            "end": entry.end.isoformat(),
+            "reason": entry.reason
+        }
+
+    @staticmethod
+    def from_record(record):
+        return LOA(date.fromisoformat(record["start"]),
+                   date.fromisoformat(record["end"]), record["reason"])
+
+    # --- queries -------------------------------------------------------
+
+    def is_on_loa(self, uid, day):
+        user = self.users.get(uid)
+        return bool(user) and user.covers(day)
+
+    def entries_for(self, uid):
+        user = self.users.get(uid)
+        return list(user.entries) if user else []
+
+    def active(self, today):
+        # (uid, LOA) for every LOA that has not ended before today
+        for uid, user in self.users.items():
+            for entry in user.entries:
+                if entry.end >= today:
+                    yield uid, entry
+
+    # --- mutations (write-through) -------------------------------------
+
+    def _insert(self, uid, entry):
+        self.users.setdefault(uid, UserLOAs()).add(entry)
+        heapq.heappush(self._expiry, (entry.end, uid, entry))
+        if self.reasons is not None:
+            self.reasons.add_loa(uid, entry)
+        if self.analytics is not None:
+            self.analytics.add_loa(uid, entry)
+
+    def _discard(self, uid, entry, expired=False):
+        user = self.users.get(uid)
+        if not user or not user.remove(entry):
+            return False
+        if not user.entries:
+            del self.users[uid]
+        if self.reasons is not None:
+            self.reasons.remove_loa(uid, entry)
+        if self.analytics is not None and not expired:
+            self.analytics.remove_loa(uid, entry)
+        return True
+
+    def add(self, uid, start, end, reason):
+        entry = LOA(start, end, reason)
+        self._insert(uid, entry)
+        self.storage.add_loa(uid, self.to_record(entry))
+        return entry
+
+    def remove_at(self, uid, idx):
+        entries = self.entries_for(uid)
+        if not 0 <= idx < len(entries):
+            return None
+        entry = entries[idx]
+        self._discard(uid, entry)
+        self.storage.remove_loas([(uid, self.to_record(entry))])
+        return entry
+
+    def remove_user(self, uid):
+        # Withdraws the member's current LOAs; ended ones are kept.
+        # Heap entries for this user become stale and are skipped by sweep
+        user = self.users.pop(uid, None)
+        if user is None:
+            return False
+        if self.reasons is not None:
+            self.reasons.remove_user(uid, "loa")
+        if self.analytics is not None:
+            for entry in user.entries:
+                self.analytics.remove_loa(uid, entry)
+        self.storage.remove_user_loas(uid)
+        return True
+
+    def clear_ended(self, uid=None):
+        # Forgets ended LOAs, for one member or everyone
+        self.storage.clear_ended_loas(uid)
+
+    def clear(self):
+        self.users = {}
+        self._expiry = []
+        if self.reasons is not None:
+            self.reasons.clear("loa")
+        if self.analytics is not None:
+            self.analytics.clear_loas()
+        self.storage.clear_loas()
+        self.storage.clear_ended_loas()
+
+    def sweep(self, today):
+        # Move every LOA that ended before today to the ended LOAs
+        ended = []
+        while self._expiry and self._expiry[0][0] < today:
+            _, uid, entry = heapq.heappop(self._expiry)
+            if self._discard(uid, entry, expired=True):
+                ended.append((uid, self.to_record(entry)))
+        if ended:
+            self.storage.end_loas(ended)
+        return len(ended)
@@ -1,32 +1,94 @@
 import discord
+from discord import app_commands
 from discord.ext import tasks, commands
 import os
-import json
+import asyncio
+import io
+import logging
+import tempfile
 from datetime import datetime, timedelta, date
-from zoneinfo import ZoneInfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from discord.ui import Select, View, Modal, TextInput
 from aiohttp import web
+from storage import HOME_GUILD_ID, lock_data, open_guild_storage
+from persistence import AtomicWriter
+from guilds import GuildRegistry
+from loa_board import PAGE_LIMIT
+from analytics import WINDOWS
+from records import Availability, parse_availability
+import message_registry
+from scheduler import DailyAt, JobStateFile, Scheduler
+from router import ComponentRouter
+from startup import Startup, tree_hash
+from outbound import (Outbox, PRIORITY_ADMIN_PANEL, PRIORITY_LOA_LIST,
+                      PRIORITY_SUMMARY, PRIORITY_TURF)
+import metrics
+import bulk
+import tracing
+from profiler import SamplingProfiler
 
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+class TurfCommandTree(app_commands.CommandTree):
+
+    async def _call(self, interaction):
+        # Times and traces every slash command; command errors propagate
+        # out of _call to the tree's on_error, so the trace records them
+        name = interaction.data.get("name", "")
+        with interaction_seconds.time(kind="slash", name=name), tracer.trace(
+                "slash", name, guild=interaction.guild_id,
+                user=interaction.user.id):
+            await super()._call(interaction)
+
+
+class TurfBot(commands.AutoShardedBot):
+
+    async def setup_hook(self):
+        # Persistent views are built and registered once per process, so
+        # buttons on messages posted before a restart keep working
+        global admin_panel_view, loa_message_view, turf_question_view
+        admin_panel_view = AdminPanel()
+        loa_message_view = LOAMessageView()
+        turf_question_view = TurfQuestionView()
+        for view in (admin_panel_view, loa_message_view, turf_question_view):
+            self.add_view(view)
+        # Up before login so /ready can report progress
+        await startup.phase("webserver", start_webserver())
+
+    async def close(self):
+        # Let queued file writes land before the process exits
+        for state in guilds:
+            try:
+                await state.storage.flush()
+            except Exception as e:
+                print(f"Error flushing storage for {state.guild_id}: {e}")
+        await super().close()
+
+
+# discord.py caches no members; the bot reads display names from each
+# guild's MemberNames, fed by interactions and member events
+bot = TurfBot(command_prefix="!",
+              intents=intents,
+              tree_cls=TurfCommandTree,
+              member_cache_flags=discord.MemberCacheFlags.none(),
+              chunk_guilds_at_startup=False)
 print("Starting bot...")
 
 
 # Constants
-GUILD_ID = 1355091741501554859
-
-SETTINGS_FILE = "settings.json"
-HISTORY_FILE = "history.json"
-ARCHIVE_FOLDER = "archive"
-LOA_FILE = "loas.json"
+# Data file layout (HOME_GUILD_ID, file names, STORAGE_ENGINE) is in
+# storage.py, shared with the offline tools
+JOBS_FILE = "jobs.json"  # last runs of jobs that belong to no guild
+SLOW_LOG_FILE = "slow_traces.jsonl"
 
 DEFAULT_MESSAGE = "Are you available for turf at 8pm?"
 DEFAULT_HOUR = 20
 DEFAULT_MINUTE = 0
+TIMEZONE = ZoneInfo("Europe/London")  # unless a guild sets its own
 
 TURF_CHANNEL_ID = 1373930711542923296
 LOG_CHANNEL_ID = 1373936464152236062
@@ -34,65 +96,282 @@ ADMIN_PANEL_CHANNEL_ID = 1373961230682951811
 LOA_LIST_CHANNEL_ID = 1373956925506588812
 
 RESPONSE_WINDOW_MINUTES = 60
+LOOP_LAG_INTERVAL_SECONDS = 1.0
+ARCHIVE_GRACE_HOURS = 12
+# Daily jobs every guild gets, named "<kind>:<guild id>"
+GUILD_JOBS = ("turf_announcement", "close_day", "expire_loas")
+HISTORY_COMPACT_MINUTES = 10
+# Retention: raw responses for this many days, then one final answer per
+# member and day; attendance totals are kept as monthly counters forever
+HISTORY_RAW_DAYS = 60
+HISTORY_DAILY_DAYS = 400
+SUMMARY_COALESCE_SECONDS = 1.0
+SLOW_TRACE_SECONDS = 1.0  # interactions at least this slow go to the slow log
+PROFILE_SECONDS = 30
+PROFILE_MAX_SECONDS = 600  # interaction follow-ups expire after 15 minutes
 MIN_RESPONSES_FOR_LEADERBOARD = 5
+HISTORY_MAX_MESSAGES = 5
+AVAILABILITY_LABELS = {"yes": "Yes", "yes_later": "Yes but later", "no": "No"}
+
+
+def default_settings(guild_id):
+    settings = {
+        "message": DEFAULT_MESSAGE,
+        "hour": DEFAULT_HOUR,
+        "minute": DEFAULT_MINUTE,
+        "admin_roles": [],
+        "announcement": DEFAULT_MESSAGE,
+        "turf_channel": None,
+        "log_channel": None,
+        "admin_panel_channel": None,
+        "loa_list_channel": None,
+        "timezone": None,
+        "history_raw_days": HISTORY_RAW_DAYS,
+        "history_daily_days": HISTORY_DAILY_DAYS
+    }
+    if guild_id == HOME_GUILD_ID:
+        settings.update({
+            "turf_channel": TURF_CHANNEL_ID,
+            "log_channel": LOG_CHANNEL_ID,
+            "admin_panel_channel": ADMIN_PANEL_CHANNEL_ID,
+            "loa_list_channel": LOA_LIST_CHANNEL_ID
+        })
+    return settings
+
+
+storage_writer = AtomicWriter()
+
+
+def open_storage(guild_id):
+    return open_guild_storage(guild_id, writer=storage_writer)
+
+
+guilds = GuildRegistry(open_storage, default_settings,
+                       MIN_RESPONSES_FOR_LEADERBOARD,
+                       lambda state: guild_today(state))
+# Each guild's daily jobs keep their last runs with that guild's data;
+# global jobs use JOBS_FILE, seeded from the home guild's old state
+scheduler = Scheduler(
+    JobStateFile(JOBS_FILE, storage_writer,
+                 fallback=guilds.peek(HOME_GUILD_ID).storage))
+startup = Startup()
+admin_panel_view = None
+loa_message_view = None
+turf_question_view = None
+
+interaction_seconds = metrics.histogram(
+    "turf_interaction_seconds",
+    "Handling time of slash commands, modals and component routes",
+    ["kind", "name"])
+interaction_errors = metrics.counter(
+    "turf_interaction_errors_total",
+    "Component route handlers that raised", ["kind", "name"])
+rest_calls = metrics.counter("turf_discord_rest_calls_total",
+                             "Discord REST calls made by the bot", ["type"])
+outbound_superseded = metrics.counter(
+    "turf_outbound_superseded_total",
+    "Queued Discord calls replaced by a newer call before they ran",
+    ["type"])
+rate_limit_hits = metrics.counter("turf_discord_rate_limited_total",
+                                  "HTTP 429 responses received from Discord")
+slow_traces = metrics.counter(
+    "turf_slow_traces_total",
+    "Interactions slow enough to be written to the slow log", ["kind"])
+loop_lag = metrics.gauge("turf_event_loop_lag_seconds",
+                         "Most recent event loop scheduling delay")
+metrics.gauge("turf_gateway_latency_seconds",
+              "Discord gateway heartbeat latency",
+              collect=lambda: bot.latency)
+metrics.gauge("turf_loaded_guilds", "Guilds whose state is in memory",
+              collect=lambda: len(guilds.loaded()))
+metrics.gauge("turf_live_responses", "Entries in the in-memory responses maps",
+              collect=lambda: sum(len(s.responses) for s in guilds))
+metrics.gauge("turf_member_names", "Display names held in the member caches",
+              collect=lambda: sum(len(s.members) for s in guilds))
+metrics.gauge("turf_mutation_queue_depth",
+              "State mutations waiting for the writer",
+              collect=lambda: sum(s.mutations.depth() for s in guilds))
+
+
+def storage_file_sizes():
+    sizes = {}
+    for state in guilds:
+        for key, size in state.storage.file_sizes().items():
+            sizes[key] = sizes.get(key, 0) + size
+    return sizes
+
+
+metrics.gauge("turf_storage_file_bytes",
+              "Size of the bot's data files, summed over guilds", ["file"],
+              collect=storage_file_sizes)
+
+
+class RateLimitCounter(logging.Handler):
+    # discord.py retries 429s itself and only logs them
+
+    def emit(self, record):
+        message = record.getMessage()
+        if "responded with 429" in message or "Global rate limit" in message:
+            rate_limit_hits.inc()
+
+
+logging.getLogger("discord.http").addHandler(RateLimitCounter())
+
+
+def observe_route(custom_id, seconds, failed):
+    interaction_seconds.observe(seconds, kind="component", name=custom_id)
+    if failed:
+        interaction_errors.inc(kind="component", name=custom_id)
+
+
+def observe_slow_trace(kind, name, seconds):
+    slow_traces.inc(kind=kind)
+
+
+tracer = tracing.Tracer(tracing.SlowLog(SLOW_LOG_FILE), SLOW_TRACE_SECONDS,
+                        observer=observe_slow_trace)
+router = ComponentRouter(observer=observe_route, tracer=tracer)
+profiler = SamplingProfiler()
+# (guild ID, event that stops the run early) while the profiler runs
+profile_run = None
+
+
+def observe_outbound(kind, outcome):
+    if outcome == "superseded":
+        outbound_superseded.inc(type=kind)
+    else:
+        rest_calls.inc(type=kind)
+
 
-settings = {
-    "message": DEFAULT_MESSAGE,
-    "hour": DEFAULT_HOUR,
-    "minute": DEFAULT_MINUTE,
-    "admin_roles": [],
-    "announcement": DEFAULT_MESSAGE,
-    "turf_channel": TURF_CHANNEL_ID,
-    "log_channel": LOG_CHANNEL_ID,
-    "admin_panel_channel": ADMIN_PANEL_CHANNEL_ID,
-    "loa_list_channel": LOA_LIST_CHANNEL_ID
+outbox = Outbox(observer=observe_outbound)
+metrics.gauge("turf_outbound_queue_depth",
+              "Discord REST calls waiting in the outbound queue",
+              collect=outbox.depth)
+
+# Which queue priority each tracked message's updates run at
+PURPOSE_PRIORITIES = {
+    message_registry.TURF_QUESTION: PRIORITY_TURF,
+    message_registry.SUMMARY: PRIORITY_SUMMARY,
+    message_registry.LOA_LIST: PRIORITY_LOA_LIST,
+    message_registry.ADMIN_PANEL: PRIORITY_ADMIN_PANEL,
 }
 
-responses = {}
-summary_message_id = None
-loa_message_id = None
-last_turf_message_id = None
 
-if not os.path.exists(ARCHIVE_FOLDER):
-    os.makedirs(ARCHIVE_FOLDER)
+async def rest(kind, channel, start, priority, key=None):
+    # start() begins the call; see outbound.Outbox
+    return await outbox.submit(kind, channel.id, start, priority, key)
+
+
+def edit_key(message_id):
+    # Pending edits of one message replace each other
+    return ("edit", message_id)
 
 
-def load_json(filename, default):
-    if not os.path.exists(filename):
-        return default
-    with open(filename, 'r') as f:
-        return json.load(f)
+async def monitor_event_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+        loop_lag.set(max(0.0, loop.time() - start - LOOP_LAG_INTERVAL_SECONDS))
 
 
-def save_json(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+def guild_job(kind, guild_id):
+    return f"{kind}:{guild_id}"
 
 
-def load_all():
-    global settings, responses
-    loaded = load_json(SETTINGS_FILE, settings)
-    settings.update(loaded)
-    responses.clear()
+def announcement_job(guild_id):
+    return guild_job("turf_announcement", guild_id)
 
 
-def archive_today():
-    today_str = date.today().isoformat()
-    save_json(f"{ARCHIVE_FOLDER}/{today_str}.json", responses)
+def guild_timezone(state):
+    name = state.settings.get("timezone")
+    if name:
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            print(f"Unknown timezone {name} for guild {state.guild_id}")
+    return TIMEZONE
+
+
+def guild_today(state):
+    return datetime.now(guild_timezone(state)).date()
+
+
+def schedule_guild(guild_id):
+    # The announcement, closing the day and expiring LOAs all run at
+    # wall-clock times in the guild's own timezone
+    state = guilds.peek(guild_id)
+    if announcement_job(guild_id) in scheduler.jobs:
+        return
+
+    def zone():
+        return guild_timezone(state)
+
+    async def announce():
+        await turf_announcement(guild_id)
+
+    async def close_day():
+        # Guilds that were never loaded have no responses to archive
+        if state.loaded:
+            await close_guild_day(state)
+
+    async def expire():
+        # The rest are swept when they are first loaded
+        if state.loaded:
+            await expire_guild_loas(state)
+
+    scheduler.add(announcement_job(guild_id),
+                  DailyAt(
+                      lambda: (state.settings.get("hour", DEFAULT_HOUR),
+                               state.settings.get("minute", DEFAULT_MINUTE)),
+                      zone),
+                  announce,
+                  grace=timedelta(minutes=RESPONSE_WINDOW_MINUTES),
+                  store=state.storage)
+    scheduler.add(guild_job("close_day", guild_id),
+                  DailyAt(lambda: (0, 1), zone),
+                  close_day,
+                  grace=timedelta(hours=ARCHIVE_GRACE_HOURS),
+                  store=state.storage)
+    scheduler.add(guild_job("expire_loas", guild_id),
+                  DailyAt(lambda: (0, 0), zone),
+                  expire,
+                  grace=timedelta(days=1),
+                  store=state.storage)
+
+
+def unschedule_guild(guild_id):
+    for kind in GUILD_JOBS:
+        scheduler.remove(guild_job(kind, guild_id))
+
+
+def reschedule_guild(guild_id):
+    # After the guild's timezone changed
+    for kind in GUILD_JOBS:
+        scheduler.reschedule(guild_job(kind, guild_id))
+
+
+class TimedModal(Modal):
+    # Wraps each subclass's on_submit in the interaction latency histogram
+    # and a trace
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        on_submit = cls.__dict__.get("on_submit")
+        if on_submit is None:
+            return
 
+        async def timed_on_submit(self, interaction: discord.Interaction):
+            with interaction_seconds.time(
+                    kind="modal", name=cls.__name__), tracer.trace(
+                        "modal", cls.__name__, guild=interaction.guild_id,
+                        user=interaction.user.id):
+                await on_submit(self, interaction)
 
-def is_on_loa(user_id: str, check_date: date):
-    loas = load_json(LOA_FILE, {})
-    user_loas = loas.get(user_id, [])
-    for entry in user_loas:
-        start = datetime.strptime(entry["start"], "%Y-%m-%d").date()
-        end = datetime.strptime(entry["end"], "%Y-%m-%d").date()
-        if start <= check_date <= end:
-            return True
-    return False
+        cls.on_submit = timed_on_submit
 
 
-class TurfModal(Modal, title="Turf Availability"):
+class TurfModal(TimedModal, title="Turf Availability"):
     availability = TextInput(label="Availability (Yes, No, or Yes but later)",
                              placeholder="Yes / No / Yes but later",
                              max_length=20)
@@ -102,23 +381,27 @@ class TurfModal(Modal, title="Turf Availability"):
                        max_length=100)
 
     async def on_submit(self, interaction: discord.Interaction):
-        avail = self.availability.value.lower().strip()
+        avail = parse_availability(self.availability.value)
+        if avail is None:
+            await interaction.response.send_message(
+                "❌ Please answer Yes, No, or Yes but later.", ephemeral=True)
+            return
+        state = await guilds.get(interaction.guild_id)
         reason = self.reason.value.strip()
-        if avail == "yes but later":
+        if avail is Availability.YES_LATER:
             reason_text = f"Will join later: {reason}" if reason else "Will join later (time not specified)"
-            avail = "yes_later"   # differentiate "yes but later"
-        elif avail == "no":
+        elif avail is Availability.NO:
             reason_text = reason or "No reason given"
         else:
             reason_text = ""
-        await record_response(interaction.user, avail, reason_text)
-        await update_summary()
+        await record_response(state, interaction.user, avail, reason_text)
+        await update_summary(state)
         await interaction.response.send_message(
             "✅ Your response has been recorded!", ephemeral=True)
 
-    
 
-class LOAModal(Modal, title="Log Leave of Absence"):
+
+class LOAModal(TimedModal, title="Log Leave of Absence"):
     start = TextInput(label="Start Date (dd/mm/yyyy)",
                       placeholder="e.g. 20/05/2025")
     end = TextInput(label="End Date (dd/mm/yyyy)",
@@ -127,29 +410,22 @@ class LOAModal(Modal, title="Log Leave of Absence"):
 
     async def on_submit(self, interaction: discord.Interaction):
         try:
+            state = await guilds.get(interaction.guild_id)
             start_date = datetime.strptime(self.start.value.strip(),
                                            "%d/%m/%Y").date()
             end_date = datetime.strptime(self.end.value.strip(),
                                          "%d/%m/%Y").date()
             reason_text = self.reason.value.strip()
             user_id = str(interaction.user.id)
-            loas = load_json(LOA_FILE, {})
-            if user_id not in loas:
-                loas[user_id] = []
-            loas[user_id].append({
-                "start": start_date.isoformat(),
-                "end": end_date.isoformat(),
-                "reason": reason_text
-            })
-            save_json(LOA_FILE, loas)
-
-            for day in range((end_date - start_date).days + 1):
-                current_date = start_date + timedelta(days=day)
-                if current_date == date.today():
-                    await record_response(interaction.user, "no", reason_text)
-                    await update_summary()
-
-            await update_loa_list()
+            await state.mutations.submit(state.loa_index.add, user_id,
+                                         start_date, end_date, reason_text)
+
+            if start_date <= guild_today(state) <= end_date:
+                await record_response(state, interaction.user, Availability.NO,
+                                      reason_text)
+                await update_summary(state)
+
+            await update_loa_list(state)
             await interaction.response.send_message(
                 f"✅ LOA recorded from {self.start.value} to {self.end.value}.",
                 ephemeral=True)
@@ -158,18 +434,22 @@ class LOAModal(Modal, title="Log Leave of Absence"):
                 "❌ Invalid date format. Use dd/mm/yyyy.", ephemeral=True)
 
 
-class TimeModal(Modal, title="Set Turf Time"):
+class TimeModal(TimedModal, title="Set Turf Time"):
     hour = TextInput(label="Hour (0-23)", placeholder="e.g. 20")
     minute = TextInput(label="Minute (0-59)", placeholder="e.g. 30")
 
     async def on_submit(self, interaction: discord.Interaction):
         try:
+            state = await guilds.get(interaction.guild_id)
             h = int(self.hour.value.strip())
             m = int(self.minute.value.strip())
             if 0 <= h <= 23 and 0 <= m <= 59:
-                settings["hour"] = h
-                settings["minute"] = m
-                save_json(SETTINGS_FILE, settings)
+                await state.mutations.submit(state.update_settings, {
+                    "hour": h,
+                    "minute": m
+                })
+                schedule_guild(state.guild_id)
+                scheduler.reschedule(announcement_job(state.guild_id))
                 await interaction.response.send_message(
                     f"✅ Turf time updated to {h:02d}:{m:02d}.", ephemeral=True)
             else:
@@ -180,7 +460,7 @@ class TimeModal(Modal, title="Set Turf Time"):
                                                     ephemeral=True)
 
 
-class MessageModal(Modal, title="Set Turf Announcement"):
+class MessageModal(TimedModal, title="Set Turf Announcement"):
     mention_role = TextInput(label="Role to mention (@everyone or role ID)",
                              placeholder="@everyone or RoleID",
                              required=True)
@@ -189,80 +469,169 @@ class MessageModal(Modal, title="Set Turf Announcement"):
                     style=discord.TextStyle.paragraph)
 
     async def on_submit(self, interaction: discord.Interaction):
+        state = await guilds.get(interaction.guild_id)
         mention_text = self.mention_role.value.strip()
         msg_text = self.msg.value.strip()
         if mention_text == "@everyone":
-            settings["announcement"] = f"@everyone {msg_text}"
+            announcement = f"@everyone {msg_text}"
         else:
             try:
                 role_id = int(mention_text.strip("<@&>"))
-                settings["announcement"] = f"<@&{role_id}> {msg_text}"
+                announcement = f"<@&{role_id}> {msg_text}"
             except:
-                settings["announcement"] = msg_text
-        save_json(SETTINGS_FILE, settings)
+                announcement = msg_text
+        await state.mutations.submit(state.update_settings,
+                                     {"announcement": announcement})
         await interaction.response.send_message(
             "✅ Announcement message updated.", ephemeral=True)
 
 
-class AdminPanel(View):
+class ProfileModal(TimedModal, title="Run Profiler"):
+    seconds = TextInput(label=f"Seconds to profile (1-{PROFILE_MAX_SECONDS})",
+                        default=str(PROFILE_SECONDS),
+                        max_length=3)
 
-    @discord.ui.button(label="Send Turf Test",
-                       style=discord.ButtonStyle.primary)
-    async def test(self, interaction: discord.Interaction,
-                   button: discord.ui.Button):
-        if not is_admin(interaction):
-            await interaction.response.send_message("❌ Not permitted.",
-                                                    ephemeral=True)
+    async def on_submit(self, interaction: discord.Interaction):
+        global profile_run
+        try:
+            seconds = int(self.seconds.value.strip())
+        except ValueError:
+            seconds = 0
+        if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+            await interaction.response.send_message(
+                f"❌ Enter a number of seconds from 1 to {PROFILE_MAX_SECONDS}.",
+                ephemeral=True)
+            return
+        if not profiler.start():
+            await interaction.response.send_message(
+                "❌ The profiler is already running.", ephemeral=True)
             return
-        await send_turf_question()
-        await interaction.response.send_message("✅ Turf test sent.",
+        stop = asyncio.Event()
+        profile_run = (interaction.guild_id, stop)
+        asyncio.create_task(finish_profile(interaction, seconds, stop))
+        await interaction.response.send_message(
+            f"⏱ Profiling for {seconds}s. Press Profile again to stop early.",
+            ephemeral=True)
+
+
+async def finish_profile(interaction, seconds, stop):
+    # Sends the report as a follow-up to the interaction that started it
+    global profile_run
+    tracing.detach()
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+    profiler.stop()
+    profile_run = None
+    stamp = datetime.now(TIMEZONE).strftime("%Y%m%d-%H%M%S")
+    files = [
+        discord.File(io.BytesIO(profiler.summary().encode()),
+                     filename=f"profile-{stamp}.txt"),
+        discord.File(io.BytesIO(profiler.folded().encode()),
+                     filename=f"profile-{stamp}.folded")
+    ]
+    try:
+        await interaction.followup.send(
+            f"📊 Profile of {profiler.seconds:.1f}s ({profiler.samples} "
+            f"samples). The .folded file opens in speedscope or "
+            f"flamegraph.pl.", files=files, ephemeral=True)
+    except discord.HTTPException as e:
+        print(f"Error sending profile: {e}")
+
+
+class AdminPanel(View):
+
+    def __init__(self):
+        super().__init__(timeout=None)
+        self.add_item(
+            router.button("Send Turf Test", discord.ButtonStyle.primary,
+                          "admin_test"))
+        self.add_item(
+            router.button("Force Summary", discord.ButtonStyle.secondary,
+                          "admin_summary"))
+        self.add_item(
+            router.button("Set Time", discord.ButtonStyle.secondary,
+                          "admin_settime"))
+        self.add_item(
+            router.button("Set Message", discord.ButtonStyle.secondary,
+                          "admin_setmsg"))
+        self.add_item(
+            router.button("Profile", discord.ButtonStyle.secondary,
+                          "admin_profile"))
+
+
+@router.route("admin_test")
+async def admin_test(interaction: discord.Interaction):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
+        await interaction.response.send_message("❌ Not permitted.",
                                                 ephemeral=True)
+        return
+    await send_turf_question(state)
+    await interaction.response.send_message("✅ Turf test sent.",
+                                            ephemeral=True)
 
-    @discord.ui.button(label="Force Summary",
-                       style=discord.ButtonStyle.secondary)
-    async def summary(self, interaction: discord.Interaction,
-                      button: discord.ui.Button):
-        if not is_admin(interaction):
-            await interaction.response.send_message("❌ Not permitted.",
-                                                    ephemeral=True)
-            return
-        await update_loa_list()
-        await update_summary(force=True)
-        await interaction.response.send_message("✅ Summary updated.",
+
+@router.route("admin_summary")
+async def admin_summary(interaction: discord.Interaction):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
+        await interaction.response.send_message("❌ Not permitted.",
                                                 ephemeral=True)
+        return
+    await update_loa_list(state)
+    await update_summary(state, force=True)
+    await interaction.response.send_message("✅ Summary updated.",
+                                            ephemeral=True)
 
-    @discord.ui.button(label="Set Time", style=discord.ButtonStyle.secondary)
-    async def settime(self, interaction: discord.Interaction,
-                      button: discord.ui.Button):
-        if not is_admin(interaction):
-            await interaction.response.send_message("❌ Not permitted.",
-                                                    ephemeral=True)
-            return
-        await interaction.response.send_modal(TimeModal())
-
-    @discord.ui.button(label="Set Message",
-                       style=discord.ButtonStyle.secondary)
-    async def setmsg(self, interaction: discord.Interaction,
-                     button: discord.ui.Button):
-        if not is_admin(interaction):
-            await interaction.response.send_message("❌ Not permitted.",
-                                                    ephemeral=True)
-            return
-        await interaction.response.send_modal(MessageModal())
+
+@router.route("admin_settime")
+async def admin_settime(interaction: discord.Interaction):
+    if not is_admin(guilds.peek(interaction.guild_id), interaction):
+        await interaction.response.send_message("❌ Not permitted.",
+                                                ephemeral=True)
+        return
+    await interaction.response.send_modal(TimeModal())
+
+
+@router.route("admin_setmsg")
+async def admin_setmsg(interaction: discord.Interaction):
+    if not is_admin(guilds.peek(interaction.guild_id), interaction):
+        await interaction.response.send_message("❌ Not permitted.",
+                                                ephemeral=True)
+        return
+    await interaction.response.send_modal(MessageModal())
+
+
+@router.route("admin_profile")
+async def admin_profile(interaction: discord.Interaction):
+    if not is_admin(guilds.peek(interaction.guild_id), interaction):
+        await interaction.response.send_message("❌ Not permitted.",
+                                                ephemeral=True)
+        return
+    if profile_run is None:
+        await interaction.response.send_modal(ProfileModal())
+    elif profile_run[0] == interaction.guild_id:
+        profile_run[1].set()
+        await interaction.response.send_message(
+            "⏹ Profiler stopped; the report goes to whoever started it.",
+            ephemeral=True)
+    else:
+        await interaction.response.send_message(
+            "❌ The profiler is already running for another server.",
+            ephemeral=True)
 
 
 class RemoveLOASelect(Select):
 
-    def __init__(self, user_id: str):
+    def __init__(self, state, user_id: str):
+        self.state = state
         self.user_id = user_id
-        loas = load_json(LOA_FILE, {}).get(user_id, [])
         options = []
-        for i, entry in enumerate(loas):
-            start = datetime.strptime(entry["start"],
-                                      "%Y-%m-%d").date().strftime("%d/%m/%Y")
-            end = datetime.strptime(entry["end"],
-                                    "%Y-%m-%d").date().strftime("%d/%m/%Y")
-            label = f"{start} to {end}"
+        for i, entry in enumerate(state.loa_index.entries_for(user_id)):
+            label = (f"{entry.start.strftime('%d/%m/%Y')} to "
+                     f"{entry.end.strftime('%d/%m/%Y')}")
             options.append(discord.SelectOption(label=label, value=str(i)))
         super().__init__(placeholder="Select LOA to remove",
                          options=options,
@@ -270,16 +639,21 @@ class RemoveLOASelect(Select):
                          max_values=1)
 
     async def callback(self, interaction: discord.Interaction):
-        loas = load_json(LOA_FILE, {})
-        user_loas = loas.get(self.user_id, [])
-        idx = int(self.values[0])
-        if 0 <= idx < len(user_loas):
-            removed = user_loas.pop(idx)
-            loas[self.user_id] = user_loas
-            save_json(LOA_FILE, loas)
-            await update_loa_list()
+        with tracer.trace("component", "remove_loa_select",
+                          guild=interaction.guild_id,
+                          user=interaction.user.id):
+            await self.remove(interaction)
+
+    async def remove(self, interaction):
+        state = self.state
+        removed = await state.mutations.submit(state.loa_index.remove_at,
+                                               self.user_id,
+                                               int(self.values[0]))
+        if removed:
+            await update_loa_list(state)
             await interaction.response.send_message(
-                f"✅ Removed LOA from {removed['start']} to {removed['end']}.",
+                f"✅ Removed LOA from {removed.start.isoformat()} to "
+                f"{removed.end.isoformat()}.",
                 ephemeral=True)
         else:
             await interaction.response.send_message("❌ Invalid selection.",
@@ -288,256 +662,331 @@ class RemoveLOASelect(Select):
 
 class RemoveLOAView(View):
 
-    def __init__(self, user_id: str):
+    def __init__(self, state, user_id: str):
         super().__init__()
-        self.add_item(RemoveLOASelect(user_id))
+        self.add_item(RemoveLOASelect(state, user_id))
 
 
-# NEW: Add this class to show Add LOA and Remove LOA buttons on LOA list message
+# Add LOA and Remove LOA buttons on the LOA list message
 class LOAMessageView(View):
 
     def __init__(self):
-        super().__init__()
+        super().__init__(timeout=None)
+        self.add_item(
+            router.button("Add LOA", discord.ButtonStyle.primary, "add_loa"))
         self.add_item(
-            discord.ui.Button(label="Add LOA",
-                              style=discord.ButtonStyle.primary,
-                              custom_id="add_loa"))
+            router.button("Remove LOA", discord.ButtonStyle.danger,
+                          "remove_loa"))
+
+
+class TurfQuestionView(View):
+
+    def __init__(self):
+        super().__init__(timeout=None)
         self.add_item(
-            discord.ui.Button(label="Remove LOA",
-                              style=discord.ButtonStyle.danger,
-                              custom_id="remove_loa"))
+            router.button("Respond", discord.ButtonStyle.primary,
+                          "respond_button"))
+
 
+@router.route("respond_button")
+async def respond_button(interaction: discord.Interaction):
+    await interaction.response.send_modal(TurfModal())
+
+
+@router.route("add_loa")
+async def add_loa(interaction: discord.Interaction):
+    await interaction.response.send_modal(LOAModal())
 
-async def clear_bot_messages(channel):
+
+@router.route("remove_loa")
+async def remove_loa(interaction: discord.Interaction):
+    state = await guilds.get(interaction.guild_id)
+    await interaction.response.send_message(
+        "Select an LOA to remove:",
+        view=RemoveLOAView(state, str(interaction.user.id)),
+        ephemeral=True)
+
+
+async def clear_bot_messages(channel, priority):
 
     def is_bot(m):
         return m.author == bot.user
 
     try:
-        deleted = await channel.purge(limit=100, check=is_bot)
+        deleted = await rest(
+            "purge", channel,
+            lambda: channel.purge(limit=100, check=is_bot), priority,
+            key=("purge", channel.id))
         print(f"Deleted {len(deleted)} bot messages in {channel.name}")
     except Exception as e:
         print(f"Error deleting messages: {e}")
 
 
-async def update_loa_list():
-    global loa_message_id
-    channel = bot.get_channel(settings.get("loa_list_channel"))
+async def refresh_tracked_pages(state, channel, purpose, pages, view=None):
+    # One message per page, edited only when its content hash changed. The
+    # view goes on the first page. If one of our messages is gone, purge
+    # and repost every page so they stay in order
+    priority = PURPOSE_PRIORITIES[purpose]
+    old_hashes = state.page_hashes.get(purpose, [])
+    new_hashes = [hash(content) for content in pages]
+    ids = []
+    while state.tracked.get(message_registry.page(purpose, len(ids))):
+        ids.append(state.tracked.get(message_registry.page(purpose, len(ids))))
+    if ids:
+        try:
+            for i, content in enumerate(pages):
+                page_view = view if i == 0 else None
+                if i >= len(ids):
+                    msg = await rest(
+                        "send", channel,
+                        lambda: channel.send(content, view=page_view),
+                        priority)
+                    state.tracked.set(message_registry.page(purpose, i),
+                                      msg.id)
+                elif i >= len(old_hashes) or old_hashes[i] != new_hashes[i]:
+                    message = channel.get_partial_message(ids[i])
+                    await rest(
+                        "edit", channel,
+                        lambda: message.edit(content=content, view=page_view),
+                        priority, key=edit_key(ids[i]))
+            for i in range(len(pages), len(ids)):
+                message = channel.get_partial_message(ids[i])
+                try:
+                    await rest("delete", channel, message.delete, priority,
+                               key=("delete", ids[i]))
+                except discord.NotFound:
+                    pass
+                state.tracked.forget(message_registry.page(purpose, i))
+            state.page_hashes[purpose] = new_hashes
+            return
+        except discord.NotFound:
+            for i in range(len(ids)):
+                state.tracked.forget(message_registry.page(purpose, i))
+    await clear_bot_messages(channel, priority)
+    for i, content in enumerate(pages):
+        page_view = view if i == 0 else None
+        msg = await rest("send", channel,
+                         lambda: channel.send(content, view=page_view),
+                         priority)
+        state.tracked.set(message_registry.page(purpose, i), msg.id)
+    state.page_hashes[purpose] = new_hashes
+
+
+async def refresh_tracked_message(state, channel, purpose, content,
+                                  view=None):
+    await refresh_tracked_pages(state, channel, purpose, [content], view)
+
+
+async def note_member(state, member):
+    # Records the member's current display name, refreshing today's
+    # summary and the LOA list when it changed
+    if member.bot:
+        return
+    uid, name = str(member.id), member.display_name
+    if state.members.get(uid) == name:
+        return
+    if await state.mutations.submit(state.rename_member, uid, name):
+        await update_summary(state)
+    if state.loa_index.entries_for(uid):
+        await update_loa_list(state)
+
+
+async def update_loa_list(state):
+    channel = bot.get_channel(state.settings.get("loa_list_channel"))
     if not channel:
         return
-    await clear_bot_messages(channel
-                             )  # clear previous bot messages before posting
-
-    loas = load_json(LOA_FILE, {})
-    today = date.today()
-    output = []
-    for uid, records in loas.items():
-        member = channel.guild.get_member(int(uid))
-        if not member:
-            continue
-        name = member.display_name
-        for entry in records:
-            start = datetime.strptime(entry["start"], "%Y-%m-%d").date()
-            end = datetime.strptime(entry["end"], "%Y-%m-%d").date()
-            if end >= today:
-                start_str = start.strftime("%d/%m/%Y")
-                end_str = end.strftime("%d/%m/%Y")
-                output.append(
-                    f"📅 **{name}** — {start_str} to {end_str} – {entry['reason']}"
-                )
-    content = "**📋 Current and Upcoming LOAs:**\n" + (
-        "\n".join(output) if output else "✅ No active LOAs.")
+    pages = state.loa_board.pages(state.loa_index.active(guild_today(state)),
+                                  state.members.get)
     # Send message with Add LOA and Remove LOA buttons always
-    msg = await channel.send(content, view=LOAMessageView())
-    loa_message_id = msg.id
+    await refresh_tracked_pages(state, channel, message_registry.LOA_LIST,
+                                pages, view=loa_message_view)
 
 
-async def update_summary(force=False):
-    global summary_message_id
-    log_channel = bot.get_channel(settings.get("log_channel"))
-    if not log_channel:
+async def update_summary(state, force=False):
+    # Coalesce bursts of submits into a single edit of the summary message
+    if force:
+        await flush_summary(state, force=True)
         return
-
-    # Delete old summary message if forcing update to avoid clutter
-    if force and summary_message_id:
+    state.summary_dirty = True
+    if state.summary_task is None or state.summary_task.done():
+        state.summary_task = asyncio.create_task(summary_writer(state))
+
+
+async def summary_writer(state):
+    # One edit covers many responses, so it belongs to no single trace
+    tracing.detach()
+    while state.summary_dirty:
+        await asyncio.sleep(
+            state.settings.get("summary_coalesce_seconds",
+                               SUMMARY_COALESCE_SECONDS))
+        state.summary_dirty = False
         try:
-            old_msg = await log_channel.fetch_message(summary_message_id)
-            await old_msg.delete()
-        except:
-            pass
+            await flush_summary(state)
+        except Exception as e:
+            print(f"Error updating summary: {e}")
 
-    yes_list = [
-        r["name"] for r in responses.values() if r["available"] == "yes"
-    ]
-    yes_later_list = [
-        f"⏰ **{r['name']}** – {r['reason']}" for r in responses.values() if r["available"] == "yes_later"
-    ]
-    no_list = [
-        f"❌ **{r['name']}** – {r['reason']}" for r in responses.values()
-        if r["available"] == "no"
-    ]
-    today_uk = date.today().strftime("%d/%m/%Y")
-    summary = f"📋 **Turf Availability Summary** ({today_uk})\n\n"
-    summary += f"✅ **Yes ({len(yes_list)}):**\n" + (
-        ", ".join(yes_list) if yes_list else "None") + "\n\n"
-    summary += f"⏰ **Yes but later ({len(yes_later_list)}):**\n" + (
-        "\n".join(yes_later_list) if yes_later_list else "None") + "\n\n"
-    summary += f"❌ **No ({len(no_list)}):**\n" + ("\n".join(no_list)
-                                                  if no_list else "None")
-
-    # Delete old summary message (if not forced)
-    if not force and summary_message_id:
-        try:
-            old_msg = await log_channel.fetch_message(summary_message_id)
-            await old_msg.delete()
-        except:
-            pass
 
-    msg = await log_channel.send(summary)
-    summary_message_id = msg.id
+async def flush_summary(state, force=False):
+    async with state.summary_lock:
+        log_channel = bot.get_channel(state.settings.get("log_channel"))
+        if not log_channel:
+            return
+        summary = state.summary_board.render(guild_today(state))
+        summary_message_id = state.tracked.get(message_registry.SUMMARY)
 
+        if summary_message_id and not force:
+            if summary == state.summary_last_content:
+                return
+            message = log_channel.get_partial_message(summary_message_id)
+            try:
+                await rest("edit", log_channel,
+                           lambda: message.edit(content=summary),
+                           PRIORITY_SUMMARY, key=edit_key(summary_message_id))
+                state.summary_last_content = summary
+                return
+            except discord.NotFound:
+                summary_message_id = None
+                state.tracked.forget(message_registry.SUMMARY)
+
+        # Force mode reposts the summary at the bottom of the channel
+        if summary_message_id:
+            message = log_channel.get_partial_message(summary_message_id)
+            try:
+                await rest("delete", log_channel, message.delete,
+                           PRIORITY_SUMMARY,
+                           key=("delete", summary_message_id))
+            except:
+                pass
+
+        msg = await rest("send", log_channel,
+                         lambda: log_channel.send(summary), PRIORITY_SUMMARY)
+        state.tracked.set(message_registry.SUMMARY, msg.id)
+        state.summary_last_content = summary
 
 
-async def send_turf_question():
-    global last_turf_message_id
-    turf_channel = bot.get_channel(settings.get("turf_channel"))
+async def send_turf_question(state):
+    turf_channel = bot.get_channel(state.settings.get("turf_channel"))
     if not turf_channel:
         return
-    await clear_bot_messages(turf_channel
-                             )  # clear previous turf messages before sending
+    # A fresh message is needed for the ping, so delete the previous one
+    last_turf_message_id = state.tracked.get(message_registry.TURF_QUESTION)
+    if last_turf_message_id:
+        message = turf_channel.get_partial_message(last_turf_message_id)
+        try:
+            await rest("delete", turf_channel, message.delete, PRIORITY_TURF,
+                       key=("delete", last_turf_message_id))
+        except discord.NotFound:
+            pass
+    else:
+        await clear_bot_messages(turf_channel, PRIORITY_TURF)
 
     ping_text = "@everyone"
-    msg = await turf_channel.send(
-        f"{ping_text} {settings.get('announcement', DEFAULT_MESSAGE)}",
-        view=discord.ui.View().add_item(
-            discord.ui.Button(label='Respond',
-                              style=discord.ButtonStyle.primary,
-                              custom_id="respond_button")))
-    last_turf_message_id = msg.id
+    msg = await rest(
+        "send", turf_channel,
+        lambda: turf_channel.send(
+            f"{ping_text} {state.settings.get('announcement', DEFAULT_MESSAGE)}",
+            view=turf_question_view), PRIORITY_TURF)
+    state.tracked.set(message_registry.TURF_QUESTION, msg.id)
 
 
-async def send_admin_panel():
-    channel = bot.get_channel(settings.get("admin_panel_channel"))
+async def send_admin_panel(state):
+    channel = bot.get_channel(state.settings.get("admin_panel_channel"))
     if channel:
-        await clear_bot_messages(channel)
-        await channel.send("🛠 **Turf Admin Panel**", view=AdminPanel())
+        await refresh_tracked_message(state, channel,
+                                      message_registry.ADMIN_PANEL,
+                                      "🛠 **Turf Admin Panel**",
+                                      view=admin_panel_view)
+
+
+async def record_response(state, user, availability, reason):
+    today = guild_today(state)
+    timestamp = datetime.now(guild_timezone(state)).strftime("%H:%M:%S")
+    loa_added = await state.mutations.submit(state.apply_response,
+                                             str(user.id), user.display_name,
+                                             availability, reason, today,
+                                             timestamp)
+    if loa_added:
+        await update_loa_list(state)
+
+
+async def turf_announcement(guild_id):
+    state = await guilds.get(guild_id)
+    if not state.settings.get("turf_channel"):
+        return
+    await state.mutations.submit(state.clear_responses, guild_today(state))
+    await send_turf_question(state)
+    await update_summary(state)
 
 
-async def record_response(user, availability, reason):
-    uid = str(user.id)
-    today = date.today()
-    if is_on_loa(uid, today):
-        # Auto set no if user on LOA today
-        reason = "On Leave of Absence"
-        availability = "no"
-    else:
-        availability = availability.lower().strip()
-        reason = reason.strip() if availability == "no" else ""
-
-    # --- NEW: Automatically add 1-day LOA if user responds 'no' ---
-    if availability == "no" and reason:
-        loas = load_json(LOA_FILE, {})
-        user_loas = loas.get(uid, [])
-        # Check if user already has a LOA today to avoid duplicates
-        already_has_today = any(
-            datetime.strptime(entry["start"], "%Y-%m-%d").date() <= today <=
-            datetime.strptime(entry["end"], "%Y-%m-%d").date()
-            for entry in user_loas)
-        if not already_has_today:
-            user_loas.append({
-                "start": today.isoformat(),
-                "end": today.isoformat(),
-                "reason": reason
-            })
-            loas[uid] = user_loas
-            save_json(LOA_FILE, loas)
-            await update_loa_list()
-    # -------------------------------------------------------------
-
-    timestamp = datetime.now(ZoneInfo("Europe/London")).strftime("%H:%M:%S")
-    previous = responses.get(uid, {}).get("available")
-    change_note = f" (changed at {timestamp})" if previous == "yes" and availability == "no" else ""
-
-    responses[uid] = {
-        "name": user.display_name,
-        "available": availability,
-        "reason": reason + change_note if reason and change_note else reason
-    }
-
-    history = load_json(HISTORY_FILE, {})
-    today_str = today.isoformat()
-    if uid not in history:
-        history[uid] = []
-    history[uid].append({
-        "date": today_str,
-        "available": availability,
-        "reason": reason,
-        "time": timestamp
-    })
-    save_json(HISTORY_FILE, history)
+async def close_guild_day(state):
+    log_channel = bot.get_channel(state.settings.get("log_channel"))
+    summary_message_id = state.tracked.get(message_registry.SUMMARY)
+    if log_channel and summary_message_id:
+        message = log_channel.get_partial_message(summary_message_id)
+        try:
+            await rest("delete", log_channel, message.delete,
+                       PRIORITY_SUMMARY, key=("delete", summary_message_id))
+        except:
+            pass
+    await state.mutations.submit(state.close_day, guild_today(state))
+    state.tracked.forget(message_registry.SUMMARY)
 
 
-@bot.event
-async def on_interaction(interaction):
-    if interaction.type == discord.InteractionType.component:
-        cid = interaction.data.get("custom_id")
-        if cid == "respond_button":
-            await interaction.response.send_modal(TurfModal())
-        elif cid == "add_loa":
-            await interaction.response.send_modal(LOAModal())
-        elif cid == "remove_loa":
-            await interaction.response.send_message(
-                "Select an LOA to remove:",
-                view=RemoveLOAView(str(interaction.user.id)),
-                ephemeral=True)
+async def expire_guild_loas(state):
+    await state.mutations.submit(state.loa_index.sweep, guild_today(state))
+    await update_loa_list(state)
 
 
-@tasks.loop(minutes=1)
-async def turf_check():
-    now = datetime.now(ZoneInfo("Europe/London"))
-    if now.hour == settings.get("hour",
-                                DEFAULT_HOUR) and now.minute == settings.get(
-                                    "minute", DEFAULT_MINUTE):
-        responses.clear()
-        await send_turf_question()
-        await update_summary()
-
-
-@tasks.loop(minutes=1)
-async def clear_daily():
-    now = datetime.now(ZoneInfo("Europe/London"))
-    if now.hour == 0 and now.minute == 1:
-        log_channel = bot.get_channel(settings.get("log_channel"))
-        global summary_message_id
-        if log_channel and summary_message_id:
-            try:
-                msg = await log_channel.fetch_message(summary_message_id)
-                await msg.delete()
-            except:
-                pass
-        archive_today()
-        summary_message_id = None
-        responses.clear()
-        await update_loa_list()
+@tasks.loop(minutes=HISTORY_COMPACT_MINUTES)
+async def compact_history():
+    for state in guilds.loaded():
+        try:
+            await state.mutations.submit(state.apply_retention, guild_today(state))
+            await state.storage.maintenance()
+        except Exception as e:
+            print(f"Storage maintenance failed for {state.guild_id}: {e}")
+
+
+@bot.tree.command(name="setup",
+                  description="Admin: Set the channels the bot posts in")
+@app_commands.guild_only()
+async def setup(interaction: discord.Interaction,
+                turf: discord.TextChannel,
+                log: discord.TextChannel,
+                admin_panel: discord.TextChannel,
+                loa_list: discord.TextChannel):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
+        await interaction.response.send_message("❌ Not permitted.",
+                                                ephemeral=True)
+        return
+    await state.mutations.submit(
+        state.update_settings, {
+            "turf_channel": turf.id,
+            "log_channel": log.id,
+            "admin_panel_channel": admin_panel.id,
+            "loa_list_channel": loa_list.id
+        })
+    schedule_guild(state.guild_id)
+    await interaction.response.send_message("✅ Channels updated.",
+                                            ephemeral=True)
+    await send_admin_panel(state)
+    await update_loa_list(state)
 
 
-@bot.tree.command(name="loa",
-                  description="Log a leave of absence",
-                  guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="loa", description="Log a leave of absence")
+@app_commands.guild_only()
 async def loa(interaction: discord.Interaction):
     await interaction.response.send_modal(LOAModal())
 
 
-@bot.tree.command(name="removeloa",
-                  description="Remove your own LOAs",
-                  guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="removeloa", description="Remove your own LOAs")
+@app_commands.guild_only()
 async def removeloa(interaction: discord.Interaction):
-    loas = load_json(LOA_FILE, {})
-    user_id = str(interaction.user.id)
-    if user_id in loas:
-        del loas[user_id]
-        save_json(LOA_FILE, loas)
-        await update_loa_list()
+    state = await guilds.get(interaction.guild_id)
+    if await state.mutations.submit(state.loa_index.remove_user,
+                                    str(interaction.user.id)):
+        await update_loa_list(state)
         await interaction.response.send_message(
             "✅ Your LOAs have been removed.", ephemeral=True)
     else:
@@ -546,20 +995,18 @@ async def removeloa(interaction: discord.Interaction):
 
 
 @bot.tree.command(name="removeloauser",
-                  description="Admin: Remove LOAs for a user",
-                  guild=discord.Object(id=GUILD_ID))
+                  description="Admin: Remove LOAs for a user")
+@app_commands.guild_only()
 async def removeloauser(interaction: discord.Interaction,
                         member: discord.Member):
-    if not is_admin(interaction):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
         await interaction.response.send_message("❌ Not permitted.",
                                                 ephemeral=True)
         return
-    loas = load_json(LOA_FILE, {})
-    user_id = str(member.id)
-    if user_id in loas:
-        del loas[user_id]
-        save_json(LOA_FILE, loas)
-        await update_loa_list()
+    if await state.mutations.submit(state.loa_index.remove_user,
+                                    str(member.id)):
+        await update_loa_list(state)
         await interaction.response.send_message(
             f"✅ LOAs for {member.display_name} removed.", ephemeral=True)
     else:
@@ -567,54 +1014,46 @@ async def removeloauser(interaction: discord.Interaction,
             f"❌ No LOAs found for {member.display_name}.", ephemeral=True)
 
 
-@bot.tree.command(name="loas",
-                  description="View active or upcoming LOAs",
-                  guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="loas", description="View active or upcoming LOAs")
+@app_commands.guild_only()
 async def view_loas(interaction: discord.Interaction):
-    loas = load_json(LOA_FILE, {})
-    today = date.today()
-    output = []
-    for uid, records in loas.items():
-        member = interaction.guild.get_member(int(uid))
-        if not member:
-            continue
-        name = member.display_name
-        for entry in records:
-            start = datetime.strptime(entry["start"], "%Y-%m-%d").date()
-            end = datetime.strptime(entry["end"], "%Y-%m-%d").date()
-            if end >= today:
-                start_str = start.strftime("%d/%m/%Y")
-                end_str = end.strftime("%d/%m/%Y")
-                output.append(
-                    f"📅 **{name}** — {start_str} to {end_str} – {entry['reason']}"
-                )
-    if output:
-        await interaction.response.send_message("\n".join(output),
-                                                ephemeral=True)
-    else:
+    state = await guilds.get(interaction.guild_id)
+    lines = state.loa_board.lines(state.loa_index.active(guild_today(state)),
+                                  state.members.get)
+    if not lines:
         await interaction.response.send_message(
             "✅ No active or upcoming LOAs.", ephemeral=True)
+        return
+    pages = state.loa_board.paginate(lines)
+    await interaction.response.send_message(pages[0], ephemeral=True)
+    for page in pages[1:]:
+        await interaction.followup.send(page, ephemeral=True)
 
 
 @bot.tree.command(name="setmessage",
-                  description="Set turf announcement message",
-                  guild=discord.Object(id=GUILD_ID))
+                  description="Set turf announcement message")
+@app_commands.guild_only()
 async def setmessage(interaction: discord.Interaction, text: str):
-    if not is_admin(interaction):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
         await interaction.response.send_message("❌ Not permitted.",
                                                 ephemeral=True)
         return
-    settings["announcement"] = text
-    save_json(SETTINGS_FILE, settings)
+    await state.mutations.submit(state.update_settings,
+                                 {"announcement": text})
     await interaction.response.send_message("✅ Announcement message updated.",
                                             ephemeral=True)
 
 
 @bot.tree.command(name="settime",
-                  description="Set turf announcement time (hour minute)",
-                  guild=discord.Object(id=GUILD_ID))
-async def settime(interaction: discord.Interaction, hour: int, minute: int):
-    if not is_admin(interaction):
+                  description="Set turf announcement time (hour minute)")
+@app_commands.guild_only()
+@app_commands.describe(
+    timezone="IANA timezone, e.g. Europe/London (default: unchanged)")
+async def settime(interaction: discord.Interaction, hour: int, minute: int,
+                  timezone: str = None):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
         await interaction.response.send_message("❌ Not permitted.",
                                                 ephemeral=True)
         return
@@ -622,140 +1061,491 @@ async def settime(interaction: discord.Interaction, hour: int, minute: int):
         await interaction.response.send_message(
             "❌ Invalid time. Hour 0-23, minute 0-59.", ephemeral=True)
         return
-    settings["hour"] = hour
-    settings["minute"] = minute
-    save_json(SETTINGS_FILE, settings)
+    changes = {"hour": hour, "minute": minute}
+    if timezone:
+        try:
+            ZoneInfo(timezone.strip())
+        except (ZoneInfoNotFoundError, ValueError):
+            await interaction.response.send_message(
+                f"❌ Unknown timezone {timezone}.", ephemeral=True)
+            return
+        changes["timezone"] = timezone.strip()
+    await state.mutations.submit(state.update_settings, changes)
+    schedule_guild(state.guild_id)
+    reschedule_guild(state.guild_id)
     await interaction.response.send_message(
-        f"✅ Turf time set to {hour:02d}:{minute:02d}.", ephemeral=True)
+        f"✅ Turf time set to {hour:02d}:{minute:02d} "
+        f"({guild_timezone(state).key}).", ephemeral=True)
+
+
+@bot.tree.command(name="retention",
+                  description="Admin: Set how long detailed history is kept")
+@app_commands.guild_only()
+@app_commands.describe(
+    raw_days="Days to keep every individual response",
+    daily_days="Days to keep each member's final answer per day (0 = forever)")
+async def retention(interaction: discord.Interaction, raw_days: int,
+                    daily_days: int):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
+        await interaction.response.send_message("❌ Not permitted.",
+                                                ephemeral=True)
+        return
+    if raw_days < 1 or (daily_days and daily_days < raw_days):
+        await interaction.response.send_message(
+            "❌ Raw days must be at least 1 and daily days at least raw days "
+            "(or 0 to keep daily history forever).", ephemeral=True)
+        return
+    await state.mutations.submit(state.update_settings, {
+        "history_raw_days": raw_days,
+        "history_daily_days": daily_days or None
+    })
+    rolled = await state.mutations.submit(state.apply_retention, guild_today(state))
+    kept = f"{daily_days} days" if daily_days else "forever"
+    await interaction.response.send_message(
+        f"✅ Keeping every response for {raw_days} days and daily answers "
+        f"{kept}. Rolled up {rolled} records; attendance totals are "
+        f"unchanged.", ephemeral=True)
 
 
-@bot.tree.command(name="forcesummary",
-                  description="Force update summary now",
-                  guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="forcesummary", description="Force update summary now")
+@app_commands.guild_only()
 async def forcesummary(interaction: discord.Interaction):
-    if not is_admin(interaction):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
         await interaction.response.send_message("❌ Not permitted.",
                                                 ephemeral=True)
         return
-    await update_loa_list()
-    await update_summary(force=True)
+    await update_loa_list(state)
+    await update_summary(state, force=True)
     await interaction.response.send_message("✅ Summary updated.",
                                             ephemeral=True)
 
 
 @bot.tree.command(name="clearhistory",
-                  description="Admin: Clear history for user or all",
-                  guild=discord.Object(id=GUILD_ID))
+                  description="Admin: Clear history for user or all")
+@app_commands.guild_only()
 async def clearhistory(interaction: discord.Interaction,
                        member: discord.Member = None):
-    if not is_admin(interaction):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
         await interaction.response.send_message("❌ Not permitted.",
                                                 ephemeral=True)
         return
     # Clear history + responses + LOAs for member or all
     if member is None:
         # Clear all
-        for file in os.listdir(ARCHIVE_FOLDER):
-            os.remove(os.path.join(ARCHIVE_FOLDER, file))
-        for file in [HISTORY_FILE, LOA_FILE]:
-            if os.path.exists(file):
-                os.remove(file)
-        responses.clear()
+        await state.mutations.submit(state.clear_all_records)
         await interaction.response.send_message(
             "✅ Cleared all history, LOAs and responses.", ephemeral=True)
     else:
-        uid = str(member.id)
-        history = load_json(HISTORY_FILE, {})
-        loas = load_json(LOA_FILE, {})
-        if uid in history:
-            del history[uid]
-        if uid in loas:
-            del loas[uid]
-        save_json(HISTORY_FILE, history)
-        save_json(LOA_FILE, loas)
-        if uid in responses:
-            del responses[uid]
+        await state.mutations.submit(state.clear_member_records,
+                                     str(member.id))
         await interaction.response.send_message(
             f"✅ Cleared history, LOAs and responses for {member.display_name}.",
             ephemeral=True)
 
 
-@bot.tree.command(name="stats",
-                  description="Check attendance stats",
-                  guild=discord.Object(id=GUILD_ID))
+@bot.tree.command(name="stats", description="Check attendance stats")
+@app_commands.guild_only()
 async def stats(interaction: discord.Interaction,
                 member: discord.Member = None):
+    state = await guilds.get(interaction.guild_id)
     member = member or interaction.user
     uid = str(member.id)
-    history = load_json(HISTORY_FILE, {})
-    user_data = history.get(uid, [])
-    total = len(user_data)
-    yes = sum(1 for x in user_data if x["available"] == "yes")
-    no = total - yes
-    reasons = [x["reason"] for x in user_data if x["reason"]]
-    common = max(set(reasons), key=reasons.count) if reasons else "N/A"
-    percent = round((yes / total) * 100, 1) if total > 0 else 0
+    user_stats = state.attendance.get(uid)
+    total = user_stats.total if user_stats else 0
+    yes = user_stats.yes if user_stats else 0
+    yes_later = user_stats.yes_later if user_stats else 0
+    no = user_stats.no if user_stats else 0
+    common = user_stats.top_reason if user_stats and user_stats.top_reason else "N/A"
+    percent = round(user_stats.percent, 1) if total > 0 else 0
+
+    today = guild_today(state)
+    rolling = []
+    for days in WINDOWS:
+        hit, counted = state.analytics.window(uid, today, days)
+        rate = f"{hit / counted * 100:.1f}% ({hit}/{counted})" if counted else "N/A"
+        rolling.append(f"Last {days} days: {rate}")
+    trend = state.analytics.trend(uid, today)
+    trend = f"{trend:+.1f} pts" if trend is not None else "N/A"
 
     await interaction.response.send_message(
         f"📊 **Stats for {member.display_name}**\n"
         f"Total responses: {total}\n"
         f"✅ Yes: {yes}\n"
+        f"⏰ Yes but later: {yes_later}\n"
         f"❌ No: {no}\n"
         f"📈 Attendance: {percent}%\n"
+        f"📆 {' | '.join(rolling)}\n"
+        f"🔥 Current streak: {state.analytics.current_streak(uid, today)} "
+        f"(longest {state.analytics.longest_streak(uid, today)})\n"
+        f"📉 Week over week: {trend}\n"
         f"📝 Most common reason: {common}",
         ephemeral=True)
 
 
+LEADERBOARD_METRICS = {
+    "all": "All time",
+    "7": "Last 7 days",
+    "30": "Last 30 days",
+    "90": "Last 90 days",
+    "streak": "Current streak",
+    "trend": "Week over week",
+}
+
+
+def rolling_leaderboard(state, metric, today, n=5):
+    # (uid, line) pairs for the windowed, streak and trend rankings
+    analytics = state.analytics
+    if metric == "streak":
+        scored = [(analytics.current_streak(uid, today), uid)
+                  for uid in analytics.active(today, 90)]
+        scored = [(streak, uid) for streak, uid in scored if streak]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(uid, f"{streak} turf days in a row")
+                for streak, uid in scored[:n]]
+    if metric == "trend":
+        scored = []
+        for uid in analytics.active(today, 14):
+            change = analytics.trend(uid, today)
+            if change is not None:
+                scored.append((change, uid))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(uid, f"{change:+.1f} pts this week")
+                for change, uid in scored[:n]]
+    days = int(metric)
+    scored = []
+    for uid in analytics.active(today, days):
+        hit, counted = analytics.window(uid, today, days)
+        if counted:
+            scored.append((hit / counted * 100, counted, uid))
+    scored.sort(key=lambda item: (-item[0], -item[1], item[2]))
+    return [(uid, f"{rate:.1f}% attendance ({counted} turf days)")
+            for rate, counted, uid in scored[:n]]
+
+
 @bot.tree.command(name="leaderboard",
-                  description="Show attendance leaderboard",
-                  guild=discord.Object(id=GUILD_ID))
-async def leaderboard(interaction: discord.Interaction):
-    history = load_json(HISTORY_FILE, {})
-    scores = []
-    for uid, entries in history.items():
-        total = len(entries)
-        if total < MIN_RESPONSES_FOR_LEADERBOARD:
-            continue
-        yes = sum(1 for x in entries if x["available"] == "yes")
-        percent = (yes / total) * 100
-        scores.append((uid, percent, total))
-    scores.sort(key=lambda x: x[1], reverse=True)
+                  description="Show attendance leaderboard")
+@app_commands.guild_only()
+@app_commands.choices(metric=[
+    app_commands.Choice(name=label, value=value)
+    for value, label in LEADERBOARD_METRICS.items()
+])
+async def leaderboard(interaction: discord.Interaction,
+                      metric: app_commands.Choice[str] = None):
+    state = await guilds.get(interaction.guild_id)
+    metric = metric.value if metric else "all"
+    today = guild_today(state)
+    if metric == "all":
+        ranked = [(uid, f"{user_stats.percent:.1f}% attendance "
+                   f"({user_stats.total} responses)")
+                  for uid, user_stats in state.attendance.top(5)]
+    else:
+        ranked = rolling_leaderboard(state, metric, today)
     lines = []
-    for i, (uid, percent, total) in enumerate(scores[:5], 1):
-        member = bot.get_guild(GUILD_ID).get_member(int(uid))
-        name = member.display_name if member else f"User ID {uid}"
-        lines.append(
-            f"**{i}. {name}** - {percent:.1f}% attendance ({total} responses)")
+    for i, (uid, detail) in enumerate(ranked, 1):
+        name = state.members.get(uid) or f"User ID {uid}"
+        lines.append(f"**{i}. {name}** - {detail}")
     if not lines:
         await interaction.response.send_message(
             "No sufficient data for leaderboard.", ephemeral=True)
         return
-    await interaction.response.send_message("🏆 **Attendance Leaderboard:**\n" +
-                                            "\n".join(lines),
+    title = "🏆 **Attendance Leaderboard:**"
+    if metric != "all":
+        title = f"🏆 **Attendance Leaderboard ({LEADERBOARD_METRICS[metric]}):**"
+    if metric == "trend":
+        this_week = state.analytics.roster_rate(today, 7)
+        last_week = state.analytics.roster_rate(today, 7, offset=7)
+        if this_week is not None and last_week is not None:
+            title += (f"\nRoster: {this_week:.1f}% this week vs "
+                      f"{last_week:.1f}% last week")
+    await interaction.response.send_message(title + "\n" + "\n".join(lines),
+                                            ephemeral=True)
+
+
+@bot.tree.command(name="history",
+                  description="Admin: Show archived responses for a date range")
+@app_commands.guild_only()
+@app_commands.describe(start="First day (dd/mm/yyyy)",
+                       end="Last day (dd/mm/yyyy)")
+@app_commands.choices(availability=[
+    app_commands.Choice(name=label, value=value)
+    for value, label in AVAILABILITY_LABELS.items()
+])
+async def history(interaction: discord.Interaction,
+                  start: str,
+                  end: str,
+                  member: discord.Member = None,
+                  availability: app_commands.Choice[str] = None):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
+        await interaction.response.send_message("❌ Not permitted.",
+                                                ephemeral=True)
+        return
+    try:
+        start_day = datetime.strptime(start.strip(), "%d/%m/%Y").date()
+        end_day = datetime.strptime(end.strip(), "%d/%m/%Y").date()
+    except ValueError:
+        await interaction.response.send_message(
+            "❌ Invalid date format. Use dd/mm/yyyy.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+
+    # Rows are streamed from storage and sent a message at a time
+    chunk, sent, count = "", 0, 0
+    rows = state.storage.archive_range(
+        start_day.isoformat(), end_day.isoformat(),
+        uid=str(member.id) if member else None,
+        available=availability.value if availability else None)
+    for day, uid, record in rows:
+        count += 1
+        reason = f" – {record['reason']}" if record.get("reason") else ""
+        line = (f"{date.fromisoformat(day).strftime('%d/%m/%Y')} "
+                f"**{record['name']}**: "
+                f"{AVAILABILITY_LABELS.get(record['available'], record['available'])}"
+                f"{reason}")
+        if len(chunk) + len(line) + 1 > PAGE_LIMIT:
+            if sent == HISTORY_MAX_MESSAGES - 1:
+                chunk += "\n… more results, narrow the range or filters."
+                break
+            await interaction.followup.send(chunk, ephemeral=True)
+            sent += 1
+            chunk = ""
+        chunk += ("\n" if chunk else "") + line
+    if count == 0:
+        chunk = "No archived responses in that range."
+    await interaction.followup.send(chunk, ephemeral=True)
+
+
+EXPORT_KINDS = {
+    "all": "Everything",
+    "history": "Response history",
+    "loas": "LOAs",
+    "archive": "Archived days",
+}
+EXPORT_YIELD_ROWS = 1000  # rows written between yields to the event loop
+
+
+@bot.tree.command(name="export",
+                  description="Admin: Download history, LOAs and archives")
+@app_commands.guild_only()
+@app_commands.describe(start="First day (dd/mm/yyyy)",
+                       end="Last day (dd/mm/yyyy)",
+                       file_format="JSON lines or CSV, gzip-compressed")
+@app_commands.choices(
+    kind=[
+        app_commands.Choice(name=label, value=value)
+        for value, label in EXPORT_KINDS.items()
+    ],
+    file_format=[
+        app_commands.Choice(name=fmt.upper(), value=fmt)
+        for fmt in bulk.FORMATS
+    ],
+    availability=[
+        app_commands.Choice(name=label, value=value)
+        for value, label in AVAILABILITY_LABELS.items()
+    ])
+async def export(interaction: discord.Interaction,
+                 kind: app_commands.Choice[str] = None,
+                 file_format: app_commands.Choice[str] = None,
+                 start: str = None,
+                 end: str = None,
+                 member: discord.Member = None,
+                 availability: app_commands.Choice[str] = None):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
+        await interaction.response.send_message("❌ Not permitted.",
+                                                ephemeral=True)
+        return
+    try:
+        start_day = (datetime.strptime(start.strip(), "%d/%m/%Y").date()
+                     if start else None)
+        end_day = (datetime.strptime(end.strip(), "%d/%m/%Y").date()
+                   if end else None)
+    except ValueError:
+        await interaction.response.send_message(
+            "❌ Invalid date format. Use dd/mm/yyyy.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+
+    kinds = (bulk.KINDS if kind is None or kind.value == "all" else
+             (kind.value, ))
+    fmt = file_format.value if file_format else "jsonl"
+    # Rows are streamed into a compressed temporary file, never held in
+    # memory, and the loop gets a turn every EXPORT_YIELD_ROWS rows
+    with tempfile.TemporaryFile() as f:
+        writer = bulk.RowWriter(f, fmt)
+        rows = bulk.export_rows(
+            state.storage, state.loa_index, kinds,
+            start_day.isoformat() if start_day else None,
+            end_day.isoformat() if end_day else None,
+            uid=str(member.id) if member else None,
+            available=availability.value if availability else None)
+        for row in rows:
+            writer.write(row)
+            if writer.count % EXPORT_YIELD_ROWS == 0:
+                await asyncio.sleep(0)
+        writer.close()
+        if writer.count == 0:
+            await interaction.followup.send("No records match those filters.",
+                                            ephemeral=True)
+            return
+        size = f.tell()
+        if size > interaction.guild.filesize_limit:
+            await interaction.followup.send(
+                f"❌ The export is {size // 1024} KB, over this server's "
+                f"upload limit. Narrow the range or filters.", ephemeral=True)
+            return
+        f.seek(0)
+        name = f"turf-{'-'.join(kinds)}-{guild_today(state).isoformat()}.{fmt}.gz"
+        await interaction.followup.send(
+            f"📦 Exported {writer.count} records.",
+            file=discord.File(f, filename=name), ephemeral=True)
+
+
+@bot.tree.command(name="import",
+                  description="Admin: Import history, LOAs and archives")
+@app_commands.guild_only()
+@app_commands.describe(
+    file="A CSV or JSON lines file from /export, optionally gzipped")
+async def import_records(interaction: discord.Interaction,
+                         file: discord.Attachment):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
+        await interaction.response.send_message("❌ Not permitted.",
+                                                ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    importer = bulk.Importer(state)
+    with tempfile.TemporaryFile() as f:
+        await file.save(f)
+        f.seek(0)
+        # Each batch is one mutation, so live responses interleave with
+        # the import instead of waiting for all of it
+        for batch in importer.batches(bulk.read_rows(f)):
+            await state.mutations.submit(importer.apply, batch)
+            await state.storage.flush()
+    if importer.counts["loas"]:
+        await update_loa_list(state)
+    await interaction.followup.send(f"📥 {importer.summary()}"[:PAGE_LIMIT],
+                                    ephemeral=True)
+
+
+REASON_PERIODS = {
+    "7": "Last 7 days",
+    "30": "Last 30 days",
+    "90": "Last 90 days",
+    "all": "All time",
+}
+REASON_TOP_K = 10
+REASON_SEARCH_LIMIT = 20
+
+
+@bot.tree.command(name="reasons",
+                  description="Admin: Search absence reasons or show the top ones")
+@app_commands.guild_only()
+@app_commands.describe(keywords="Words every reason must contain",
+                       member="Only search this member's reasons")
+@app_commands.choices(period=[
+    app_commands.Choice(name=label, value=value)
+    for value, label in REASON_PERIODS.items()
+])
+async def reasons(interaction: discord.Interaction,
+                  keywords: str = None,
+                  period: app_commands.Choice[str] = None,
+                  member: discord.Member = None):
+    state = await guilds.get(interaction.guild_id)
+    if not is_admin(state, interaction):
+        await interaction.response.send_message("❌ Not permitted.",
+                                                ephemeral=True)
+        return
+    period = period.value if period else "30"
+    today = guild_today(state)
+    start = end = None
+    if period != "all":
+        start = (today - timedelta(days=int(period) - 1)).isoformat()
+        end = today.isoformat()
+
+    if keywords:
+        matches = state.reasons.search(keywords, start, end,
+                                       uid=str(member.id) if member else None,
+                                       limit=REASON_SEARCH_LIMIT)
+        lines = []
+        for record in matches:
+            name = state.members.get(record.uid) or f"User ID {record.uid}"
+            when = date.fromisoformat(record.start).strftime("%d/%m/%Y")
+            if record.end != record.start:
+                when += " to " + date.fromisoformat(
+                    record.end).strftime("%d/%m/%Y")
+            kind = "LOA" if record.kind == "loa" else "Response"
+            lines.append(f"{when} **{name}** ({kind}): {record.reason}")
+        title = f"🔎 **Reasons matching \"{keywords}\" ({REASON_PERIODS[period]}):**"
+        empty = "No matching reasons."
+    else:
+        top = state.reasons.top(REASON_TOP_K, start, end)
+        lines = [f"**{i}. {reason}** - {n}" for i, (reason, n) in enumerate(top, 1)]
+        title = f"📝 **Top absence reasons ({REASON_PERIODS[period]}):**"
+        empty = "No reasons recorded."
+    text = title + "\n" + ("\n".join(lines) if lines else empty)
+    await interaction.response.send_message(text[:PAGE_LIMIT],
                                             ephemeral=True)
 
 
-def is_admin(interaction):
-    return any(role.id in settings.get("admin_roles", [])
+def is_admin(state, interaction):
+    return any(role.id in state.settings.get("admin_roles", [])
                for role in interaction.user.roles
                ) or interaction.user.guild_permissions.administrator
 
 
 @bot.event
-async def on_member_remove(member):
+async def on_raw_member_remove(payload):
     # Remove LOA if user leaves server
-    loas = load_json(LOA_FILE, {})
-    user_id = str(member.id)
-    if user_id in loas:
-        del loas[user_id]
-        save_json(LOA_FILE, loas)
-        await update_loa_list()
+    state = await guilds.get(payload.guild_id)
+    state.members.remove(payload.user.id)
+    if await state.mutations.submit(state.loa_index.remove_user,
+                                    str(payload.user.id)):
+        await update_loa_list(state)
+
+
+@bot.event
+async def on_member_join(member):
+    await note_member(await guilds.get(member.guild.id), member)
+
+
+@bot.event
+async def on_interaction(interaction):
+    # With no member cache, interactions are where renames are seen
+    if interaction.guild_id and isinstance(interaction.user, discord.Member):
+        await note_member(await guilds.get(interaction.guild_id),
+                          interaction.user)
+
+
+@bot.event
+async def on_guild_join(guild):
+    schedule_guild(guild.id)
+
+
+@bot.event
+async def on_guild_remove(guild):
+    # Data is kept in case the bot is invited back
+    unschedule_guild(guild.id)
 
 async def handle(request):
     return web.Response(text="Bot is alive!")
 
+async def handle_metrics(request):
+    return web.Response(text=metrics.REGISTRY.render(),
+                        content_type="text/plain",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+async def handle_ready(request):
+    return web.json_response(startup.status(),
+                             status=200 if startup.ready else 503)
+
 app = web.Application()
-app.add_routes([web.get('/', handle)])
+app.add_routes([web.get('/', handle), web.get('/metrics', handle_metrics),
+                web.get('/ready', handle_ready)])
 
 async def start_webserver():
     runner = web.AppRunner(app)
@@ -767,28 +1557,59 @@ async def start_webserver():
 
 
 
+async def sync_commands():
+    # Skip the sync when the tree is unchanged since the last one
+    home = guilds.peek(HOME_GUILD_ID)
+    digest = tree_hash(bot.tree, bot.application_id)
+    if home.settings.get("command_tree_hash") == digest:
+        print("Slash commands unchanged, sync skipped.")
+        return
+    await bot.tree.sync()
+    # Drop the copies that used to be registered on the home guild only
+    await bot.tree.sync(guild=discord.Object(id=HOME_GUILD_ID))
+    await home.mutations.submit(home.update_settings,
+                                {"command_tree_hash": digest})
+    print("Slash commands synced.")
+
+
+async def schedule_guilds():
+    # Only settings are read here; history and LOAs load on first use
+    for guild in bot.guilds:
+        schedule_guild(guild.id)
+        await asyncio.sleep(0)
+
+
+async def refresh_home_guild():
+    state = await guilds.get(HOME_GUILD_ID)
+    await asyncio.gather(update_loa_list(state), send_admin_panel(state))
+    if state.responses:
+        # A session restored after a restart edits the existing summary
+        await update_summary(state)
+
+
 @bot.event
 async def on_ready():
-    print(f"Logged in as {bot.user}")
+    print(f"Logged in as {bot.user} on {len(bot.guilds)} guilds "
+          f"({bot.shard_count} shards)")
+    # on_ready fires again after gateway reconnects; start up only once
+    if startup.started:
+        return
+    startup.started = True
+
+    await asyncio.gather(
+        startup.phase("sync_commands", sync_commands()),
+        startup.phase("schedule_guilds", schedule_guilds()),
+        startup.phase("home_guild", refresh_home_guild()))
+    asyncio.create_task(scheduler.run())
+    asyncio.create_task(monitor_event_loop())
+    compact_history.start()
+    startup.mark_ready()
+    print(f"Ready in {startup.phases['total']}s: {startup.phases}")
 
-    # Start webserver for Uptime Robot pings
-    bot.loop.create_task(start_webserver())
 
-    guild = discord.Object(id=GUILD_ID)
+if __name__ == "__main__":
     try:
-        await bot.tree.sync(guild=guild)
-        print("Slash commands synced.")
+        lock_data()
+        bot.run(os.environ['TOKEN'])
     except Exception as e:
-        print(f"Failed to sync commands: {e}")
-    load_all()
-    await update_loa_list()
-    await send_admin_panel()
-    turf_check.start()
-    clear_daily.start()
-
-
-try:
-    bot.run(os.environ['TOKEN'])
-except Exception as e:
-    print(f"Bot failed to start: {e}")
-
+        print(f"Bot failed to start: {e}")
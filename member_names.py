@@ -0,0 +1,40 @@
+"""Member ID -> display name map for one guild, kept in storage.
+
+discord.py caches no members and guilds are never chunked. Names are
+recorded from the member behind each interaction and from member join
+and remove events, and saved so the LOA list and leaderboards still
+show them after a restart.
+"""
+
+
+class MemberNames:
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.names = {}
+
+    def load(self):
+        # Names recorded before the guild was loaded are kept
+        names = dict(self.storage.load_member_names())
+        names.update(self.names)
+        self.names = names
+
+    def get(self, uid):
+        return self.names.get(str(uid))
+
+    def set(self, uid, name):
+        # Returns True if the name changed
+        uid = str(uid)
+        if self.names.get(uid) == name:
+            return False
+        self.names[uid] = name
+        self.storage.save_member_name(uid, name)
+        return True
+
+    def remove(self, uid):
+        uid = str(uid)
+        if self.names.pop(uid, None) is not None:
+            self.storage.save_member_name(uid, None)
+
+    def __len__(self):
+        return len(self.names)
@@ -0,0 +1,35 @@
+"""Persistent IDs of the bot's own long-lived messages, keyed by purpose."""
+
+
+SUMMARY = "summary_message_id"
+LOA_LIST = "loa_message_id"
+TURF_QUESTION = "last_turf_message_id"
+ADMIN_PANEL = "admin_info_message_id"
+
+
+
+def page(purpose, index):
+    # Later pages of a multi-message purpose are tracked as purpose:N
+    return purpose if index == 0 else f"{purpose}:{index}"
+
+
+class MessageRegistry:
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.ids = {}
+
+    def load(self):
+        self.ids = dict(self.storage.load_message_ids())
+
+    def get(self, purpose):
+        return self.ids.get(purpose)
+
+    def set(self, purpose, message_id):
+        if self.ids.get(purpose) == message_id:
+            return
+        self.ids[purpose] = message_id
+        self.storage.save_message_ids(self.ids)
+
+    def forget(self, purpose):
+        self.set(purpose, None)
@@ -0,0 +1,91 @@
+"""Single-writer actor for state mutations.
+
+Handlers submit plain (synchronous) mutation functions; one worker task
+applies them strictly in submission order, so no read-modify-write can
+interleave with another at an await point. Everything queued at the
+same moment is applied as one batch inside storage.batch(), so
+persistence is committed once per batch instead of once per mutation.
+Each mutation, and its share of the commit, is recorded as a span in
+the trace of the handler that submitted it.
+"""
+import asyncio
+import time
+
+import tracing
+
+
+MAX_BATCH = 64
+
+
+class MutationQueue:
+
+    def __init__(self, storage, max_batch=MAX_BATCH):
+        self.storage = storage
+        self.max_batch = max_batch
+        self._queue = None
+        self._worker = None
+        self.applied = 0
+        self.batches = 0
+
+    def depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, mutation, *args):
+        # Returns mutation(*args), or raises what it raised
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((mutation, args, future, tracing.current(),
+                                time.perf_counter()))
+        return await future
+
+    def _apply(self, mutation, args, trace, queued):
+        start = time.perf_counter()
+        try:
+            with tracing.activate(trace):
+                return mutation(*args)
+        finally:
+            if trace is not None:
+                trace.add("mutation", start, time.perf_counter() - start, {
+                    "fn": getattr(mutation, "__qualname__", repr(mutation)),
+                    "queued": round(start - queued, 6)
+                })
+
+    async def _run(self):
+        tracing.detach()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            outcomes = []
+            try:
+                with self.storage.batch():
+                    for mutation, args, future, trace, queued in batch:
+                        try:
+                            outcomes.append(
+                                (future,
+                                 self._apply(mutation, args, trace, queued),
+                                 None))
+                        except Exception as e:
+                            outcomes.append((future, None, e))
+                    commit_start = time.perf_counter()
+            except Exception as e:
+                # Committing the batch failed, so nothing in it is durable
+                outcomes = [(future, None, e) for _, _, future, _, _ in batch]
+            else:
+                commit_seconds = time.perf_counter() - commit_start
+                for trace in {item[3] for item in batch} - {None}:
+                    trace.add("storage.commit", commit_start, commit_seconds,
+                              {"batch": len(batch)})
+            # Results are handed back only once the batch is persisted
+            for future, result, error in outcomes:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            self.applied += len(batch)
+            self.batches += 1
@@ -0,0 +1,224 @@
+"""One prioritised, rate-limited queue for the bot's Discord REST calls.
+
+Callers submit a zero-argument function that starts the call, so work
+that is still waiting can be replaced without ever being started. Each
+channel has a token bucket sized to Discord's per-channel limit, and a
+global bucket covers the bot as a whole. Among the calls that have a
+token, the highest priority goes first, so the turf ping is not stuck
+behind an LOA list refresh. A call submitted with the same key as one
+that is still pending (an edit of the same message, say) replaces it,
+and both callers get the result of the newer call. Queue wait and call
+time are recorded in the trace of every caller waiting on a call.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+import tracing
+
+
+# Lower runs first
+PRIORITY_TURF = 0
+PRIORITY_SUMMARY = 1
+PRIORITY_LOA_LIST = 2
+PRIORITY_ADMIN_PANEL = 3
+
+CHANNEL_CAPACITY = 5  # Discord allows about 5 messages per 5s per channel
+CHANNEL_SECONDS = 5.0
+GLOBAL_CAPACITY = 50  # and 50 requests per second overall
+GLOBAL_SECONDS = 1.0
+MAX_IN_FLIGHT = 8
+
+
+class TokenBucket:
+
+    def __init__(self, capacity, seconds):
+        self.capacity = capacity
+        self.rate = capacity / seconds
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        # Seconds until a token is available
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Call:
+    __slots__ = ("kind", "channel_id", "start", "key", "futures", "traces",
+                 "started")
+
+    def __init__(self, kind, channel_id, start, key):
+        self.kind = kind
+        self.channel_id = channel_id
+        self.start = start
+        self.key = key
+        self.futures = []
+        # (trace, submitted at) for each traced caller
+        self.traces = []
+        self.started = False
+
+
+class Outbox:
+
+    def __init__(self,
+                 channel_capacity=CHANNEL_CAPACITY,
+                 channel_seconds=CHANNEL_SECONDS,
+                 global_capacity=GLOBAL_CAPACITY,
+                 global_seconds=GLOBAL_SECONDS,
+                 max_in_flight=MAX_IN_FLIGHT,
+                 observer=None):
+        # observer(kind, outcome) with outcome "sent", "failed" or
+        # "superseded"
+        self.channel_capacity = channel_capacity
+        self.channel_seconds = channel_seconds
+        self.global_bucket = TokenBucket(global_capacity, global_seconds)
+        self.max_in_flight = max_in_flight
+        self.observer = observer
+        self.buckets = {}
+        self.in_flight = 0
+        self._heap = []
+        self._pending = {}
+        self._count = 0
+        self._order = itertools.count()
+        self._wake = None
+        self._worker = None
+
+    def depth(self):
+        # Calls waiting to start
+        return self._count
+
+    def submit(self, kind, channel_id, start, priority, key=None):
+        # Returns a future for the call's result; start() must return the
+        # coroutine that makes the call
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        call = self._pending.get(key) if key is not None else None
+        if call is not None:
+            call.start = start
+            self._observe(kind, "superseded")
+        else:
+            call = _Call(kind, channel_id, start, key)
+            self._count += 1
+            if key is not None:
+                self._pending[key] = call
+        call.futures.append(future)
+        trace = tracing.current()
+        if trace is not None:
+            call.traces.append((trace, time.perf_counter()))
+        # A call raised to a higher priority is simply pushed again; the
+        # stale heap entry is skipped once the call has started
+        heapq.heappush(self._heap, (priority, next(self._order), call))
+        self._ensure_worker()
+        self._wake.set()
+        return future
+
+    def _observe(self, kind, outcome):
+        if self.observer:
+            self.observer(kind, outcome)
+
+    def _bucket(self, channel_id):
+        bucket = self.buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.buckets[channel_id] = TokenBucket(
+                self.channel_capacity, self.channel_seconds)
+        return bucket
+
+    def _ensure_worker(self):
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    def _next_ready(self, now):
+        # Pops the best call that has a token; otherwise returns how long
+        # to wait for one
+        wait = self.global_bucket.wait_time(now)
+        if wait or self.in_flight >= self.max_in_flight:
+            return None, wait or None
+        blocked, chosen, delay = [], None, None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            call = entry[2]
+            if call.started:
+                continue
+            wait = self._bucket(call.channel_id).wait_time(now)
+            if not wait:
+                chosen = call
+                break
+            blocked.append(entry)
+            delay = wait if delay is None else min(delay, wait)
+        for entry in blocked:
+            heapq.heappush(self._heap, entry)
+        return chosen, delay
+
+    async def _run(self):
+        tracing.detach()
+        while True:
+            self._wake.clear()
+            now = time.monotonic()
+            call, delay = self._next_ready(now)
+            if call is None:
+                if delay is None and not self._heap and not self.in_flight:
+                    self._drop_idle_buckets(now)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            call.started = True
+            self._count -= 1
+            if call.key is not None:
+                self._pending.pop(call.key, None)
+            self.global_bucket.take(now)
+            self._bucket(call.channel_id).take(now)
+            self.in_flight += 1
+            asyncio.create_task(self._execute(call))
+
+    async def _execute(self, call):
+        started = time.perf_counter()
+        try:
+            result = await call.start()
+        except Exception as e:
+            self._trace(call, started, type(e).__name__)
+            self._observe(call.kind, "failed")
+            for future in call.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            self._trace(call, started)
+            self._observe(call.kind, "sent")
+            for future in call.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.in_flight -= 1
+            self._wake.set()
+
+    @staticmethod
+    def _trace(call, started, error=None):
+        seconds = time.perf_counter() - started
+        for trace, submitted in call.traces:
+            attrs = {"queued": round(started - submitted, 6)}
+            if error:
+                attrs["error"] = error
+            trace.add(f"discord.{call.kind}", started, seconds, attrs)
+
+    def _drop_idle_buckets(self, now):
+        # Full buckets carry no state worth keeping
+        for channel_id in [c for c, b in self.buckets.items() if b.full(now)]:
+            del self.buckets[channel_id]
@@ -0,0 +1,115 @@
+"""Atomic JSON writes on a bounded thread pool.
+
+Writes land in a temp file next to the target, are fsynced and then
+renamed into place, so a crash never leaves a truncated file. Requests
+for the same path that arrive while a write is in flight are merged:
+only the newest state is written once the current write finishes.
+Other blocking writes (SQLite transactions) can be queued on the same
+pool with run(); calls sharing a key run one at a time, in order.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import file_label, storage_seconds
+
+
+WRITER_THREADS = 2
+
+
+def write_atomic(path, data, indent=None):
+    with storage_seconds.time(op="save", file=file_label(path)):
+        _write_atomic(path, data, indent)
+
+
+def write_bytes_atomic(path, payload):
+    with storage_seconds.time(op="save", file=file_label(path)):
+        _replace(path, payload, 'wb')
+
+
+def _write_atomic(path, data, indent):
+    if indent is None:
+        text = json.dumps(data, separators=(",", ":"))
+    else:
+        text = json.dumps(data, indent=indent)
+    _replace(path, text, 'w')
+
+
+def _replace(path, payload, mode):
+    tmp = path + ".tmp"
+    with open(tmp, mode) as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(os.path.dirname(path) or ".", os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class AtomicWriter:
+
+    def __init__(self, max_workers=WRITER_THREADS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="writer")
+        self._pending = {}
+        self._calls = {}
+        self._active = {}
+
+    def write_json(self, path, snapshot, indent=2):
+        # snapshot() is called on the event loop right before the write
+        # starts and must return a structure the loop will not mutate
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            write_atomic(path, snapshot(), indent)
+            return
+        self._pending[path] = (snapshot, indent)
+        if path not in self._active:
+            self._active[path] = loop.create_task(self._drain(path))
+
+    async def _drain(self, path):
+        loop = asyncio.get_running_loop()
+        try:
+            while path in self._pending:
+                snapshot, indent = self._pending.pop(path)
+                try:
+                    await loop.run_in_executor(self._executor, write_atomic,
+                                               path, snapshot(), indent)
+                except Exception as e:
+                    print(f"Error writing {path}: {e}")
+        finally:
+            del self._active[path]
+
+    def run(self, key, call):
+        # Runs call() on the pool after every earlier call for key; with
+        # no event loop running it runs right away
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            call()
+            return
+        self._calls.setdefault(key, []).append(call)
+        if key not in self._active:
+            self._active[key] = loop.create_task(self._drain_calls(key))
+
+    async def _drain_calls(self, key):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._calls.get(key):
+                call = self._calls[key].pop(0)
+                try:
+                    await loop.run_in_executor(self._executor, call)
+                except Exception as e:
+                    print(f"Error writing {key}: {e}")
+        finally:
+            self._calls.pop(key, None)
+            del self._active[key]
+
+    async def flush(self):
+        while self._active:
+            await asyncio.gather(*list(self._active.values()))
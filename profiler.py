@@ -0,0 +1,106 @@
+"""Sampling profiler for the event loop thread.
+
+A background thread reads the loop thread's current stack every
+interval and counts identical stacks, so the cost is independent of how
+many calls the bot makes and nothing has to be instrumented. The
+result is a plain-text summary (functions by self and total samples)
+and the raw counts in the folded-stack format read by flamegraph.pl and
+speedscope.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+INTERVAL = 0.005
+TOP_FUNCTIONS = 25
+
+
+def _label(code):
+    return (f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+            f"{code.co_firstlineno})")
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.seconds = 0.0
+        self._labels = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        # Samples the thread that calls start()
+        if self.running:
+            return False
+        self.stacks.clear()
+        self.samples = 0
+        self._stop.clear()
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(threading.get_ident(), ),
+                                        name="sampling-profiler",
+                                        daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.seconds = time.monotonic() - self.started
+        return True
+
+    def _run(self, thread_id):
+        labels = self._labels
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _label(code)
+                stack.append(label)
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def folded(self):
+        # "outer;inner;leaf count" per line
+        return "".join(f"{';'.join(stack)} {n}\n"
+                       for stack, n in self.stacks.most_common())
+
+    def summary(self, n=TOP_FUNCTIONS):
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        samples = self.samples or 1
+        lines = [
+            f"{self.samples} samples over {self.seconds:.1f}s "
+            f"(every {self.interval * 1000:g} ms)", "",
+            "Self time:"
+        ]
+        lines += [f"{count / samples:7.1%}  {label}"
+                  for label, count in own.most_common(n)]
+        lines += ["", "Total time (including callees):"]
+        lines += [f"{count / samples:7.1%}  {label}"
+                  for label, count in total.most_common(n)]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,171 @@
+"""Inverted index over free-text absence reasons.
+
+Reasons from response history and from current LOAs are split into
+lowercase word tokens, and each token maps to the set of records that
+contain it, so a keyword search only touches the postings of its rarest
+word. Response reasons are also counted per day under a normalised form
+of the text, which makes top-k reports proportional to the days asked
+for rather than the whole history. Everything is maintained as records
+are added and removed.
+"""
+import heapq
+import re
+from collections import Counter, namedtuple
+from datetime import date, timedelta
+
+from records import LOA_REASON
+
+
+RESPONSE = "response"
+LOA = "loa"
+STOPWORDS = frozenset(
+    ("a", "an", "and", "at", "for", "i", "im", "in", "is", "it", "my",
+     "of", "on", "the", "to", "with"))
+
+Record = namedtuple("Record", ["uid", "start", "end", "reason", "kind"])
+
+
+def tokens(text):
+    text = re.sub(r"'s\b", "", text.lower()).replace("'", "")
+    words = re.findall(r"[a-z0-9]+", text)
+    return {word for word in words if word not in STOPWORDS}
+
+
+def normalize(reason):
+    return " ".join(reason.lower().split()).strip(" .!?,;:")
+
+
+class ReasonIndex:
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self, kind=None):
+        if kind is None:
+            self.records = {}
+            self.postings = {}
+            self.by_user = {}
+            self.loas = {}
+            self.days = {}
+            self.totals = Counter()
+            self.labels = {}
+            self._next = 0
+            return
+        for rid in [rid for rid, r in self.records.items() if r.kind == kind]:
+            self._drop(rid)
+
+    # --- maintenance ---------------------------------------------------
+
+    def _insert(self, record):
+        rid = self._next
+        self._next += 1
+        self.records[rid] = record
+        for token in tokens(record.reason):
+            self.postings.setdefault(token, set()).add(rid)
+        self.by_user.setdefault(record.uid, set()).add(rid)
+        if record.kind == RESPONSE:
+            key = normalize(record.reason)
+            self.labels.setdefault(key, record.reason.strip())
+            self.days.setdefault(record.start, Counter())[key] += 1
+            self.totals[key] += 1
+        return rid
+
+    def _drop(self, rid):
+        record = self.records.pop(rid, None)
+        if record is None:
+            return
+        for token in tokens(record.reason):
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.discard(rid)
+                if not posting:
+                    del self.postings[token]
+        user = self.by_user.get(record.uid)
+        if user is not None:
+            user.discard(rid)
+            if not user:
+                del self.by_user[record.uid]
+        if record.kind == RESPONSE:
+            key = normalize(record.reason)
+            day = self.days[record.start]
+            day[key] -= 1
+            if day[key] <= 0:
+                del day[key]
+                if not day:
+                    del self.days[record.start]
+            self.totals[key] -= 1
+            if self.totals[key] <= 0:
+                del self.totals[key]
+                self.labels.pop(key, None)
+        else:
+            self.loas.pop((record.uid, record.start, record.end,
+                           record.reason), None)
+
+    def add_response(self, uid, entry):
+        # entry: a records.HistoryRecord. Answers given while on LOA carry
+        # a placeholder reason; the LOA itself is indexed by add_loa
+        if not entry.reason or entry.reason == LOA_REASON:
+            return None
+        day = entry.date.isoformat()
+        return self._insert(Record(uid, day, day, entry.reason, RESPONSE))
+
+    def add_loa(self, uid, entry):
+        start, end = entry.start.isoformat(), entry.end.isoformat()
+        key = (uid, start, end, entry.reason)
+        if key not in self.loas:
+            self.loas[key] = self._insert(
+                Record(uid, start, end, entry.reason, LOA))
+
+    def remove_loa(self, uid, entry):
+        rid = self.loas.get((uid, entry.start.isoformat(),
+                             entry.end.isoformat(), entry.reason))
+        if rid is not None:
+            self._drop(rid)
+
+    def remove_user(self, uid, kind=None):
+        for rid in list(self.by_user.get(uid, ())):
+            if kind is None or self.records[rid].kind == kind:
+                self._drop(rid)
+
+    # --- queries -------------------------------------------------------
+
+    def search(self, text, start=None, end=None, uid=None, limit=20):
+        # Records whose reason contains every word of text, newest first
+        words = tokens(text)
+        if not words:
+            return []
+        postings = sorted((self.postings.get(w, set()) for w in words),
+                          key=len)
+        found = set(postings[0])
+        for posting in postings[1:]:
+            found &= posting
+        if uid is not None:
+            found &= self.by_user.get(uid, set())
+        matches = [
+            self.records[rid] for rid in found
+            if (start is None or self.records[rid].end >= start) and (
+                end is None or self.records[rid].start <= end)
+        ]
+        matches.sort(key=lambda r: (r.start, r.end), reverse=True)
+        return matches[:limit]
+
+    def top(self, k, start=None, end=None):
+        # [(reason, count)] over response reasons given between start and
+        # end (ISO days, inclusive)
+        if start is None and end is None:
+            counts = self.totals
+        elif start is not None and end is not None:
+            counts = Counter()
+            day, last = date.fromisoformat(start), date.fromisoformat(end)
+            while day <= last:
+                counts.update(self.days.get(day.isoformat(), ()))
+                day += timedelta(days=1)
+        else:
+            counts = Counter()
+            for day, day_counts in self.days.items():
+                if (start is None or day >= start) and (end is None
+                                                        or day <= end):
+                    counts.update(day_counts)
+        best = heapq.nlargest(k, counts.items(),
+                              key=lambda item: (item[1], item[0]))
+        return [(self.labels.get(key, key), n) for key, n in best]
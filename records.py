@@ -0,0 +1,189 @@
+"""Typed response and history records.
+
+Availability is parsed once, when a response is submitted or a legacy
+record is read, into a small str-valued enum, so everything downstream
+compares against fixed values. History is held per member in parallel
+arrays (day ordinal, availability code, seconds since midnight, reason)
+and written to disk in the same columnar shape.
+"""
+from array import array
+from datetime import date
+from enum import Enum
+
+
+class Availability(str, Enum):
+    YES = "yes"
+    YES_LATER = "yes_later"
+    NO = "no"
+    # Legacy free text that could not be recognised
+    UNKNOWN = "unknown"
+
+    @property
+    def code(self):
+        return CODES[self]
+
+
+CODES = {availability: i for i, availability in enumerate(Availability)}
+BY_CODE = list(Availability)
+# Reason recorded for a member who answers while on LOA
+LOA_REASON = "On Leave of Absence"
+
+
+def parse_availability(text):
+    # Returns None when text is not a recognisable answer
+    if isinstance(text, Availability):
+        return text
+    text = " ".join(str(text).lower().replace("_", " ").split())
+    if not text:
+        return None
+    if "later" in text:
+        return Availability.YES_LATER
+    if text[0] == "y":
+        return Availability.YES
+    if text[0] == "n":
+        return Availability.NO
+    return None
+
+
+def parse_time(text):
+    # "HH:MM[:SS]" -> seconds since midnight, 0 if missing or malformed
+    try:
+        parts = [int(p) for p in text.split(":")]
+    except (AttributeError, ValueError):
+        return 0
+    parts += [0] * (3 - len(parts))
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def format_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class Response:
+    __slots__ = ("name", "available", "reason")
+
+    def __init__(self, name, available, reason):
+        self.name = name
+        self.available = available
+        self.reason = reason
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "available": self.available.value,
+            "reason": self.reason
+        }
+
+
+class HistoryRecord:
+    __slots__ = ("day", "available", "reason", "seconds")
+
+    def __init__(self, day, available, reason="", seconds=0):
+        self.day = day
+        self.available = available
+        self.reason = reason
+        self.seconds = seconds
+
+    @property
+    def date(self):
+        return date.fromordinal(self.day)
+
+    @property
+    def time(self):
+        return format_time(self.seconds)
+
+    @classmethod
+    def from_entry(cls, entry):
+        # Legacy dict entry {"date", "available", "reason", "time"}
+        return cls(
+            date.fromisoformat(entry["date"]).toordinal(),
+            parse_availability(entry["available"]) or Availability.UNKNOWN,
+            entry.get("reason") or "", parse_time(entry.get("time")))
+
+    def to_entry(self):
+        return {
+            "date": self.date.isoformat(),
+            "available": self.available.value,
+            "reason": self.reason,
+            "time": self.time
+        }
+
+    def encode(self):
+        return [self.day, self.available.code, self.seconds, self.reason]
+
+    @classmethod
+    def decode(cls, data):
+        return cls(data[0], BY_CODE[data[1]], data[3], data[2])
+
+
+class UserHistory:
+    """One member's history as parallel arrays, oldest first."""
+
+    __slots__ = ("days", "codes", "seconds", "reasons")
+
+    def __init__(self):
+        self.days = array("l")
+        self.codes = array("B")
+        self.seconds = array("l")
+        # Most records have no reason; only the ones that do are stored
+        self.reasons = {}
+
+    def append(self, record):
+        if record.reason:
+            self.reasons[len(self.days)] = record.reason
+        self.days.append(record.day)
+        self.codes.append(record.available.code)
+        self.seconds.append(record.seconds)
+
+    def __len__(self):
+        return len(self.days)
+
+    @classmethod
+    def from_records(cls, records):
+        history = cls()
+        for record in records:
+            history.append(record)
+        return history
+
+    def split(self, before):
+        # (records before day ordinal `before`, the rest) as two histories
+        older, newer = [], []
+        for record in self:
+            (older if record.day < before else newer).append(record)
+        return self.from_records(older), self.from_records(newer)
+
+    def final_states(self):
+        # Last record of each day, oldest day first
+        last = {}
+        for record in self:
+            last[record.day] = record
+        return [last[day] for day in sorted(last)]
+
+    def __iter__(self):
+        reasons = self.reasons
+        for i, (day, code, seconds) in enumerate(
+                zip(self.days, self.codes, self.seconds)):
+            yield HistoryRecord(day, BY_CODE[code], reasons.get(i, ""),
+                                seconds)
+
+    def to_json(self):
+        return {
+            "d": self.days.tolist(),
+            "a": self.codes.tolist(),
+            "s": self.seconds.tolist(),
+            "r": {str(i): reason for i, reason in self.reasons.items()}
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        history = cls()
+        if isinstance(data, list):
+            # Legacy list of entry dicts
+            for entry in data:
+                history.append(HistoryRecord.from_entry(entry))
+            return history
+        history.days = array("l", data["d"])
+        history.codes = array("B", data["a"])
+        history.seconds = array("l", data["s"])
+        history.reasons = {int(i): r for i, r in data.get("r", {}).items()}
+        return history
@@ -0,0 +1,56 @@
+"""Component router: custom_id -> handler, timed for an observer.
+
+Buttons built with ComponentRouter.button() dispatch through the router,
+so they can live on persistent views (timeout=None, registered once
+with bot.add_view) and keep working across restarts.
+"""
+import time
+
+import discord
+
+
+class ComponentRouter:
+
+    def __init__(self, observer=None, tracer=None):
+        # observer(custom_id, seconds, failed) is called after every
+        # dispatch; with a tracing.Tracer each dispatch is traced
+        self.routes = {}
+        self.observer = observer
+        self.tracer = tracer
+
+    def route(self, custom_id):
+
+        def decorator(handler):
+            self.routes[custom_id] = handler
+            return handler
+
+        return decorator
+
+    def button(self, label, style, custom_id):
+        button = discord.ui.Button(label=label, style=style, custom_id=custom_id)
+        button.callback = self.dispatch
+        return button
+
+    async def dispatch(self, interaction):
+        custom_id = interaction.data.get("custom_id")
+        handler = self.routes.get(custom_id)
+        if handler is None:
+            return False
+        start = time.perf_counter()
+        failed = False
+        try:
+            if self.tracer:
+                with self.tracer.trace("component", custom_id,
+                                       guild=interaction.guild_id,
+                                       user=interaction.user.id):
+                    await handler(interaction)
+            else:
+                await handler(interaction)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.observer:
+                self.observer(custom_id, elapsed, failed)
+        return True
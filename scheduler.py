@@ -0,0 +1,197 @@
+"""Deadline scheduler for the bot's daily jobs.
+
+Upcoming runs sit in a heap ordered by UTC deadline and the runner
+sleeps until the earliest one instead of polling every minute. Wall
+clock times are resolved in the job's timezone on every run, so DST
+changes are picked up. On startup, a job whose last run predates its
+most recent deadline is run immediately if that deadline is still
+within the job's grace window. Jobs can be added and removed while the
+scheduler is running, e.g. as guilds join and leave. Each due job runs
+in its own task, so jobs due at the same moment (every guild's 20:00
+announcement) run side by side and one slow job holds up no other.
+Last-run times are kept per job in the job's own store (its guild's
+storage), falling back to the scheduler's store for jobs without one.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+from datetime import datetime, time, timedelta, timezone
+
+
+MAX_SLEEP_SECONDS = 300
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+class JobStateFile:
+    """Last-run times in a JSON file, for jobs that belong to no guild."""
+
+    def __init__(self, path, writer, fallback=None):
+        # fallback supplies the state until the file is first written
+        self.path = path
+        self.writer = writer
+        self.fallback = fallback
+
+    def load_scheduler_state(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        return self.fallback.load_scheduler_state() if self.fallback else {}
+
+    def save_scheduler_state(self, state):
+        self.writer.write_json(self.path, lambda: state)
+
+
+class DailyAt:
+    # Wall-clock time of day in tz; get_time, and tz when it is a
+    # callable, are re-read on every resolve so settings changes apply
+    # to the next deadline
+
+    def __init__(self, get_time, tz):
+        self.get_time = get_time
+        self.tz = tz
+
+    def _zone(self):
+        return self.tz() if callable(self.tz) else self.tz
+
+    def _on(self, day):
+        hour, minute = self.get_time()
+        return datetime.combine(day, time(hour, minute),
+                                tzinfo=self._zone()).astimezone(timezone.utc)
+
+    def next_after(self, moment):
+        day = moment.astimezone(self._zone()).date()
+        candidate = self._on(day)
+        if candidate <= moment:
+            candidate = self._on(day + timedelta(days=1))
+        return candidate
+
+    def previous_before(self, moment):
+        day = moment.astimezone(self._zone()).date()
+        candidate = self._on(day)
+        if candidate > moment:
+            candidate = self._on(day - timedelta(days=1))
+        return candidate
+
+
+class Job:
+
+    def __init__(self, name, when, callback, grace, store=None):
+        self.name = name
+        self.when = when
+        self.callback = callback
+        self.grace = grace
+        self.store = store
+        self.due = None
+
+
+class Scheduler:
+
+    def __init__(self, store):
+        # store keeps last-run times for jobs added without their own
+        self.store = store
+        self.jobs = {}
+        self.last_runs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._started = False
+        # Jobs currently running; referenced so the tasks are not collected
+        self._running = set()
+
+    def add(self, name, when, callback, grace=timedelta(0), store=None):
+        job = self.jobs[name] = Job(name, when, callback, grace, store)
+        if self._started:
+            self._schedule(job, utcnow())
+            self._wake.set()
+
+    def remove(self, name):
+        # Its heap entry is skipped when it comes up
+        self.jobs.pop(name, None)
+
+    def _push(self, job, due):
+        job.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), job.name))
+
+    def reschedule(self, name):
+        # Recompute a job's deadline after its time of day changed
+        job = self.jobs[name]
+        self._push(job, job.when.next_after(utcnow()))
+        self._wake.set()
+
+    def _catch_up(self):
+        now = utcnow()
+        self.last_runs = {
+            name: datetime.fromisoformat(value)
+            for name, value in self.store.load_scheduler_state().items()
+        }
+        for job in self.jobs.values():
+            self._schedule(job, now)
+        self._started = True
+
+    def _store(self, job):
+        return job.store or self.store
+
+    def _schedule(self, job, now):
+        if job.store is not None:
+            # Entries from before per-guild state live in self.store
+            value = job.store.load_scheduler_state().get(job.name)
+            if value:
+                self.last_runs[job.name] = datetime.fromisoformat(value)
+        previous = job.when.previous_before(now)
+        last = self.last_runs.get(job.name)
+        if last and last < previous and now - previous <= job.grace:
+            print(f"Catching up missed job {job.name} due at {previous}")
+            self._push(job, previous)
+        else:
+            self._push(job, job.when.next_after(now))
+
+    async def _run(self, job, due):
+        # Records the run and schedules the next one once the job finishes
+        try:
+            await job.callback()
+        except Exception as e:
+            print(f"Scheduled job {job.name} failed: {e}")
+        self.last_runs[job.name] = due
+        store = self._store(job)
+        # Times of removed jobs stay with the scheduler's own store
+        store.save_scheduler_state({
+            name: value.isoformat()
+            for name, value in self.last_runs.items()
+            if (self._store(self.jobs[name]) if name in self.jobs else
+                self.store) is store
+        })
+        if self.jobs.get(job.name) is job:
+            self._push(job, job.when.next_after(max(due, utcnow())))
+
+    async def run(self):
+        self._catch_up()
+        while True:
+            if not self._heap:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            due, _, name = self._heap[0]
+            job = self.jobs.get(name)
+            if job is None or job.due != due:
+                heapq.heappop(self._heap)  # removed or rescheduled
+                continue
+            delay = (due - utcnow()).total_seconds()
+            if delay > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(),
+                                           timeout=min(delay,
+                                                       MAX_SLEEP_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            job.due = None
+            task = asyncio.create_task(self._run(job, due))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
@@ -0,0 +1,138 @@
+"""Journaled copy of the live turf session (today's responses).
+
+Every change is appended as one line to session/journal.jsonl and the
+whole session is periodically snapshotted to session/snapshot.json. To
+compact, the journal is first sealed (renamed to journal.sealed.jsonl)
+and a fresh one started, so the snapshot can be written off the event
+loop while changes keep arriving; the sealed journal is deleted once
+the snapshot is on disk. Records are per-member last-write-wins plus a
+whole-session clear, so replaying a journal over a snapshot that
+already includes it gives the same result, and a crash at any point of
+a compaction is harmless.
+"""
+import json
+import os
+
+from persistence import write_atomic
+
+
+SNAPSHOT_FILE = "snapshot.json"
+JOURNAL_FILE = "journal.jsonl"
+SEALED_FILE = "journal.sealed.jsonl"
+COMPACT_LINES = 200
+
+
+def _ends_line(path):
+    # True for an empty file or one whose last byte is a newline
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if not f.tell():
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class SessionStore:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.day = None
+        self.responses = {}
+        self._journal = None
+        self._lines = 0
+        self.defer_flush = False
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def load(self):
+        # Returns (day, {uid: response dict}); day is None with no session
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.day, self.responses, self._lines = None, {}, 0
+        if os.path.exists(self._path(SNAPSHOT_FILE)):
+            with open(self._path(SNAPSHOT_FILE), 'r') as f:
+                snapshot = json.load(f)
+            self.day = snapshot.get("day")
+            self.responses = snapshot.get("responses", {})
+        # A sealed journal is left by a compaction that did not finish
+        for name in (SEALED_FILE, JOURNAL_FILE):
+            if not os.path.exists(self._path(name)):
+                continue
+            with open(self._path(name), 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A partial last line, ended below before appending
+                        continue
+                    self._apply(record)
+                    self._lines += 1
+        if self._journal is None:
+            self._journal = open(self._path(JOURNAL_FILE), 'a')
+            if not _ends_line(self._path(JOURNAL_FILE)):
+                # End the torn line so the next record starts its own
+                self._journal.write("\n")
+                self._journal.flush()
+        return self.day, dict(self.responses)
+
+    def _apply(self, record):
+        op = record.get("op")
+        if op == "set":
+            self.day = record["day"]
+            # Moved to the end, matching the summary's order
+            self.responses.pop(record["uid"], None)
+            self.responses[record["uid"]] = record["response"]
+        elif op == "remove":
+            self.responses.pop(record["uid"], None)
+        elif op == "clear":
+            self.day = record.get("day")
+            self.responses = {}
+
+    def _write(self, record):
+        self._apply(record)
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._lines += 1
+        if not self.defer_flush:
+            self.flush()
+
+    def flush(self):
+        if self._journal:
+            self._journal.flush()
+
+    def set(self, day, uid, response):
+        self._write({"op": "set", "day": day, "uid": uid,
+                     "response": response})
+
+    def remove(self, uid):
+        if uid in self.responses:
+            self._write({"op": "remove", "uid": uid})
+
+    def clear(self, day=None):
+        if self.responses or self.day != day:
+            self._write({"op": "clear", "day": day})
+
+    def needs_compaction(self):
+        return self._lines >= COMPACT_LINES
+
+    def begin_compaction(self):
+        # On the loop: seals the journal and returns the snapshot to write.
+        # If an earlier compaction failed its sealed journal is kept, and
+        # the new snapshot covers it and the current journal alike
+        snapshot = {"day": self.day, "responses": dict(self.responses)}
+        if not os.path.exists(self._path(SEALED_FILE)):
+            if self._journal:
+                self._journal.close()
+            os.replace(self._path(JOURNAL_FILE), self._path(SEALED_FILE))
+            self._journal = open(self._path(JOURNAL_FILE), 'w')
+            self._lines = 0
+        return snapshot
+
+    def write_snapshot(self, snapshot):
+        # Safe to run in a worker thread
+        write_atomic(self._path(SNAPSHOT_FILE), snapshot)
+
+    def end_compaction(self):
+        os.remove(self._path(SEALED_FILE))
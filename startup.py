@@ -0,0 +1,56 @@
+"""Once-per-process startup pipeline with per-phase timings.
+
+on_ready fires again after every gateway reconnect; the pipeline only
+runs the first time. Phases are timed individually and reported by the
+/ready endpoint, and the command tree is only synced when its hash
+differs from the one recorded after the last successful sync.
+"""
+import hashlib
+import json
+import time
+
+
+def tree_hash(tree, application_id, guild=None):
+    payload = {
+        "application_id": application_id,
+        "commands": sorted(
+            (command.to_dict(tree) for command in tree.get_commands(
+                guild=guild)),
+            key=lambda command: command["name"])
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True,
+                   separators=(",", ":")).encode()).hexdigest()
+
+
+class Startup:
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.started = False
+        self.ready = False
+        self.phases = {}
+        self.errors = {}
+
+    async def phase(self, name, step):
+        # Awaits step, recording how long it took; failures are logged and
+        # reported but do not stop the other phases
+        start = time.perf_counter()
+        try:
+            return await step
+        except Exception as e:
+            self.errors[name] = str(e)
+            print(f"Startup phase {name} failed: {e}")
+        finally:
+            self.phases[name] = round(time.perf_counter() - start, 4)
+
+    def mark_ready(self):
+        self.ready = True
+        self.phases["total"] = round(time.perf_counter() - self.created, 4)
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "phases": dict(self.phases),
+            "errors": dict(self.errors)
+        }
@@ -0,0 +1,154 @@
+"""Per-user attendance counters and a maintained leaderboard ranking."""
+import bisect
+from collections import Counter
+
+from records import Availability
+
+
+class UserStats:
+    __slots__ = ("total", "yes", "yes_later", "no", "reasons", "top_reason",
+                 "rank_key")
+
+    def __init__(self):
+        self.total = 0
+        self.yes = 0
+        self.yes_later = 0
+        self.no = 0
+        self.reasons = Counter()
+        self.top_reason = None
+        self.rank_key = None
+
+    @property
+    def percent(self):
+        return (self.yes / self.total) * 100 if self.total else 0
+
+    def add(self, available, reason):
+        self.total += 1
+        if available is Availability.YES:
+            self.yes += 1
+        elif available is Availability.YES_LATER:
+            self.yes_later += 1
+        elif available is Availability.NO:
+            self.no += 1
+        if reason:
+            self._count_reason(reason, 1)
+
+    def merge(self, data):
+        # Adds counters in to_json() form, e.g. a rolled-up month
+        self.total += data.get("total", 0)
+        self.yes += data.get("yes", 0)
+        self.yes_later += data.get("yes_later", 0)
+        self.no += data.get("no", 0)
+        for reason, n in data.get("reasons", {}).items():
+            self._count_reason(reason, n)
+
+    def _count_reason(self, reason, n):
+        self.reasons[reason] += n
+        # Counts only grow, so the leader can be tracked without a scan
+        if (self.top_reason is None
+                or self.reasons[reason] > self.reasons[self.top_reason]):
+            self.top_reason = reason
+
+    def to_json(self):
+        return {
+            "total": self.total,
+            "yes": self.yes,
+            "yes_later": self.yes_later,
+            "no": self.no,
+            "reasons": dict(self.reasons)
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        stats = cls()
+        stats.merge(data)
+        return stats
+
+
+class AttendanceStats:
+
+    def __init__(self, min_responses):
+        self.min_responses = min_responses
+        self.users = {}
+        # Sorted (-percent, -total, uid) for users eligible for the leaderboard
+        self.ranking = []
+
+    def get(self, uid):
+        return self.users.get(uid)
+
+    def add(self, uid, entry):
+        stats = self.users.get(uid)
+        if stats is None:
+            stats = self.users[uid] = UserStats()
+        self._unrank(stats)
+        stats.add(entry.available, entry.reason)
+        self._rank(uid, stats)
+
+    def merge(self, uid, data):
+        # Adds counters in UserStats.to_json() form to a member
+        stats = self.users.get(uid)
+        if stats is None:
+            stats = self.users[uid] = UserStats()
+        self._unrank(stats)
+        stats.merge(data)
+        self._rank(uid, stats)
+
+    def remove_user(self, uid):
+        stats = self.users.pop(uid, None)
+        if stats:
+            self._unrank(stats)
+
+    def clear(self):
+        self.users = {}
+        self.ranking = []
+
+    def top(self, n):
+        return [(uid, self.users[uid]) for _, _, uid in self.ranking[:n]]
+
+    def _rank(self, uid, stats):
+        if stats.total < self.min_responses:
+            return
+        stats.rank_key = (-stats.percent, -stats.total, uid)
+        bisect.insort(self.ranking, stats.rank_key)
+
+    def _unrank(self, stats):
+        if stats.rank_key is None:
+            return
+        i = bisect.bisect_left(self.ranking, stats.rank_key)
+        if i < len(self.ranking) and self.ranking[i] == stats.rank_key:
+            del self.ranking[i]
+        stats.rank_key = None
+
+    # --- persistence ---------------------------------------------------
+
+    def rebuild(self, history, monthly=None):
+        # history: uid -> records.UserHistory of raw responses, counted
+        # straight off the availability column; monthly: uid -> month ->
+        # counters for responses already rolled up out of it
+        self.clear()
+        for uid, entries in history.items():
+            stats = self.users[uid] = UserStats()
+            codes = entries.codes
+            stats.total = len(codes)
+            stats.yes = codes.count(Availability.YES.code)
+            stats.yes_later = codes.count(Availability.YES_LATER.code)
+            stats.no = codes.count(Availability.NO.code)
+            for reason, n in Counter(entries.reasons.values()).items():
+                stats._count_reason(reason, n)
+        for uid, months in (monthly or {}).items():
+            stats = self.users.get(uid)
+            if stats is None:
+                stats = self.users[uid] = UserStats()
+            for counts in months.values():
+                stats.merge(counts)
+        for uid, stats in self.users.items():
+            self._rank(uid, stats)
+
+    def to_json(self):
+        return {uid: stats.to_json() for uid, stats in self.users.items()}
+
+    def load_json(self, data):
+        self.clear()
+        for uid, raw in data.items():
+            stats = self.users[uid] = UserStats.from_json(raw)
+            self._rank(uid, stats)
@@ -0,0 +1,940 @@
+"""Storage engines behind one repository API.
+
+JsonStorage keeps the original file layout (settings.json, the history
+journal, loas.json, loas_ended.json, message_ids.json, scheduler.json,
+member_names.json and archive/YYYY-MM-DD.json, packed per month once the
+month is over). SqliteStorage keeps the same data in one WAL-mode
+database with indexes on history (user_id, date), LOAs (user_id, start,
+end) and archive day; rolled-up history lives in history_daily and
+history_monthly. Its writes run on the AtomicWriter pool, so reads on
+the event loop see them once flush() returns.
+
+    python storage.py import [turf.db]   # one-shot JSON -> SQLite import
+
+Each guild has its own storage; see open_guild_storage. The running bot
+holds an flock on LOCK_FILE, and offline tools (this import, bulk.py)
+refuse to run while it does. Public methods are recorded as spans in the
+active trace (see tracing.traced).
+"""
+import asyncio
+import contextlib
+import fcntl
+import json
+import os
+import sqlite3
+import sys
+from datetime import date
+
+from archive_store import ArchiveStore
+from history_store import HistoryStore
+from persistence import AtomicWriter
+from records import Availability, HistoryRecord, parse_availability
+from session_store import SessionStore
+from stats import UserStats
+from metrics import file_label, storage_seconds
+import tracing
+
+
+# The original single-guild deployment; its data stays in the top-level
+# files below, every other guild gets a folder under GUILDS_DIR
+HOME_GUILD_ID = 1355091741501554859
+
+SETTINGS_FILE = "settings.json"
+HISTORY_FILE = "history.json"
+HISTORY_DIR = "history"
+ARCHIVE_FOLDER = "archive"
+LOA_FILE = "loas.json"
+# LOAs moved out of LOA_FILE once they end, kept for the attendance bitmaps
+ENDED_LOA_FILE = "loas_ended.json"
+MESSAGE_IDS_FILE = "message_ids.json"
+SCHEDULER_FILE = "scheduler.json"
+SESSION_DIR = "session"
+MEMBER_NAMES_FILE = "member_names.json"
+DATABASE_FILE = "turf.db"
+GUILDS_DIR = "guilds"
+LOCK_FILE = "data.lock"
+# "json" keeps the flat files above, "sqlite" uses DATABASE_FILE
+STORAGE_ENGINE = os.environ.get("STORAGE_ENGINE", "json")
+
+_lock = None  # LOCK_FILE, open and locked for as long as this process runs
+
+
+def load_json(filename, default):
+    if not os.path.exists(filename):
+        return default
+    with storage_seconds.time(op="load", file=file_label(filename)):
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    if not os.path.isdir(path):
+        return 0
+    return sum(
+        os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+        if os.path.isfile(os.path.join(path, name)))
+
+
+@tracing.traced("storage")
+class JsonStorage:
+
+    def __init__(self, settings_file, history_dir, history_file, loa_file,
+                 archive_folder, message_file, scheduler_file, session_dir,
+                 names_file, ended_loa_file, writer=None):
+        self.settings_file = settings_file
+        self.loa_file = loa_file
+        self.message_file = message_file
+        self.scheduler_file = scheduler_file
+        self.names_file = names_file
+        self._names = {}
+        self.archive_folder = archive_folder
+        self.history_dir = history_dir
+        self.history = HistoryStore(history_dir, legacy_file=history_file)
+        # One writer (and thread pool) can be shared by many guilds
+        self.writer = writer or AtomicWriter()
+        self._loas = {}
+        self.ended_loa_file = ended_loa_file
+        self._ended_loas = {}
+        self.archive = ArchiveStore(archive_folder)
+        self.session_dir = session_dir
+        self.session = SessionStore(session_dir)
+
+    # --- settings ------------------------------------------------------
+
+    def load_settings(self, default):
+        return load_json(self.settings_file, default)
+
+    def save_settings(self, settings):
+        self.writer.write_json(self.settings_file, lambda: dict(settings))
+
+    # --- tracked messages ----------------------------------------------
+
+    def load_message_ids(self):
+        return load_json(self.message_file, {})
+
+    def save_message_ids(self, ids):
+        self.writer.write_json(self.message_file, lambda: dict(ids))
+
+    # --- scheduler -----------------------------------------------------
+
+    def load_scheduler_state(self):
+        return load_json(self.scheduler_file, {})
+
+    def save_scheduler_state(self, state):
+        self.writer.write_json(self.scheduler_file, lambda: state)
+
+    # --- member names --------------------------------------------------
+
+    def load_member_names(self):
+        self._names = load_json(self.names_file, {})
+        return self._names
+
+    def save_member_name(self, uid, name):
+        # name None forgets the member
+        if name is None:
+            self._names.pop(uid, None)
+        else:
+            self._names[uid] = name
+        self.writer.write_json(self.names_file, lambda: dict(self._names))
+
+    # --- history -------------------------------------------------------
+
+    def load_history(self, stats, writable=True):
+        # stats may be None; writable=False is for offline readers
+        self.history.stats = stats
+        self.history.load(writable)
+
+    def append_history(self, uid, entry):
+        self.history.append(uid, entry)
+
+    def history_rows(self):
+        # (uid, HistoryRecord) for every retained response, daily final
+        # states first, oldest first per member
+        return self.history.all_records()
+
+    def history_for(self, uid, start=None, end=None):
+        first = date.fromisoformat(start).toordinal() if start else 0
+        last = date.fromisoformat(end).toordinal() if end else date.max.toordinal()
+        return [
+            e for e in self.history.records_for(uid) if first <= e.day <= last
+        ]
+
+    def history_range(self, start, end, uid=None):
+        # (uid, HistoryRecord) with start <= date <= end (ISO days)
+        first = date.fromisoformat(start).toordinal()
+        last = date.fromisoformat(end).toordinal()
+        rows = (self.history.all_records() if uid is None else
+                ((uid, e) for e in self.history.records_for(uid)))
+        for record_uid, entry in rows:
+            if first <= entry.day <= last:
+                yield record_uid, entry
+
+    def roll_up_history(self, raw_before, daily_before):
+        # ISO days; see HistoryStore.roll_up
+        return self.history.roll_up(
+            date.fromisoformat(raw_before).toordinal(),
+            date.fromisoformat(daily_before).toordinal())
+
+    def clear_history(self, uid=None):
+        if uid is None:
+            self.history.clear_all()
+        else:
+            self.history.clear_user(uid)
+
+    @contextlib.contextmanager
+    def batch(self):
+        # Journal appends are flushed once for the whole batch; file saves
+        # are already merged per path by the writer
+        self.history.defer_flush = True
+        self.session.defer_flush = True
+        try:
+            yield
+        finally:
+            self.history.defer_flush = False
+            self.session.defer_flush = False
+            self.history.flush()
+            self.session.flush()
+
+    async def flush(self):
+        await self.writer.flush()
+
+    def file_sizes(self):
+        return {(file_label(path) if os.path.isfile(path) else
+                 os.path.basename(path), ):
+                _tree_size(path)
+                for path in (self.settings_file, self.loa_file,
+                             self.message_file, self.scheduler_file,
+                             self.names_file, self.ended_loa_file,
+                             self.history_dir, self.archive_folder,
+                             self.session_dir)}
+
+    async def maintenance(self):
+        # Fold sealed journal segments into a new snapshot, snapshot the
+        # live session and pack finished archive months, all off the loop
+        if self.history.needs_compaction():
+            started = self.history.begin_compaction()
+            if started is not None:
+                try:
+                    await asyncio.to_thread(self.history.write_compaction,
+                                            *started)
+                finally:
+                    self.history.end_compaction(*started)
+        if self.session.needs_compaction():
+            snapshot = self.session.begin_compaction()
+            await asyncio.to_thread(self.session.write_snapshot, snapshot)
+            self.session.end_compaction()
+        current_month = date.today().isoformat()[:7]
+        for month in self.archive.unpacked_months(current_month):
+            await asyncio.to_thread(self.archive.pack_month, month)
+
+    # --- live session ------------------------------------------------
+
+    def load_session(self):
+        return self.session.load()
+
+    def session_set(self, day, uid, response):
+        self.session.set(day, uid, response)
+
+    def session_remove(self, uid):
+        self.session.remove(uid)
+
+    def session_clear(self, day=None):
+        self.session.clear(day)
+
+    # --- LOAs ----------------------------------------------------------
+
+    def load_loas(self):
+        self._loas = load_json(self.loa_file, {})
+        return self._loas
+
+    def _save_loas(self):
+        self.writer.write_json(
+            self.loa_file,
+            lambda: {uid: list(records)
+                     for uid, records in self._loas.items()})
+
+    def add_loa(self, uid, record):
+        self._loas.setdefault(uid, []).append(record)
+        self._save_loas()
+
+    def remove_loas(self, pairs):
+        for uid, record in pairs:
+            records = self._loas.get(uid, [])
+            if record in records:
+                records.remove(record)
+            if not records:
+                self._loas.pop(uid, None)
+        self._save_loas()
+
+    def remove_user_loas(self, uid):
+        if self._loas.pop(uid, None) is not None:
+            self._save_loas()
+
+    def clear_loas(self):
+        self._loas = {}
+        self._save_loas()
+
+    def load_ended_loas(self):
+        self._ended_loas = load_json(self.ended_loa_file, {})
+        return self._ended_loas
+
+    def _save_ended_loas(self):
+        self.writer.write_json(
+            self.ended_loa_file,
+            lambda: {uid: list(records)
+                     for uid, records in self._ended_loas.items()})
+
+    def end_loas(self, pairs):
+        # Moves LOAs that ended from loas.json to the ended LOAs
+        self.remove_loas(pairs)
+        for uid, record in pairs:
+            self._ended_loas.setdefault(uid, []).append(record)
+        self._save_ended_loas()
+
+    def clear_ended_loas(self, uid=None):
+        if uid is None:
+            self._ended_loas = {}
+        elif self._ended_loas.pop(uid, None) is None:
+            return
+        self._save_ended_loas()
+
+    # --- archive -------------------------------------------------------
+
+    def save_archive(self, day, responses):
+        # Copied now: callers clear responses right after archiving
+        data = dict(responses)
+        self.writer.write_json(self.archive.day_path(day), lambda: data)
+
+    def load_archive(self, day):
+        return self.archive.load(day)
+
+    def archive_days(self):
+        return self.archive.days()
+
+    def archive_range(self, start, end, uid=None, available=None):
+        # Yields (day, uid, record) in day order; only overlapping months
+        # are read
+        for day, responses in self.archive.range(start, end):
+            for record_uid, record in responses.items():
+                if uid is not None and record_uid != uid:
+                    continue
+                if available is not None and record["available"] != available:
+                    continue
+                yield day, record_uid, record
+
+    def clear_archives(self):
+        self.archive.clear()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    available TEXT NOT NULL,
+    reason TEXT NOT NULL DEFAULT '',
+    time TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS history_user_date ON history (user_id, date);
+CREATE INDEX IF NOT EXISTS history_date ON history (date);
+CREATE TABLE IF NOT EXISTS history_daily (
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    available TEXT NOT NULL,
+    reason TEXT NOT NULL DEFAULT '',
+    time TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (user_id, date)
+);
+CREATE INDEX IF NOT EXISTS history_daily_date ON history_daily (date);
+CREATE TABLE IF NOT EXISTS history_monthly (
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    counts TEXT NOT NULL,
+    PRIMARY KEY (user_id, month)
+);
+CREATE TABLE IF NOT EXISTS loas (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    reason TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS loas_user_range
+    ON loas (user_id, start_date, end_date);
+CREATE INDEX IF NOT EXISTS loas_end ON loas (end_date, start_date);
+CREATE TABLE IF NOT EXISTS loas_ended (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    reason TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS archive (
+    day TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    available TEXT NOT NULL,
+    reason TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (day, user_id)
+);
+CREATE TABLE IF NOT EXISTS session (
+    user_id TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    name TEXT NOT NULL,
+    available TEXT NOT NULL,
+    reason TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS messages (
+    purpose TEXT PRIMARY KEY,
+    message_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS job_runs (
+    name TEXT PRIMARY KEY,
+    last_run TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS member_names (
+    user_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+"""
+
+
+@tracing.traced("storage")
+class SqliteStorage:
+
+    def __init__(self, path, writer=None):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        # self.db only reads, on the event loop. Writes are queued and run
+        # in order on the writer's thread pool, on their own connection,
+        # so no insert, commit or checkpoint stalls the loop
+        self.writer = writer or AtomicWriter()
+        self._write_db = sqlite3.connect(path, check_same_thread=False)
+        self._write_db.execute("PRAGMA synchronous=NORMAL")
+        self._ops = []
+        self._batching = 0
+        self.stats = None
+
+    @contextlib.contextmanager
+    def batch(self):
+        # One transaction for every write made inside the block
+        self._batching += 1
+        try:
+            yield
+        finally:
+            self._batching -= 1
+            if not self._batching:
+                self._commit()
+
+    def _queue(self, op):
+        # op(db) runs on the writer thread, inside the transaction
+        self._ops.append(op)
+        if not self._batching:
+            self._commit()
+
+    def _write(self, sql, params=()):
+        self._queue(lambda db: db.execute(sql, params))
+
+    def _write_many(self, sql, rows):
+        rows = list(rows)
+        self._queue(lambda db: db.executemany(sql, rows))
+
+    def _commit(self):
+        ops, self._ops = self._ops, []
+        if ops:
+            self.writer.run(self.path, lambda: self._apply(ops))
+
+    def _apply(self, ops):
+        with storage_seconds.time(op="commit", file=file_label(self.path)):
+            with self._write_db:
+                for op in ops:
+                    op(self._write_db)
+
+    # --- settings ------------------------------------------------------
+
+    def load_settings(self, default):
+        rows = self.db.execute("SELECT key, value FROM settings").fetchall()
+        if not rows:
+            return default
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_settings(self, settings):
+        self._write_many(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value)) for key, value in settings.items()])
+
+    # --- tracked messages ----------------------------------------------
+
+    def load_message_ids(self):
+        return dict(
+            self.db.execute("SELECT purpose, message_id FROM messages"))
+
+    def save_message_ids(self, ids):
+        self._write_many(
+            "INSERT OR REPLACE INTO messages (purpose, message_id) "
+            "VALUES (?, ?)", ids.items())
+
+    # --- scheduler -----------------------------------------------------
+
+    def load_scheduler_state(self):
+        return dict(self.db.execute("SELECT name, last_run FROM job_runs"))
+
+    def save_scheduler_state(self, state):
+        self._write_many(
+            "INSERT OR REPLACE INTO job_runs (name, last_run) "
+            "VALUES (?, ?)", state.items())
+
+    # --- member names --------------------------------------------------
+
+    def load_member_names(self):
+        return dict(self.db.execute("SELECT user_id, name FROM member_names"))
+
+    def save_member_name(self, uid, name):
+        if name is None:
+            self._write("DELETE FROM member_names WHERE user_id = ?", (uid, ))
+        else:
+            self._write(
+                "INSERT OR REPLACE INTO member_names (user_id, name) "
+                "VALUES (?, ?)", (uid, name))
+
+    # --- history -------------------------------------------------------
+
+    def load_history(self, stats, writable=True):
+        # Kept so appends and clears update the live stats, as the JSON
+        # journal does
+        self.stats = stats
+        if stats is None:
+            return
+        aggregates = {}
+        for uid, available, n in self.db.execute(
+                "SELECT user_id, available, COUNT(*) FROM history "
+                "GROUP BY user_id, available"):
+            user = aggregates.setdefault(uid, {"total": 0, "reasons": {}})
+            user["total"] += n
+            # Older rows may hold free text such as "y"
+            key = (parse_availability(available) or Availability.UNKNOWN).value
+            user[key] = user.get(key, 0) + n
+        for uid, reason, n in self.db.execute(
+                "SELECT user_id, reason, COUNT(*) FROM history "
+                "WHERE reason != '' GROUP BY user_id, reason"):
+            aggregates[uid]["reasons"][reason] = n
+        stats.load_json(aggregates)
+        for uid, counts in self.db.execute(
+                "SELECT user_id, counts FROM history_monthly"):
+            stats.merge(uid, json.loads(counts))
+
+    def append_history(self, uid, entry):
+        self._write(
+            "INSERT INTO history (user_id, date, available, reason, time) "
+            "VALUES (?, ?, ?, ?, ?)", (uid, entry.date.isoformat(),
+                                       entry.available.value, entry.reason,
+                                       entry.time))
+        if self.stats is not None:
+            self.stats.add(uid, entry)
+
+    @staticmethod
+    def _record(d, a, r, t):
+        return HistoryRecord.from_entry({
+            "date": d,
+            "available": a,
+            "reason": r,
+            "time": t
+        })
+
+    def history_rows(self):
+        for uid, d, a, r, t in self.db.execute(
+                "SELECT user_id, date, available, reason, time "
+                "FROM history_daily ORDER BY user_id, date"):
+            yield uid, self._record(d, a, r, t)
+        for uid, d, a, r, t in self.db.execute(
+                "SELECT user_id, date, available, reason, time FROM history "
+                "ORDER BY id"):
+            yield uid, self._record(d, a, r, t)
+
+    def history_for(self, uid, start=None, end=None):
+        bounds = (uid, start or "", end or "9999-12-31")
+        daily = self.db.execute(
+            "SELECT date, available, reason, time FROM history_daily "
+            "WHERE user_id = ? AND date >= ? AND date <= ? ORDER BY date",
+            bounds).fetchall()
+        rows = self.db.execute(
+            "SELECT date, available, reason, time FROM history "
+            "WHERE user_id = ? AND date >= ? AND date <= ? ORDER BY id",
+            bounds).fetchall()
+        return [self._record(d, a, r, t) for d, a, r, t in daily + rows]
+
+    def history_range(self, start, end, uid=None):
+        query = ("SELECT user_id, date, available, reason, time FROM {} "
+                 "WHERE date >= ? AND date <= ?")
+        params = [start, end]
+        if uid is not None:
+            query += " AND user_id = ?"
+            params.append(uid)
+        for table, order in (("history_daily", "user_id, date"),
+                             ("history", "id")):
+            for row_uid, d, a, r, t in self.db.execute(
+                    query.format(table) + f" ORDER BY {order}", params):
+                yield row_uid, self._record(d, a, r, t)
+
+    def roll_up_history(self, raw_before, daily_before):
+        # Raw rows before raw_before become monthly counters plus one
+        # daily row per member and day; daily rows before daily_before
+        # are dropped. The work runs with the other writes; the count
+        # returned is read now
+        moved = self.db.execute(
+            "SELECT (SELECT COUNT(*) FROM history WHERE date < ?) + "
+            "(SELECT COUNT(*) FROM history_daily WHERE date < ?)",
+            (raw_before, daily_before)).fetchone()[0]
+        if moved:
+            self._queue(
+                lambda db: self._roll_up(db, raw_before, daily_before))
+        return moved
+
+    def _roll_up(self, db, raw_before, daily_before):
+        rows = db.execute(
+            "SELECT user_id, date, available, reason, time FROM history "
+            "WHERE date < ? ORDER BY id", (raw_before, )).fetchall()
+        months, finals = {}, {}
+        for uid, d, a, r, t in rows:
+            record = self._record(d, a, r, t)
+            stats = months.get((uid, d[:7]))
+            if stats is None:
+                existing = db.execute(
+                    "SELECT counts FROM history_monthly "
+                    "WHERE user_id = ? AND month = ?", (uid, d[:7])).fetchone()
+                stats = months[(uid, d[:7])] = UserStats.from_json(
+                    json.loads(existing[0]) if existing else {})
+            stats.add(record.available, record.reason)
+            finals[(uid, d)] = record
+        db.executemany(
+            "INSERT OR REPLACE INTO history_monthly "
+            "(user_id, month, counts) VALUES (?, ?, ?)",
+            [(uid, month, json.dumps(stats.to_json()))
+             for (uid, month), stats in months.items()])
+        db.executemany(
+            "INSERT OR REPLACE INTO history_daily "
+            "(user_id, date, available, reason, time) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(uid, d, e.available.value, e.reason, e.time)
+             for (uid, d), e in finals.items()])
+        db.execute("DELETE FROM history WHERE date < ?", (raw_before, ))
+        db.execute("DELETE FROM history_daily WHERE date < ?",
+                   (daily_before, ))
+
+    def clear_history(self, uid=None):
+        for table in ("history", "history_daily", "history_monthly"):
+            if uid is None:
+                self._write(f"DELETE FROM {table}")
+            else:
+                self._write(f"DELETE FROM {table} WHERE user_id = ?", (uid, ))
+        if self.stats is not None:
+            if uid is None:
+                self.stats.clear()
+            else:
+                self.stats.remove_user(uid)
+
+    async def flush(self):
+        await self.writer.flush()
+
+    def file_sizes(self):
+        return {(os.path.basename(path), ): _tree_size(path)
+                for path in (self.path, self.path + "-wal")}
+
+    async def maintenance(self):
+        self._queue(lambda db: db.execute("PRAGMA wal_checkpoint(PASSIVE)"))
+
+    # --- live session ------------------------------------------------
+    # An empty session keeps its day as a row with no user
+
+    def load_session(self):
+        day, responses = None, {}
+        for uid, row_day, name, available, reason in self.db.execute(
+                "SELECT user_id, day, name, available, reason FROM session "
+                "ORDER BY rowid"):
+            day = max(day or row_day, row_day)
+            if uid:
+                responses[uid] = {
+                    "name": name,
+                    "available": available,
+                    "reason": reason
+                }
+        return day, responses
+
+    def session_set(self, day, uid, response):
+        self._write(
+            "INSERT OR REPLACE INTO session "
+            "(user_id, day, name, available, reason) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (uid, day, response["name"], response["available"],
+             response["reason"]))
+
+    def session_remove(self, uid):
+        self._write("DELETE FROM session WHERE user_id = ?", (uid, ))
+
+    def session_clear(self, day=None):
+        self._write("DELETE FROM session")
+        if day:
+            self._write(
+                "INSERT INTO session (user_id, day, name, available) "
+                "VALUES ('', ?, '', '')", (day, ))
+
+    # --- LOAs ----------------------------------------------------------
+
+    def load_loas(self):
+        loas = {}
+        for uid, start, end, reason in self.db.execute(
+                "SELECT user_id, start_date, end_date, reason FROM loas "
+                "ORDER BY id"):
+            loas.setdefault(uid, []).append({
+                "start": start,
+                "end": end,
+                "reason": reason
+            })
+        return loas
+
+    def add_loa(self, uid, record):
+        self._write(
+            "INSERT INTO loas (user_id, start_date, end_date, reason) "
+            "VALUES (?, ?, ?, ?)",
+            (uid, record["start"], record["end"], record["reason"]))
+
+    def remove_loas(self, pairs):
+        for uid, record in pairs:
+            self._write(
+                "DELETE FROM loas WHERE id = (SELECT id FROM loas "
+                "WHERE user_id = ? AND start_date = ? AND end_date = ? "
+                "AND reason = ? LIMIT 1)",
+                (uid, record["start"], record["end"], record["reason"]))
+
+    def remove_user_loas(self, uid):
+        self._write("DELETE FROM loas WHERE user_id = ?", (uid, ))
+
+    def clear_loas(self):
+        self._write("DELETE FROM loas")
+
+    def load_ended_loas(self):
+        loas = {}
+        for uid, start, end, reason in self.db.execute(
+                "SELECT user_id, start_date, end_date, reason FROM loas_ended "
+                "ORDER BY id"):
+            loas.setdefault(uid, []).append({
+                "start": start,
+                "end": end,
+                "reason": reason
+            })
+        return loas
+
+    def end_loas(self, pairs):
+        self.remove_loas(pairs)
+        self._write_many(
+            "INSERT INTO loas_ended (user_id, start_date, end_date, reason) "
+            "VALUES (?, ?, ?, ?)",
+            [(uid, r["start"], r["end"], r["reason"]) for uid, r in pairs])
+
+    def clear_ended_loas(self, uid=None):
+        if uid is None:
+            self._write("DELETE FROM loas_ended")
+        else:
+            self._write("DELETE FROM loas_ended WHERE user_id = ?", (uid, ))
+
+    # --- archive -------------------------------------------------------
+
+    def save_archive(self, day, responses):
+        self._write("DELETE FROM archive WHERE day = ?", (day, ))
+        self._write_many(
+            "INSERT INTO archive (day, user_id, name, available, reason) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(day, uid, r["name"], r["available"], r["reason"])
+             for uid, r in responses.items()])
+
+    def load_archive(self, day):
+        rows = self.db.execute(
+            "SELECT user_id, name, available, reason FROM archive "
+            "WHERE day = ?", (day, ))
+        return {
+            uid: {
+                "name": name,
+                "available": available,
+                "reason": reason
+            }
+            for uid, name, available, reason in rows
+        }
+
+    def archive_days(self):
+        return [
+            day for day, in self.db.execute(
+                "SELECT DISTINCT day FROM archive ORDER BY day")
+        ]
+
+    def archive_range(self, start, end, uid=None, available=None):
+        query = ("SELECT day, user_id, name, available, reason FROM archive "
+                 "WHERE day BETWEEN ? AND ?")
+        params = [start, end]
+        if uid is not None:
+            query += " AND user_id = ?"
+            params.append(uid)
+        if available is not None:
+            query += " AND available = ?"
+            params.append(available)
+        for day, record_uid, name, record_available, reason in self.db.execute(
+                query + " ORDER BY day, user_id", params):
+            yield day, record_uid, {
+                "name": name,
+                "available": record_available,
+                "reason": reason
+            }
+
+    def clear_archives(self):
+        self._write("DELETE FROM archive")
+
+
+def import_json(source, target):
+    # Copy everything from a JsonStorage into an empty-or-stale SqliteStorage
+    db = target.db
+    with db:
+        for table in ("settings", "history", "history_daily",
+                      "history_monthly", "loas", "loas_ended", "archive",
+                      "session",
+                      "messages", "job_runs", "member_names"):
+            db.execute(f"DELETE FROM {table}")
+    settings = source.load_settings(None)
+    if settings:
+        target.save_settings(settings)
+    target.save_message_ids(source.load_message_ids())
+    target.save_scheduler_state(source.load_scheduler_state())
+    for uid, name in source.load_member_names().items():
+        target.save_member_name(uid, name)
+    source.history.load(writable=False)
+    with db:
+        db.executemany(
+            "INSERT INTO history (user_id, date, available, reason, time) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(uid, e.date.isoformat(), e.available.value, e.reason, e.time)
+             for uid, entries in source.history.items() for e in entries])
+        db.executemany(
+            "INSERT INTO history_daily "
+            "(user_id, date, available, reason, time) VALUES (?, ?, ?, ?, ?)",
+            [(uid, e.date.isoformat(), e.available.value, e.reason, e.time)
+             for uid, entries in source.history.daily.items()
+             for e in entries])
+        db.executemany(
+            "INSERT INTO history_monthly (user_id, month, counts) "
+            "VALUES (?, ?, ?)",
+            [(uid, month, json.dumps(counts))
+             for uid, months in source.history.monthly.items()
+             for month, counts in months.items()])
+        db.executemany(
+            "INSERT INTO loas (user_id, start_date, end_date, reason) "
+            "VALUES (?, ?, ?, ?)",
+            [(uid, r["start"], r["end"], r.get("reason", ""))
+             for uid, records in source.load_loas().items()
+             for r in records])
+        db.executemany(
+            "INSERT INTO loas_ended (user_id, start_date, end_date, reason) "
+            "VALUES (?, ?, ?, ?)",
+            [(uid, r["start"], r["end"], r.get("reason", ""))
+             for uid, records in source.load_ended_loas().items()
+             for r in records])
+    for day in source.archive_days():
+        target.save_archive(day, source.load_archive(day))
+    day, responses = source.load_session()
+    target.session_clear(day)
+    for uid, response in responses.items():
+        target.session_set(day, uid, response)
+
+
+def guild_folder(guild_id):
+    return "" if guild_id == HOME_GUILD_ID else os.path.join(
+        GUILDS_DIR, str(guild_id))
+
+
+def json_storage(folder, writer=None):
+    return JsonStorage(*(os.path.join(folder, name)
+                         for name in (SETTINGS_FILE, HISTORY_DIR,
+                                      HISTORY_FILE, LOA_FILE, ARCHIVE_FOLDER,
+                                      MESSAGE_IDS_FILE, SCHEDULER_FILE,
+                                      SESSION_DIR, MEMBER_NAMES_FILE,
+                                      ENDED_LOA_FILE)),
+                       writer=writer)
+
+
+def open_guild_storage(guild_id, writer=None, engine=None):
+    folder = guild_folder(guild_id)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    if (engine or STORAGE_ENGINE) == "sqlite":
+        return SqliteStorage(os.path.join(folder, DATABASE_FILE), writer)
+    return json_storage(folder, writer)
+
+
+def _take_lock():
+    # The open lock file if no other process holds LOCK_FILE, else None.
+    # The OS releases the lock when its holder exits, even after a crash
+    lock = open(LOCK_FILE, 'a+')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    lock.seek(0)
+    lock.truncate()
+    lock.write(str(os.getpid()))
+    lock.flush()
+    return lock
+
+
+def _holder():
+    try:
+        with open(LOCK_FILE, 'r') as f:
+            return f.read().strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def lock_data():
+    # Taken by the bot at startup and held until the process exits
+    global _lock
+    _lock = _take_lock()
+    if _lock is None:
+        raise RuntimeError(
+            f"the data is in use by another process (PID {_holder()})")
+
+
+def refuse_if_bot_running():
+    # Offline tools write the bot's files directly, so never alongside
+    # it; the lock is held until the tool exits, so the bot cannot start
+    # halfway through either
+    global _lock
+    _lock = _take_lock()
+    if _lock is None:
+        print(f"The bot is running (PID {_holder()}); stop it before "
+              f"running this tool.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        print("Usage: python storage.py import [database]")
+        sys.exit(1)
+    refuse_if_bot_running()
+    # The home guild lives at the top level, other guilds in GUILDS_DIR
+    folders = [""]
+    if os.path.isdir(GUILDS_DIR):
+        folders += [os.path.join(GUILDS_DIR, name)
+                    for name in sorted(os.listdir(GUILDS_DIR))]
+    for folder in folders:
+        database = os.path.join(folder, DATABASE_FILE)
+        if not folder and len(sys.argv) > 2:
+            database = sys.argv[2]
+        target = SqliteStorage(database)
+        import_json(json_storage(folder), target)
+        print(f"Imported JSON data into {target.path}")
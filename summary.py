@@ -0,0 +1,47 @@
+"""Turf summary buckets kept up to date as responses arrive."""
+
+
+BUCKETS = ("yes", "yes_later", "no")
+
+
+class SummaryBoard:
+
+    def __init__(self):
+        self.buckets = {name: {} for name in BUCKETS}
+        self._bucket_of = {}
+
+    def set(self, uid, name, available, reason):
+        self.remove(uid)
+        if available == "yes":
+            line = name
+        elif available == "yes_later":
+            line = f"⏰ **{name}** – {reason}"
+        elif available == "no":
+            line = f"❌ **{name}** – {reason}"
+        else:
+            return
+        self.buckets[available][uid] = line
+        self._bucket_of[uid] = available
+
+    def remove(self, uid):
+        bucket = self._bucket_of.pop(uid, None)
+        if bucket:
+            del self.buckets[bucket][uid]
+
+    def clear(self):
+        for bucket in self.buckets.values():
+            bucket.clear()
+        self._bucket_of.clear()
+
+    def render(self, day):
+        yes_list = list(self.buckets["yes"].values())
+        yes_later_list = list(self.buckets["yes_later"].values())
+        no_list = list(self.buckets["no"].values())
+        summary = f"📋 **Turf Availability Summary** ({day.strftime('%d/%m/%Y')})\n\n"
+        summary += f"✅ **Yes ({len(yes_list)}):**\n" + (
+            ", ".join(yes_list) if yes_list else "None") + "\n\n"
+        summary += f"⏰ **Yes but later ({len(yes_later_list)}):**\n" + (
+            "\n".join(yes_later_list) if yes_later_list else "None") + "\n\n"
+        summary += f"❌ **No ({len(no_list)}):**\n" + ("\n".join(no_list)
+                                                      if no_list else "None")
+        return summary
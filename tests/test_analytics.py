@@ -0,0 +1,96 @@
+from datetime import date, timedelta
+
+from analytics import AttendanceBitmaps
+from records import Availability, HistoryRecord
+
+Y, N = Availability.YES, Availability.NO
+TODAY = date(2026, 10, 17)
+
+
+class LOA:
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+
+def answer(bitmaps, uid, days_ago, available):
+    day = TODAY - timedelta(days=days_ago)
+    bitmaps.add(uid, HistoryRecord(day.toordinal(), available))
+
+
+def test_last_answer_of_a_day_wins():
+    bitmaps = AttendanceBitmaps()
+    answer(bitmaps, "1", 1, N)
+    answer(bitmaps, "1", 1, Y)
+    assert bitmaps.window("1", TODAY, 7) == (1, 1)
+
+
+def test_windows_count_turf_days_held_by_anyone():
+    bitmaps = AttendanceBitmaps()
+    for days_ago in range(10):
+        answer(bitmaps, "2", days_ago, Y)
+    answer(bitmaps, "1", 1, Y)
+    answer(bitmaps, "1", 8, Y)
+    assert bitmaps.window("1", TODAY, 7) == (1, 7)
+    assert bitmaps.window("1", TODAY, 30) == (2, 10)
+    assert bitmaps.window("1", TODAY, 7, offset=7) == (1, 3)
+    assert bitmaps.rate("3", TODAY, 7) is None
+    assert bitmaps.active(TODAY, 7) == ["2", "1"]
+
+
+def test_loa_days_are_left_out():
+    bitmaps = AttendanceBitmaps()
+    for days_ago in range(7):
+        answer(bitmaps, "2", days_ago, Y)
+    answer(bitmaps, "1", 0, Y)
+    bitmaps.add_loa("1", LOA(TODAY - timedelta(days=6),
+                             TODAY - timedelta(days=1)))
+    assert bitmaps.window("1", TODAY, 7) == (1, 1)
+    bitmaps.remove_loa("1", LOA(TODAY - timedelta(days=6),
+                                TODAY - timedelta(days=1)))
+    assert bitmaps.window("1", TODAY, 7) == (1, 7)
+
+
+def test_loa_without_answers_leaves_no_member_behind():
+    bitmaps = AttendanceBitmaps()
+    bitmaps.add_loa("1", LOA(TODAY, TODAY))
+    assert "1" in bitmaps.members
+    bitmaps.clear_loas()
+    assert "1" not in bitmaps.members
+
+
+def test_streaks_skip_loa_days():
+    bitmaps = AttendanceBitmaps()
+    for days_ago in range(8):
+        answer(bitmaps, "2", days_ago, Y)
+    for days_ago in (7, 6, 5):
+        answer(bitmaps, "1", days_ago, Y)
+    answer(bitmaps, "1", 4, N)
+    for days_ago in (2, 1):
+        answer(bitmaps, "1", days_ago, Y)
+    bitmaps.add_loa("1", LOA(TODAY - timedelta(days=3),
+                             TODAY - timedelta(days=3)))
+    # Today is unanswered, so it does not break the streak yet
+    assert bitmaps.current_streak("1", TODAY) == 2
+    assert bitmaps.longest_streak("1", TODAY) == 3
+    answer(bitmaps, "1", 0, Y)
+    assert bitmaps.current_streak("1", TODAY) == 3
+
+
+def test_unanswered_turf_day_breaks_the_streak():
+    bitmaps = AttendanceBitmaps()
+    for days_ago in range(4):
+        answer(bitmaps, "2", days_ago, Y)
+    answer(bitmaps, "1", 3, Y)
+    answer(bitmaps, "1", 1, Y)
+    assert bitmaps.current_streak("1", TODAY) == 1
+    assert bitmaps.longest_streak("1", TODAY) == 1
+
+
+def test_trend_compares_consecutive_weeks():
+    bitmaps = AttendanceBitmaps()
+    for days_ago in range(14):
+        answer(bitmaps, "1", days_ago, Y if days_ago < 7 else N)
+    assert bitmaps.trend("1", TODAY) == 100
+    assert bitmaps.roster_rate(TODAY, 14) == 50
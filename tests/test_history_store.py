@@ -0,0 +1,103 @@
+from datetime import date
+
+from history_store import HistoryStore
+from records import Availability, HistoryRecord
+from stats import AttendanceStats
+
+
+def day(text):
+    return date.fromisoformat(text).toordinal()
+
+
+def record(text, available=Availability.YES, reason="", seconds=72000):
+    return HistoryRecord(day(text), available, reason, seconds)
+
+
+def open_store(tmp_path, **kwargs):
+    store = HistoryStore(str(tmp_path / "history"),
+                         stats=AttendanceStats(0), **kwargs)
+    store.load()
+    return store
+
+
+def dump(store, uid):
+    return [(r.day, r.available, r.reason, r.seconds)
+            for r in store.records_for(uid)]
+
+
+def test_appends_replay_after_restart(tmp_path):
+    store = open_store(tmp_path)
+    store.append("1", record("2026-10-01"))
+    store.append("1", record("2026-10-02", Availability.NO, "work"))
+    store.append("2", record("2026-10-02", Availability.YES_LATER))
+
+    reloaded = open_store(tmp_path)
+    assert dump(reloaded, "1") == dump(store, "1")
+    assert dump(reloaded, "2") == dump(store, "2")
+    assert reloaded.stats.get("1").yes == 1
+    assert reloaded.stats.get("1").no == 1
+
+
+def test_torn_tail_is_skipped(tmp_path):
+    store = open_store(tmp_path)
+    store.append("1", record("2026-10-01"))
+    path = store._segment_path(store._segment_index)
+    store._segment.close()
+    with open(path, 'a') as f:
+        f.write('{"op":"add","uid":"2","r":[7')
+
+    reloaded = open_store(tmp_path)
+    assert len(reloaded.entries_for("1")) == 1
+    assert "2" not in reloaded.entries
+    # Appends after the crash go to a fresh segment and survive
+    reloaded.append("3", record("2026-10-02"))
+    assert len(open_store(tmp_path).entries_for("3")) == 1
+
+
+def test_clear_user_is_journaled(tmp_path):
+    store = open_store(tmp_path)
+    store.append("1", record("2026-10-01"))
+    store.append("2", record("2026-10-01"))
+    store.clear_user("1")
+
+    reloaded = open_store(tmp_path)
+    assert "1" not in reloaded.entries
+    assert reloaded.stats.get("1") is None
+    assert len(reloaded.entries_for("2")) == 1
+
+
+def test_roll_up_keeps_counts_and_final_states(tmp_path):
+    store = open_store(tmp_path)
+    store.append("1", record("2026-08-01", Availability.NO, "late"))
+    store.append("1", record("2026-08-01", Availability.YES))
+    store.append("1", record("2026-08-02", Availability.NO, "sick"))
+    store.append("1", record("2026-10-01"))
+
+    moved = store.roll_up(day("2026-09-01"), day("2026-08-02"))
+    # Three raw rows rolled up, then the 08-01 daily row dropped
+    assert moved == 4
+    assert [r.date.isoformat() for r in store.records_for("1")] == [
+        "2026-08-02", "2026-10-01"
+    ]
+    assert store.monthly["1"]["2026-08"]["total"] == 3
+    assert store.stats.get("1").total == 4
+
+    reloaded = open_store(tmp_path)
+    assert dump(reloaded, "1") == dump(store, "1")
+    assert reloaded.monthly == store.monthly
+    assert reloaded.stats.get("1").total == 4
+
+
+def test_compaction_replays_each_record_once(tmp_path):
+    store = open_store(tmp_path, segment_max_bytes=64)
+    for i in range(1, 6):
+        store.append("1", record(f"2026-10-{i:02d}"))
+    assert store.needs_compaction()
+    args = store.begin_compaction()
+    store.write_compaction(*args)
+    store.end_compaction(*args)
+    store.append("1", record("2026-10-06"))
+
+    reloaded = open_store(tmp_path)
+    assert len(reloaded.entries_for("1")) == 6
+    assert reloaded.stats.get("1").total == 6
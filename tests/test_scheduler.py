@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import scheduler
+from scheduler import DailyAt, Scheduler
+
+
+LONDON = ZoneInfo("Europe/London")
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class MemoryStore:
+
+    def __init__(self, state=None):
+        self.state = dict(state or {})
+
+    def load_scheduler_state(self):
+        return dict(self.state)
+
+    def save_scheduler_state(self, state):
+        self.state.update(state)
+
+
+def test_daily_at_follows_dst():
+    when = DailyAt(lambda: (20, 0), LONDON)
+    # BST (UTC+1) until the last Sunday of October, GMT after
+    assert when.next_after(utc(2026, 10, 24, 12)) == utc(2026, 10, 24, 19)
+    assert when.next_after(utc(2026, 10, 25, 12)) == utc(2026, 10, 25, 20)
+    assert when.previous_before(utc(2026, 10, 25, 12)) == utc(
+        2026, 10, 24, 19)
+
+
+def test_daily_at_rereads_time_and_zone():
+    settings = {"time": (20, 0), "tz": timezone.utc}
+    when = DailyAt(lambda: settings["time"], lambda: settings["tz"])
+    now = utc(2026, 10, 17, 12)
+    assert when.next_after(now) == utc(2026, 10, 17, 20)
+    settings["time"] = (9, 30)
+    assert when.next_after(now) == utc(2026, 10, 18, 9, 30)
+    settings["tz"] = ZoneInfo("Pacific/Auckland")
+    # 09:30 NZDT is 20:30 UTC the day before
+    assert when.next_after(now) == utc(2026, 10, 17, 20, 30)
+
+
+def test_missed_run_within_grace_is_caught_up(monkeypatch):
+    now = utc(2026, 10, 17, 20, 30)
+    monkeypatch.setattr(scheduler, "utcnow", lambda: now)
+    store = MemoryStore({"daily": utc(2026, 10, 16, 20).isoformat()})
+    jobs = Scheduler(store)
+    jobs.add("daily", DailyAt(lambda: (20, 0), timezone.utc), None,
+             grace=timedelta(hours=1))
+    jobs.add("late", DailyAt(lambda: (20, 0), timezone.utc), None,
+             grace=timedelta(minutes=10))
+    store.state["late"] = store.state["daily"]
+    jobs._catch_up()
+    assert jobs.jobs["daily"].due == utc(2026, 10, 17, 20)
+    assert jobs.jobs["late"].due == utc(2026, 10, 18, 20)
+
+
+def test_job_without_last_run_waits_for_its_deadline(monkeypatch):
+    monkeypatch.setattr(scheduler, "utcnow",
+                        lambda: utc(2026, 10, 17, 20, 30))
+    jobs = Scheduler(MemoryStore())
+    jobs.add("daily", DailyAt(lambda: (20, 0), timezone.utc), None,
+             grace=timedelta(days=1))
+    jobs._catch_up()
+    assert jobs.jobs["daily"].due == utc(2026, 10, 18, 20)
+
+
+def test_run_records_last_run_in_the_jobs_store(monkeypatch):
+    now = utc(2026, 10, 17, 20, 30)
+    monkeypatch.setattr(scheduler, "utcnow", lambda: now)
+    shared, own = MemoryStore(), MemoryStore()
+    jobs = Scheduler(shared)
+    ran = []
+
+    async def callback():
+        ran.append(True)
+
+    jobs.add("guild", DailyAt(lambda: (20, 0), timezone.utc), callback,
+             store=own)
+    asyncio.run(jobs._run(jobs.jobs["guild"], utc(2026, 10, 17, 20)))
+    assert ran == [True]
+    assert own.state == {"guild": utc(2026, 10, 17, 20).isoformat()}
+    assert shared.state == {}
+    assert jobs.jobs["guild"].due == utc(2026, 10, 18, 20)
+
+
+def test_failing_job_is_still_rescheduled(monkeypatch):
+    monkeypatch.setattr(scheduler, "utcnow",
+                        lambda: utc(2026, 10, 17, 20, 30))
+    jobs = Scheduler(MemoryStore())
+
+    async def callback():
+        raise RuntimeError("boom")
+
+    jobs.add("daily", DailyAt(lambda: (20, 0), timezone.utc), callback)
+    asyncio.run(jobs._run(jobs.jobs["daily"], utc(2026, 10, 17, 20)))
+    assert jobs.jobs["daily"].due == utc(2026, 10, 18, 20)
@@ -0,0 +1,67 @@
+from session_store import JOURNAL_FILE, SEALED_FILE, SessionStore
+
+
+def response(name, available="yes", reason=""):
+    return {"name": name, "available": available, "reason": reason}
+
+
+def open_store(tmp_path):
+    store = SessionStore(str(tmp_path / "session"))
+    return store, store.load()
+
+
+def test_changes_survive_restart(tmp_path):
+    store, _ = open_store(tmp_path)
+    store.set("2026-10-17", "1", response("A"))
+    store.set("2026-10-17", "2", response("B", "no", "work"))
+    store.remove("1")
+    store.set("2026-10-17", "3", response("C"))
+
+    _, (day, responses) = open_store(tmp_path)
+    assert day == "2026-10-17"
+    assert list(responses) == ["2", "3"]
+    assert responses["2"]["reason"] == "work"
+
+
+def test_clear_keeps_the_new_day(tmp_path):
+    store, _ = open_store(tmp_path)
+    store.set("2026-10-16", "1", response("A"))
+    store.clear("2026-10-17")
+
+    _, (day, responses) = open_store(tmp_path)
+    assert day == "2026-10-17"
+    assert responses == {}
+
+
+def test_torn_tail_does_not_swallow_the_next_record(tmp_path):
+    store, _ = open_store(tmp_path)
+    store.set("2026-10-17", "1", response("A"))
+    store._journal.close()
+    with open(tmp_path / "session" / JOURNAL_FILE, 'a') as f:
+        f.write('{"op":"set","day":"2026-10-17","uid":"2","resp')
+
+    store, (_, responses) = open_store(tmp_path)
+    assert list(responses) == ["1"]
+    store.set("2026-10-17", "3", response("C"))
+
+    _, (_, responses) = open_store(tmp_path)
+    assert list(responses) == ["1", "3"]
+
+
+def test_interrupted_compaction_is_replayed(tmp_path):
+    store, _ = open_store(tmp_path)
+    store.set("2026-10-17", "1", response("A"))
+    snapshot = store.begin_compaction()
+    store.set("2026-10-17", "2", response("B"))
+    # Crash before the snapshot is written: the sealed journal remains
+    assert (tmp_path / "session" / SEALED_FILE).exists()
+
+    store, (_, responses) = open_store(tmp_path)
+    assert list(responses) == ["1", "2"]
+    snapshot = store.begin_compaction()
+    store.write_snapshot(snapshot)
+    store.end_compaction()
+    assert not (tmp_path / "session" / SEALED_FILE).exists()
+
+    _, (_, responses) = open_store(tmp_path)
+    assert list(responses) == ["1", "2"]
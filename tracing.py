@@ -0,0 +1,202 @@
+"""Per-interaction span tracing with a rotating slow log.
+
+A trace covers one slash command, modal submit or component callback
+and collects timed spans for the storage calls, state mutations and
+Discord REST calls made on its behalf. The active trace lives in a
+context variable, so it follows the handler across awaits. Long-lived
+workers (the mutation queue, the outbound queue) call detach() so they
+do not inherit the trace of whichever handler started them, and record
+the work they do for a caller into the trace captured at submit time.
+Traces slower than the threshold are appended as one JSON line each to
+a size-rotated slow log.
+"""
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+
+SLOW_SECONDS = 1.0
+MAX_SPANS = 200  # per trace; later spans are only counted
+LOG_MAX_BYTES = 1_000_000
+LOG_BACKUPS = 3
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    __slots__ = ("kind", "name", "attrs", "started_at", "start", "spans",
+                 "dropped", "done")
+
+    def __init__(self, kind, name, attrs):
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        self.done = False
+
+    def add(self, name, start, seconds, attrs=None):
+        # start is a perf_counter() reading; spans that end after the
+        # trace has finished are ignored
+        if self.done:
+            return
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append((name, start - self.start, seconds, attrs))
+
+    def to_json(self, seconds, error):
+        spans = []
+        for name, offset, span_seconds, attrs in self.spans:
+            span = {
+                "name": name,
+                "at": round(offset, 6),
+                "seconds": round(span_seconds, 6)
+            }
+            if attrs:
+                span.update(attrs)
+            spans.append(span)
+        record = {
+            "at": self.started_at.isoformat(timespec="milliseconds"),
+            "kind": self.kind,
+            "name": self.name,
+            "seconds": round(seconds, 6),
+            **self.attrs
+        }
+        if error:
+            record["error"] = error
+        record["spans"] = spans
+        if self.dropped:
+            record["dropped_spans"] = self.dropped
+        return record
+
+
+def current():
+    return _current.get()
+
+
+def detach():
+    # For long-lived tasks: forget the trace inherited from their creator
+    _current.set(None)
+
+
+@contextlib.contextmanager
+def activate(trace):
+    # Runs the block as part of trace (None leaves no trace active)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start, attrs)
+
+
+def _timed(name, fn):
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            trace.add(name, start, time.perf_counter() - start)
+
+    return wrapper
+
+
+def traced(prefix):
+    # Class decorator: every public plain method becomes a span named
+    # prefix.method. Generators, coroutines and already-wrapped methods
+    # (context managers) are left alone, as timing the call would only
+    # time their creation
+    def decorate(cls):
+        for name, fn in list(vars(cls).items()):
+            if (name.startswith("_") or not inspect.isfunction(fn)
+                    or inspect.isgeneratorfunction(fn)
+                    or inspect.iscoroutinefunction(fn)
+                    or hasattr(fn, "__wrapped__")):
+                continue
+            setattr(cls, name, _timed(f"{prefix}.{name}", fn))
+        return cls
+
+    return decorate
+
+
+class SlowLog:
+    """Appends JSON lines to path, rotating to path.1 .. path.N by size."""
+
+    def __init__(self, path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def write(self, record):
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        try:
+            if (os.path.exists(self.path) and
+                    os.path.getsize(self.path) + len(line) > self.max_bytes):
+                self._rotate()
+            with open(self.path, 'a') as f:
+                f.write(line)
+        except OSError as e:
+            print(f"Error writing slow log {self.path}: {e}")
+
+
+class Tracer:
+
+    def __init__(self, slow_log, threshold=SLOW_SECONDS, observer=None):
+        # observer(kind, name, seconds) is called for every slow trace
+        self.slow_log = slow_log
+        self.threshold = threshold
+        self.observer = observer
+
+    @contextlib.contextmanager
+    def trace(self, kind, name, **attrs):
+        trace = Trace(kind, name, attrs)
+        token = _current.set(trace)
+        error = None
+        try:
+            yield trace
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            trace.done = True
+            seconds = time.perf_counter() - trace.start
+            if seconds >= self.threshold:
+                self.slow_log.write(trace.to_json(seconds, error))
+                if self.observer:
+                    self.observer(kind, name, seconds)